@@ -1,10 +1,39 @@
 __version__: str = "0.1.0"
-import aggregator.config  # noqa
-import aggregator.convert  # noqa
-import aggregator.db  # noqa
-import aggregator.extract  # noqa
-import aggregator.helper  # noqa
-import aggregator.logs  # noqa
-import aggregator.main  # noqa
-import aggregator.model  # noqa
-import aggregator.view  # noqa
+
+# Submodules load on first access (aggregator.db, from aggregator import db)
+# rather than with the package, so the cli only pays for what it runs
+import importlib
+from types import ModuleType
+
+SUBMODULES: list[str] = [
+    "anomaly",
+    "cache",
+    "checkpoint",
+    "cli",
+    "config",
+    "convert",
+    "db",
+    "export",
+    "extract",
+    "helper",
+    "logs",
+    "main",
+    "model",
+    "parsers",
+    "retention",
+    "server",
+    "spill",
+    "tail",
+    "view",
+    "watch",
+]
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name in SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(list(globals()) + SUBMODULES)
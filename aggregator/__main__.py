@@ -0,0 +1,13 @@
+"""
+Module Name: __main__.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: runs the aggregator command line as python -m aggregator
+"""
+
+import sys
+
+from aggregator.cli import run
+
+sys.exit(run())
@@ -0,0 +1,282 @@
+"""
+Module Name: anomaly.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: anomaly flags bursts of errors as logs are ingested, so spikes
+show up as alerts instead of being found by hand.
+
+Converted records are fed to a SpikeDetector. Records of the watched
+severities are counted per node in fixed windows of log time, & per
+message template within the window in a count-min sketch, so memory is
+bounded however many templates there are. Each record costs one
+template lookup & depth counter updates.
+
+When a node's window closes its count is compared to an EWMA of the
+node's earlier windows, & each template that reached min_count to an
+EWMA'd sketch of its earlier counts. Counts more than threshold spreads
+(the EWMA standard deviation, at least the Poisson sqrt of the mean)
+over what was expected become alerts, once a node has warmup windows of
+history; the first window seeds it. Windows without errors count as
+zero. A detector expects its records in time order, so each log stream
+(a node's log & its rolled files, read oldest first) gets its own from
+StreamDetectors, kept for the run so its history carries from one file
+to the next; records from a window that has already closed are dropped
+& counted in late. Alerts name their stream, so two streams of a node
+flagging the same window do not overwrite each other.
+Classes: CountMinSketch, SpikeDetector, StreamDetectors
+Functions: fromSettings
+"""
+
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import Any, Hashable, Iterable
+
+from aggregator.config import Settings
+from aggregator.helper import message_template
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Gaps longer than this many windows decay the node's history to nothing
+EMPTY_WINDOW_LIMIT: int = 1000
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 1024, depth: int = 4) -> None:
+        self.width: int = width
+        self.depth: int = depth
+        self.rows: list[list[float]] = [[0.0] * width for _ in range(depth)]
+
+    def _cells(self, key: Hashable) -> list[int]:
+        return [hash((row, key)) % self.width for row in range(self.depth)]
+
+    def add(self, key: Hashable, count: float = 1.0) -> float:
+        # Count key & return its new estimate
+        estimate: float = math.inf
+        for row, cell in zip(self.rows, self._cells(key)):
+            row[cell] += count
+            estimate = min(estimate, row[cell])
+        return estimate
+
+    def estimate(self, key: Hashable) -> float:
+        # At least the true count, over by a share of the other keys'
+        return min(row[cell] for row, cell in zip(self.rows, self._cells(key)))
+
+    def blend(self, other: "CountMinSketch", alpha: float) -> None:
+        # Move every counter alpha of the way to other's (an EWMA step)
+        self.rows = [
+            [(1 - alpha) * mine + alpha * theirs for mine, theirs in zip(row, new)]
+            for row, new in zip(self.rows, other.rows)
+        ]
+
+    def scale(self, factor: float) -> None:
+        self.rows = [[value * factor for value in row] for row in self.rows]
+
+    def clear(self) -> None:
+        self.rows = [[0.0] * self.width for _ in range(self.depth)]
+
+
+class NodeWindow:
+    # A node's open window & the history it is judged against
+    def __init__(self, start: datetime, width: int, depth: int) -> None:
+        self.start: datetime = start
+        self.count: int = 0
+        self.current: CountMinSketch = CountMinSketch(width, depth)
+        self.candidates: set[str] = set()
+        self.mean: float = 0.0
+        self.var: float = 0.0
+        self.baseline: CountMinSketch = CountMinSketch(width, depth)
+        self.windows: int = 0
+
+
+class SpikeDetector:
+    def __init__(
+        self,
+        window: float = 60.0,
+        alpha: float = 0.1,
+        threshold: float = 4.0,
+        min_count: int = 10,
+        warmup: int = 5,
+        severities: Iterable[str] = ("ERROR",),
+        width: int = 1024,
+        depth: int = 4,
+        max_candidates: int = 100,
+        stream: str | None = None,
+    ) -> None:
+        self.window: timedelta = timedelta(seconds=window)
+        self.alpha: float = alpha
+        self.threshold: float = threshold
+        self.min_count: int = min_count
+        self.warmup: int = warmup
+        self.severities: frozenset[str] = frozenset(severities)
+        self.width: int = width
+        self.depth: int = depth
+        self.max_candidates: int = max_candidates
+        self.stream: str | None = stream
+        self.nodes: dict[str, NodeWindow] = {}
+        self.alerts: list[dict[str, Any]] = []
+        self.late: int = 0
+
+    def _window_start(self, timestamp: datetime) -> datetime:
+        # Windows are aligned to datetime.min so every node's line up
+        return datetime.min + self.window * ((timestamp - datetime.min) // self.window)
+
+    def observe(self, log: Any) -> None:
+        if log.severity not in self.severities:
+            return
+        start: datetime = self._window_start(log.datetime)
+        node: NodeWindow | None = self.nodes.get(log.node)
+        if node is None:
+            node = NodeWindow(start, self.width, self.depth)
+            self.nodes[log.node] = node
+        elif start > node.start:
+            self._close(log.node, node, start)
+        elif start < node.start:
+            # Its window was already judged
+            self.late += 1
+            return
+        node.count += 1
+        template: str = message_template(log.message)
+        if node.current.add(template) >= self.min_count and (
+            len(node.candidates) < self.max_candidates
+        ):
+            node.candidates.add(template)
+
+    def observe_batch(self, logs: Iterable[Any]) -> None:
+        for log in logs:
+            self.observe(log)
+
+    def _alert(
+        self,
+        name: str,
+        node: NodeWindow,
+        template: str | None,
+        count: float,
+        expected: float,
+        spread: float,
+    ) -> None:
+        # Queue an alert when count is more than threshold spreads over
+        # what was expected
+        score: float = (count - expected) / spread
+        if count < self.min_count or score <= self.threshold:
+            return
+        self.alerts.append(
+            {
+                "node": name,
+                "stream": self.stream,
+                "window_start": node.start,
+                "window_end": node.start + self.window,
+                "severities": sorted(self.severities),
+                "template": template,
+                "logs": int(count),
+                "expected": round(expected, 2),
+                "score": round(score, 2),
+                "detected": datetime.now(),
+            }
+        )
+        of: str = "" if template is None else f" for {template}"
+        logger.warning(
+            f"Spike of {int(count)} {'/'.join(sorted(self.severities))} logs on "
+            f"{name} from {node.start} ({expected:.1f} expected){of}"
+        )
+
+    def _check(self, name: str, node: NodeWindow) -> None:
+        # Judge the open window against the node's history
+        if node.windows < self.warmup:
+            return
+        self._alert(
+            name,
+            node,
+            None,
+            node.count,
+            node.mean,
+            math.sqrt(max(node.var, node.mean, 1.0)),
+        )
+        for template in node.candidates:
+            expected: float = node.baseline.estimate(template)
+            self._alert(
+                name,
+                node,
+                template,
+                node.current.estimate(template),
+                expected,
+                math.sqrt(max(expected, 1.0)),
+            )
+
+    def _update(self, node: NodeWindow, count: float) -> None:
+        # EWMA step of the node's mean & variance
+        diff: float = count - node.mean
+        increment: float = self.alpha * diff
+        node.mean += increment
+        node.var = (1 - self.alpha) * (node.var + diff * increment)
+
+    def _close(self, name: str, node: NodeWindow, next_start: datetime) -> None:
+        # Close the open window, folding it & any empty windows after it
+        # into the history, & open the one starting at next_start
+        self._check(name, node)
+        if node.windows:
+            self._update(node, node.count)
+            node.baseline.blend(node.current, self.alpha)
+        else:
+            # The first window seeds the history rather than being averaged
+            # with zeros, so a steady rate is not a spike once warmed up
+            node.mean = node.count
+            node.baseline.blend(node.current, 1.0)
+        empty: int = (next_start - node.start) // self.window - 1
+        for _ in range(min(empty, EMPTY_WINDOW_LIMIT)):
+            self._update(node, 0)
+        if empty:
+            node.baseline.scale((1 - self.alpha) ** min(empty, EMPTY_WINDOW_LIMIT))
+        node.windows += 1 + empty
+        node.start = next_start
+        node.count = 0
+        node.current.clear()
+        node.candidates.clear()
+
+    def flush(self) -> None:
+        # Judge the open windows, e.g. at the end of an ingest; they stay
+        # open for any later records
+        for name, node in self.nodes.items():
+            self._check(name, node)
+        if self.late:
+            logger.debug(f"Dropped {self.late} records from closed windows")
+
+    def take_alerts(self) -> list[dict[str, Any]]:
+        alerts: list[dict[str, Any]] = self.alerts
+        self.alerts = []
+        return alerts
+
+
+class StreamDetectors:
+    # The detectors of a run, one per log stream
+    def __init__(self, settings: Settings) -> None:
+        self.settings: Settings = settings
+        self.detectors: dict[str, SpikeDetector] = {}
+
+    def get(self, stream: str) -> SpikeDetector | None:
+        if stream not in self.detectors:
+            detector: SpikeDetector | None = from_settings(self.settings, stream)
+            if detector is None:
+                return None
+            self.detectors[stream] = detector
+        return self.detectors[stream]
+
+
+def from_settings(
+    settings: Settings, stream: str | None = None
+) -> SpikeDetector | None:
+    # The detector settings ask for, or None with detection turned off
+    if not settings.anomaly_detection:
+        return None
+    return SpikeDetector(
+        settings.anomaly_window,
+        settings.anomaly_alpha,
+        settings.anomaly_threshold,
+        settings.anomaly_min_count,
+        settings.anomaly_warmup,
+        settings.anomaly_severities,
+        settings.anomaly_sketch_width,
+        settings.anomaly_sketch_depth,
+        stream=stream,
+    )
@@ -0,0 +1,70 @@
+"""
+Module Name: cache.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: cache holds recent query results so repeated dashboard queries
+are answered without going back to the database.
+
+Entries are evicted least recently used past max_entries & expire ttl
+seconds after they were stored. Every lookup carries the ingest
+watermark it was made at (see db.ingest_watermark); when it moves, logs
+were inserted or expired, so every cached result is dropped at once.
+Classes: ResultCache
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.clock: Callable[[], float] = clock
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.watermark: Hashable = None
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def _check_watermark(self, watermark: Hashable) -> None:
+        # Drop every result cached before the watermark moved
+        if watermark != self.watermark:
+            if self.entries:
+                logger.debug(
+                    f"Ingest watermark moved to {watermark}, dropping "
+                    f"{len(self.entries)} cached results"
+                )
+            self.entries.clear()
+            self.watermark = watermark
+
+    def get(self, key: Hashable, watermark: Hashable) -> Any | None:
+        self._check_watermark(watermark)
+        entry: tuple[float, Any] | None = self.entries.get(key)
+        if entry is None or self.clock() - entry[0] > self.ttl:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, watermark: Hashable) -> None:
+        self._check_watermark(watermark)
+        self.entries[key] = (self.clock(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
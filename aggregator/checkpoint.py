@@ -0,0 +1,222 @@
+"""
+Module Name: checkpoint.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: checkpoint records how far each log file has been inserted
+into the database so that an interrupted ingest resumes each file
+from its last confirmed byte offset instead of starting over.
+
+Checkpoints are keyed by the archive & member a log came from (its
+source) rather than where it was extracted to, and remember a hash of
+the first bytes of the file so a different file under the same key
+restarts from 0 rather than resuming at the old offset.
+
+They are kept in a json lines journal (settings.checkpoint_file): each
+commit appends one line, & the journal is compacted into one line per
+checkpoint atomically when loaded or when it has grown long. The
+journal also marks the archives watch has finished with, so they are
+not picked up again after a restart.
+Classes: Checkpoint, CheckpointStore
+Functions: fileHead
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import IO, Any
+
+from pydantic import BaseModel
+
+HEAD_BYTES: int = 4096
+COMPACT_LINES: int = 10000
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class Checkpoint(BaseModel):
+    path: str
+    offset: int = 0
+    records: int = 0
+    size: int = 0
+    head: str = ""  # hash of the first head_size bytes of the file
+    head_size: int = 0
+
+
+def _head(log_file: Path | str, size: int = HEAD_BYTES) -> str:
+    # Hash the first bytes of a file to tell it from another of that name
+    with open(log_file, "rb") as file:
+        return hashlib.blake2b(file.read(size), digest_size=16).hexdigest()
+
+
+def file_head(log_file: Path | str, checkpoint: Checkpoint) -> str:
+    # The head hash a file is known by: its checkpoint's, else that of its
+    # first bytes as they are now
+    if checkpoint.head:
+        return checkpoint.head
+    return _head(log_file, min(os.path.getsize(log_file), HEAD_BYTES))
+
+
+class CheckpointStore:
+    def __init__(self, path: Path) -> None:
+        self.path: Path = Path(path)
+        self.checkpoints: dict[str, Checkpoint] = {}
+        self.archives: dict[str, int] = {}  # finished archive name: size
+        self.lines: int = 0
+        self._journal: IO[str] | None = None
+        self.load()
+
+    def load(self) -> None:
+        # Replay the journal, starting empty if there is none
+        if not os.path.exists(self.path):
+            logger.info(f"No checkpoints found at {self.path}")
+            return
+        try:
+            with open(self.path, "r") as file:
+                for line in file:
+                    if line.strip():
+                        self._replay(json.loads(line))
+                        self.lines += 1
+        except (ValueError, OSError) as err:
+            logger.error(f"ErrorType: {type(err)} - Could not load {self.path}")
+            raise err
+        logger.info(f"Loaded {len(self.checkpoints)} checkpoints from {self.path}")
+        if self.lines > self._entries():
+            self.save()
+
+    def _entries(self) -> int:
+        return len(self.checkpoints) + len(self.archives)
+
+    def _replay(self, entry: dict[str, Any]) -> None:
+        # Apply a journal line; a line without a key is the older single
+        # json dict of every checkpoint by path
+        if "archive" in entry:
+            if entry["size"] is None:
+                self.archives.pop(entry["archive"], None)
+            else:
+                self.archives[entry["archive"]] = entry["size"]
+        elif "key" not in entry:
+            for key, checkpoint in entry.items():
+                self.checkpoints[key] = Checkpoint.model_validate(checkpoint)
+        elif entry["checkpoint"] is None:
+            self.checkpoints.pop(entry["key"], None)
+        else:
+            self.checkpoints[entry["key"]] = Checkpoint.model_validate(
+                entry["checkpoint"]
+            )
+
+    def save(self) -> None:
+        # Compact the journal to a temp file & rename so a crash never
+        # leaves half a file
+        self.close()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path: str = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            for key, checkpoint in self.checkpoints.items():
+                file.write(self._line(key, checkpoint))
+            for archive, size in self.archives.items():
+                file.write(self._archive_line(archive, size))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        self.lines = self._entries()
+        logger.debug(f"Saved {len(self.checkpoints)} checkpoints to {self.path}")
+
+    def close(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    @staticmethod
+    def _line(key: str, checkpoint: Checkpoint | None) -> str:
+        dump: dict | None = None if checkpoint is None else checkpoint.model_dump()
+        return json.dumps({"key": key, "checkpoint": dump}) + "\n"
+
+    @staticmethod
+    def _archive_line(archive: str, size: int | None) -> str:
+        return json.dumps({"archive": archive, "size": size}) + "\n"
+
+    def _append(self, line: str) -> None:
+        # Append one line to the journal; it is flushed to the os but not
+        # fsynced, as a lost line only replays a batch, which is idempotent
+        if self.lines >= max(COMPACT_LINES, 2 * self._entries()):
+            self.save()
+            return
+        if self._journal is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._journal = open(self.path, "a")
+        self._journal.write(line)
+        self._journal.flush()
+        self.lines += 1
+
+    def archive_done(self, archive: str, size: int) -> bool:
+        # Whether an archive of this name & size was finished with
+        return self.archives.get(archive) == size
+
+    def finish_archive(self, archive: str, size: int) -> None:
+        self.archives[archive] = size
+        self._append(self._archive_line(archive, size))
+
+    def forget_archive(self, archive: str) -> None:
+        # Drop the mark of an archive that is no longer in the sourcedir
+        if self.archives.pop(archive, None) is not None:
+            self._append(self._archive_line(archive, None))
+
+    def get(self, log_file: Path | str, source: str | None = None) -> Checkpoint:
+        # Return the checkpoint for a file by its source (or path), resetting
+        # it if the file shrank or its first bytes changed
+        key: str = str(log_file) if source is None else source
+        checkpoint: Checkpoint | None = self.checkpoints.get(key)
+        if checkpoint is None:
+            return Checkpoint(path=str(log_file))
+        size: int = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+        reason: str | None = None
+        if size < checkpoint.size:
+            reason = "is smaller than when checkpointed"
+        elif checkpoint.head and _head(log_file, checkpoint.head_size) != (
+            checkpoint.head
+        ):
+            reason = "is not the file that was checkpointed"
+        if reason is not None:
+            logger.warning(f"{log_file} {reason}, restarting from 0")
+            del self.checkpoints[key]
+            self._append(self._line(key, None))
+            return Checkpoint(path=str(log_file))
+        logger.info(
+            f"Resuming {log_file} from offset {checkpoint.offset} "
+            f"after {checkpoint.records} records"
+        )
+        return checkpoint
+
+    def commit(
+        self,
+        log_file: Path | str,
+        offset: int,
+        records: int,
+        source: str | None = None,
+    ) -> Checkpoint:
+        # Record that records up to offset have been inserted
+        key: str = str(log_file) if source is None else source
+        previous: Checkpoint | None = self.checkpoints.get(key)
+        size: int = os.path.getsize(log_file)
+        head: str
+        head_size: int
+        if previous is not None and previous.head:
+            head, head_size = previous.head, previous.head_size
+        else:
+            head_size = min(size, HEAD_BYTES)
+            head = _head(log_file, head_size)
+        checkpoint: Checkpoint = Checkpoint(
+            path=str(log_file),
+            offset=offset,
+            records=records if previous is None else previous.records + records,
+            size=size,
+            head=head,
+            head_size=head_size,
+        )
+        self.checkpoints[key] = checkpoint
+        self._append(self._line(key, checkpoint))
+        logger.debug(f"Committed {records} records of {log_file} up to {offset}")
+        return checkpoint
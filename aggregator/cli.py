@@ -0,0 +1,381 @@
+"""
+Module Name: cli.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: cli is the aggregator command line, so routine queries no
+longer run a full ingest & dump the whole collection.
+
+    aggregator ingest [--sourcedir DIR] [--workers N] [--profile bulk]
+    aggregator query [filters] [--merge] [--format table|jsonl|csv]
+    aggregator search PATTERN [--regex] [filters] [--merge]
+    aggregator stats [--by severity|node|type|source|hour] [filters]
+    aggregator recount
+    aggregator alerts [--node NODE] [--start START] [--limit N]
+    aggregator export [filters] [--merge] [--format jsonl|csv|arrow] [--output FILE]
+    aggregator watch | tail PATH... | retention [--once]
+    aggregator serve [--host HOST] [--port PORT]
+
+Filters are --node, --severity (repeatable), --type, --source, the
+origin --collection, --fqdn & --service, --start, --end (ISO datetimes),
+--sort & --limit (not for stats, which counts every match). query &
+search show 100 logs unless --limit says otherwise (0 for all). --merge
+interleaves the nodes' logs by datetime from one cursor per node instead
+of sorting them all on the server, for --sort datetime or -datetime.
+Options override the environment settings for the run; logging goes to
+stderr so exports can be piped. Handlers import the db side (beanie,
+motor) when they run, so --help & usage errors return without loading
+it.
+Functions: buildParser, run
+"""
+
+import argparse
+import asyncio
+import logging
+import re
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Coroutine
+
+from aggregator import config, logs
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS: list[str] = ["jsonl", "csv", "arrow"]
+
+Handler = Callable[[argparse.Namespace, config.Settings], Coroutine[Any, Any, int]]
+
+
+def _add_filters(parser: argparse.ArgumentParser, limit: int | None) -> None:
+    # The filter options; a limit of None leaves out --sort & --limit, for
+    # commands that count every matching log
+    filters = parser.add_argument_group("filters")
+    filters.add_argument("--node", help="only logs from this node")
+    filters.add_argument(
+        "--severity",
+        action="append",
+        choices=config.SEVERITIES,
+        help="only logs of this severity, may be repeated",
+    )
+    filters.add_argument("--type", help="only logs of this type")
+    filters.add_argument("--source", help="only logs from this source")
+    filters.add_argument(
+        "--collection", type=int, help="only logs from this collection (epoch)"
+    )
+    filters.add_argument("--fqdn", help="only logs from this host")
+    filters.add_argument("--service", help="only logs of this service")
+    filters.add_argument(
+        "--start", type=datetime.fromisoformat, help="only logs at or after this"
+    )
+    filters.add_argument(
+        "--end", type=datetime.fromisoformat, help="only logs at or before this"
+    )
+    if limit is None:
+        return
+    filters.add_argument(
+        "--sort", default="-datetime", help="field to sort by, - for descending"
+    )
+    filters.add_argument(
+        "--limit",
+        type=int,
+        default=limit,
+        help=f"most logs to return, 0 for all (default {limit})",
+    )
+
+
+def _add_merge(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="merge per-node streams by datetime instead of a server-side sort",
+    )
+
+
+async def _query(args: argparse.Namespace) -> dict[str, Any]:
+    # The mongo filter for the filter options; origin options match the
+    # logs of the LogFiles they pick out
+    from aggregator import db
+
+    query: dict[str, Any] = {}
+    if args.node:
+        query["node"] = args.node
+    if args.severity:
+        query["severity"] = {"$in": args.severity}
+    if args.type:
+        query["type"] = args.type
+    if args.source:
+        query["source"] = args.source
+    query.update(await db.log_file_query(args.collection, args.fqdn, args.service))
+    return query
+
+
+async def _show(
+    args: argparse.Namespace, settings: config.Settings, query: dict[str, Any]
+) -> int:
+    # Show matching logs as a table or stream them in an export format
+    from aggregator import db, export, view
+
+    if args.format == "table":
+        documents: AsyncIterator[Any] = (
+            db.merge_logs(
+                query, args.start, args.end, args.sort == "-datetime", args.limit
+            )
+            if args.merge
+            else db.stream_logs(query, args.sort, args.start, args.end, args.limit)
+        )
+        rows: list[Any] = [document async for document in documents]
+        await view.display_result(rows, settings.database)
+    else:
+        await export.export_logs(
+            query,
+            args.sort,
+            None,
+            args.format,
+            args.start,
+            args.end,
+            args.limit,
+            args.merge,
+        )
+    return 0
+
+
+async def _ingest(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import main
+
+    result: list[int] = await main.ingest(settings)
+    print(f"Inserted {sum(result)} logs from {len(result)} log files")
+    return 0
+
+
+async def _query_logs(args: argparse.Namespace, settings: config.Settings) -> int:
+    return await _show(args, settings, await _query(args))
+
+
+async def _search(args: argparse.Namespace, settings: config.Settings) -> int:
+    query: dict[str, Any] = await _query(args)
+    pattern: str = args.pattern if args.regex else re.escape(args.pattern)
+    query["message"] = {"$regex": pattern, "$options": "i"}
+    return await _show(args, settings, query)
+
+
+async def _stats(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import db
+
+    counts: list[tuple[Any, int]] = await db.count_logs(
+        await _query(args), args.by, args.start, args.end
+    )
+    width: int = max([len(args.by)] + [len(str(value)) for value, _ in counts])
+    lines: list[str] = [f"{args.by:<{width}} {'logs':>10}\n"]
+    lines += [f"{str(value):<{width}} {count:>10}\n" for value, count in counts]
+    lines.append(f"{'total':<{width}} {sum(count for _, count in counts):>10}\n")
+    sys.stdout.write("".join(lines))
+    return 0
+
+
+async def _recount(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import db
+
+    print(f"Rebuilt {await db.rebuild_hourly_counts()} hourly counts")
+    return 0
+
+
+async def _alerts(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import db
+
+    lines: list[str] = [
+        f"{alert.window_start:%Y-%m-%d %H:%M:%S} {alert.node:<15} "
+        f"{alert.logs:>6} {alert.expected:>8.1f} {alert.score:>6.1f} "
+        f"{alert.template or '*'}\n"
+        for alert in await db.find_alerts(args.node, args.start, args.limit)
+    ]
+    header: str = f"{'window':<19} {'node':<15} {'logs':>6} {'expected':>8} "
+    sys.stdout.write(f"{header}{'score':>6} template\n" + "".join(lines))
+    return 0
+
+
+async def _export(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import export
+
+    written: int = await export.export_logs(
+        await _query(args),
+        args.sort,
+        args.output,
+        args.format,
+        args.start,
+        args.end,
+        args.limit,
+        args.merge,
+    )
+    logger.info(f"Exported {written} logs")
+    return 0
+
+
+def _with_db(handler: Handler) -> Handler:
+    # Run a handler with the shared client, closing it afterwards
+    async def with_db(args: argparse.Namespace, settings: config.Settings) -> int:
+        from aggregator import db, main
+
+        await main.init_app(settings)
+        try:
+            return await handler(args, settings)
+        finally:
+            await db.close()
+
+    return with_db
+
+
+async def _watch(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import watch
+
+    await watch.watch(settings)
+    return 0
+
+
+async def _tail(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import tail
+
+    await tail.tail(args.paths, settings)
+    return 0
+
+
+async def _serve(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import server
+
+    await server.serve(settings, args.host, args.port)
+    return 0
+
+
+async def _retention(args: argparse.Namespace, settings: config.Settings) -> int:
+    from aggregator import retention
+
+    await retention.retain(settings, args.once)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="aggregator", description="Aggregate, query & export service logs."
+    )
+    parser.add_argument("--database", help="database to use")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="extract & insert new logs")
+    ingest.add_argument("--sourcedir", type=Path, help="directory of log archives")
+    ingest.add_argument("--workers", type=int, help="parse worker processes")
+    ingest.add_argument(
+        "--profile", choices=list(config.INGEST_PROFILES), help="ingest profile"
+    )
+    ingest.add_argument("--batch-size", type=int, help="logs per insert batch")
+    ingest.add_argument(
+        "--no-write-ahead",
+        action="store_true",
+        help="insert directly instead of through the on-disk queue",
+    )
+    ingest.set_defaults(func=_with_db(_ingest))
+
+    query = subparsers.add_parser("query", help="show logs matching filters")
+    _add_filters(query, config.QUERY_LIMIT)
+    _add_merge(query)
+    query.add_argument("--format", choices=["table", "jsonl", "csv"], default="table")
+    query.set_defaults(func=_with_db(_query_logs))
+
+    search = subparsers.add_parser("search", help="find logs by message text")
+    search.add_argument("pattern", help="text to look for, case insensitive")
+    search.add_argument("--regex", action="store_true", help="pattern is a regex")
+    _add_filters(search, config.QUERY_LIMIT)
+    _add_merge(search)
+    search.add_argument("--format", choices=["table", "jsonl", "csv"], default="table")
+    search.set_defaults(func=_with_db(_search))
+
+    stats = subparsers.add_parser("stats", help="count logs per field value")
+    stats.add_argument(
+        "--by",
+        choices=["severity", "node", "type", "source", "hour"],
+        default="severity",
+    )
+    _add_filters(stats, None)
+    stats.set_defaults(func=_with_db(_stats))
+
+    recount = subparsers.add_parser(
+        "recount", help="rebuild the hourly counts stats reads from the logs"
+    )
+    recount.set_defaults(func=_with_db(_recount))
+
+    alerts = subparsers.add_parser("alerts", help="show error spikes found at ingest")
+    alerts.add_argument("--node", help="only alerts for this node")
+    alerts.add_argument(
+        "--start", type=datetime.fromisoformat, help="only windows from this"
+    )
+    alerts.add_argument(
+        "--limit", type=int, default=20, help="most alerts to show, 0 for all"
+    )
+    alerts.set_defaults(func=_with_db(_alerts))
+
+    export_parser = subparsers.add_parser("export", help="export logs to a file")
+    _add_filters(export_parser, 0)
+    _add_merge(export_parser)
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+    export_parser.add_argument(
+        "--output", type=Path, help="file to write, stdout if not given"
+    )
+    export_parser.set_defaults(func=_with_db(_export))
+
+    watch_parser = subparsers.add_parser("watch", help="ingest archives as they land")
+    watch_parser.add_argument("--sourcedir", type=Path, help="directory to watch")
+    watch_parser.set_defaults(func=_watch)
+
+    tail_parser = subparsers.add_parser("tail", help="ingest live logs as they grow")
+    tail_parser.add_argument("paths", nargs="+", type=Path, help="logs to follow")
+    tail_parser.set_defaults(func=_tail)
+
+    retention_parser = subparsers.add_parser("retention", help="expire old logs")
+    retention_parser.add_argument(
+        "--once", action="store_true", help="run once instead of on a schedule"
+    )
+    retention_parser.set_defaults(func=_retention)
+
+    serve_parser = subparsers.add_parser("serve", help="answer queries over HTTP")
+    serve_parser.add_argument("--host", help="address to listen on")
+    serve_parser.add_argument("--port", type=int, help="port to listen on")
+    serve_parser.set_defaults(func=_serve)
+    return parser
+
+
+def _settings(args: argparse.Namespace) -> config.Settings:
+    # Apply the options given to a copy of the environment settings
+    settings: config.Settings = config.get_settings()
+    options: dict[str, Any] = {
+        "database": args.database,
+        "sourcedir": getattr(args, "sourcedir", None),
+        "parse_workers": getattr(args, "workers", None),
+        "ingest_profile": getattr(args, "profile", None),
+        "insert_batch_size": getattr(args, "batch_size", None),
+    }
+    update: dict[str, Any] = {
+        name: value for name, value in options.items() if value is not None
+    }
+    if getattr(args, "no_write_ahead", False):
+        update["write_ahead"] = False
+    return settings.model_copy(update=update)
+
+
+def run(argv: list[str] | None = None) -> int:
+    parser: argparse.ArgumentParser = build_parser()
+    args: argparse.Namespace = parser.parse_args(argv)
+    if getattr(args, "regex", False):
+        try:
+            re.compile(args.pattern)
+        except re.error as err:
+            parser.error(f"invalid --regex pattern: {err}")
+    if getattr(args, "merge", False) and args.sort not in ["datetime", "-datetime"]:
+        parser.error("--merge needs --sort datetime or -datetime")
+    logs.configure_logging()
+    settings: config.Settings = _settings(args)
+    with config.using(settings):
+        return asyncio.run(args.func(args, settings))
+
+
+if __name__ == "__main__":
+
+    sys.exit(run())
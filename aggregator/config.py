@@ -8,13 +8,41 @@ Variables: sourcedir, outdir, connection, database
 """
 
 import logging
+from contextlib import contextmanager
 from functools import lru_cache
 from pathlib import Path
+from typing import Any, Iterator, Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict  # AnyUrl
 
 logger: logging.Logger = logging.getLogger("__name__")
 
+# bulk trades durability & read freshness for back-fill throughput: w=1
+# without journal, unordered inserts in larger batches & the bulk reads of
+# ingest jobs served by secondaries; durable waits for a journaled majority
+# & reads the primary. Interactive reads always use the primary
+INGEST_PROFILES: dict[str, dict[str, Any]] = {
+    "bulk": {
+        "w": 1,
+        "journal": False,
+        "ordered": False,
+        "batch_size": 50000,
+        "read_preference": "secondaryPreferred",
+    },
+    "durable": {
+        "w": "majority",
+        "journal": True,
+        "ordered": True,
+        "batch_size": 10000,
+        "read_preference": "primary",
+    },
+}
+
+# The severities logs are filtered by & how many logs a query returns
+# unless told otherwise, shared by the cli & the server
+SEVERITIES: list[str] = ["INFO", "WARN", "ERROR"]
+QUERY_LIMIT: int = 100
+
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
@@ -28,6 +56,60 @@ class Settings(BaseSettings):
     testdatadir: Path = Path("./testsource")
     database: str = "logs"
     log_level: int = logging.INFO
+    log_globs: list[str] = ["*.log", "*.log[0-9]"]
+    parse_workers: int = 0
+    parse_chunk_size: int = 64 * 1024 * 1024
+    checkpoint_file: Path | None = None
+    insert_batch_size: int | None = None
+    view_page_size: int = 0
+    view_sample_size: int = 1000
+    view_max_width: int = 40
+    view_message_width: int = 120
+    export_batch_size: int = 10000
+    export_buffer_size: int = 1024 * 1024
+    ingest_profile: Literal["bulk", "durable"] = "durable"
+    insert_retries: int = 3
+    insert_retry_backoff: float = 0.5
+    spill_dir: Path | None = None
+    spill_segment_size: int = 64 * 1024 * 1024
+    spill_drain_interval: float = 1.0
+    write_ahead: bool = True
+    watch_interval: float = 2.0
+    watch_debounce: float = 5.0
+    tail_interval: float = 0.25
+    tail_flush_latency: float = 1.0
+    tail_record_timeout: float = 2.0
+    tail_batch_size: int = 1000
+    retention_days: dict[str, int] = {"INFO": 14, "WARN": 90, "ERROR": 180}
+    retention_batch_size: int = 10000
+    retention_interval: float = 3600.0
+    server_host: str = "127.0.0.1"
+    server_port: int = 8080
+    server_max_limit: int = 10000
+    cache_size: int = 256
+    cache_ttl: float = 60.0
+    cache_watermark_interval: float = 1.0
+    log_cache_size: int = 1024
+    log_cache_ttl: float = 300.0
+    anomaly_detection: bool = True
+    anomaly_window: float = 60.0
+    anomaly_alpha: float = 0.1
+    anomaly_threshold: float = 4.0
+    anomaly_min_count: int = 10
+    anomaly_warmup: int = 5
+    anomaly_severities: list[str] = ["ERROR"]
+    anomaly_sketch_width: int = 1024
+    anomaly_sketch_depth: int = 4
+    merge_batch_size: int = 1000
+    db_max_pool_size: int = 100
+    db_min_pool_size: int = 0
+    db_max_idle_time_ms: int | None = None
+    db_compressors: list[str] = []
+    db_write_concern: int | str | None = None
+    db_journal: bool | None = None
+    db_connect_timeout_ms: int = 20000
+    db_socket_timeout_ms: int | None = None
+    db_server_selection_timeout_ms: int = 30000
 
     def get_environment(self) -> str:
         return self.environment
@@ -64,8 +146,228 @@ class Settings(BaseSettings):
     def get_log_level(self) -> int:
         return self.log_level
 
+    def get_log_globs(self) -> list[str]:
+        return self.log_globs
+
+    def get_parse_workers(self) -> int:
+        return self.parse_workers
+
+    def get_parse_chunk_size(self) -> int:
+        return self.parse_chunk_size
+
+    def get_checkpoint_file(self) -> Path:
+        if self.checkpoint_file is None:
+            return Path(self.outdir, "checkpoint.json")
+        return self.checkpoint_file
+
+    def get_insert_batch_size(self) -> int:
+        if self.insert_batch_size is None:
+            return INGEST_PROFILES[self.ingest_profile]["batch_size"]
+        return self.insert_batch_size
+
+    def get_insert_retries(self) -> int:
+        return self.insert_retries
+
+    def get_insert_retry_backoff(self) -> float:
+        return self.insert_retry_backoff
+
+    def get_spill_dir(self) -> Path:
+        if self.spill_dir is None:
+            return Path(self.outdir, "spill")
+        return self.spill_dir
+
+    def get_spill_segment_size(self) -> int:
+        return self.spill_segment_size
+
+    def get_spill_drain_interval(self) -> float:
+        return self.spill_drain_interval
+
+    def get_write_ahead(self) -> bool:
+        return self.write_ahead
+
+    def get_view_page_size(self) -> int:
+        return self.view_page_size
+
+    def get_view_sample_size(self) -> int:
+        return self.view_sample_size
+
+    def get_view_max_width(self) -> int:
+        return self.view_max_width
+
+    def get_view_message_width(self) -> int:
+        return self.view_message_width
+
+    def get_export_batch_size(self) -> int:
+        return self.export_batch_size
+
+    def get_export_buffer_size(self) -> int:
+        return self.export_buffer_size
+
+    def get_ingest_profile(self) -> str:
+        return self.ingest_profile
+
+    def get_insert_ordered(self) -> bool:
+        return INGEST_PROFILES[self.ingest_profile]["ordered"]
+
+    def get_read_preference(self) -> str:
+        return INGEST_PROFILES[self.ingest_profile]["read_preference"]
+
+    def get_watch_interval(self) -> float:
+        return self.watch_interval
+
+    def get_watch_debounce(self) -> float:
+        return self.watch_debounce
+
+    def get_tail_interval(self) -> float:
+        return self.tail_interval
+
+    def get_tail_flush_latency(self) -> float:
+        return self.tail_flush_latency
+
+    def get_tail_record_timeout(self) -> float:
+        return self.tail_record_timeout
+
+    def get_tail_batch_size(self) -> int:
+        return self.tail_batch_size
+
+    def get_retention_days(self) -> dict[str, int]:
+        return self.retention_days
+
+    def get_retention_batch_size(self) -> int:
+        return self.retention_batch_size
+
+    def get_retention_interval(self) -> float:
+        return self.retention_interval
+
+    def get_server_host(self) -> str:
+        return self.server_host
+
+    def get_server_port(self) -> int:
+        return self.server_port
+
+    def get_server_max_limit(self) -> int:
+        return self.server_max_limit
+
+    def get_cache_size(self) -> int:
+        return self.cache_size
+
+    def get_cache_ttl(self) -> float:
+        return self.cache_ttl
+
+    def get_cache_watermark_interval(self) -> float:
+        return self.cache_watermark_interval
+
+    def get_log_cache_size(self) -> int:
+        return self.log_cache_size
+
+    def get_log_cache_ttl(self) -> float:
+        return self.log_cache_ttl
+
+    def get_anomaly_detection(self) -> bool:
+        return self.anomaly_detection
+
+    def get_anomaly_window(self) -> float:
+        return self.anomaly_window
+
+    def get_anomaly_alpha(self) -> float:
+        return self.anomaly_alpha
+
+    def get_anomaly_threshold(self) -> float:
+        return self.anomaly_threshold
+
+    def get_anomaly_min_count(self) -> int:
+        return self.anomaly_min_count
+
+    def get_anomaly_warmup(self) -> int:
+        return self.anomaly_warmup
+
+    def get_anomaly_severities(self) -> list[str]:
+        return self.anomaly_severities
+
+    def get_anomaly_sketch_width(self) -> int:
+        return self.anomaly_sketch_width
+
+    def get_anomaly_sketch_depth(self) -> int:
+        return self.anomaly_sketch_depth
+
+    def get_merge_batch_size(self) -> int:
+        return self.merge_batch_size
+
+    def get_db_max_pool_size(self) -> int:
+        return self.db_max_pool_size
+
+    def get_db_min_pool_size(self) -> int:
+        return self.db_min_pool_size
+
+    def get_db_max_idle_time_ms(self) -> int | None:
+        return self.db_max_idle_time_ms
+
+    def get_db_compressors(self) -> list[str]:
+        return self.db_compressors
+
+    def get_db_write_concern(self) -> int | str:
+        if self.db_write_concern is None:
+            return INGEST_PROFILES[self.ingest_profile]["w"]
+        return self.db_write_concern
+
+    def get_db_journal(self) -> bool:
+        if self.db_journal is None:
+            return INGEST_PROFILES[self.ingest_profile]["journal"]
+        return self.db_journal
+
+    def get_db_connect_timeout_ms(self) -> int:
+        return self.db_connect_timeout_ms
+
+    def get_db_socket_timeout_ms(self) -> int | None:
+        return self.db_socket_timeout_ms
+
+    def get_db_server_selection_timeout_ms(self) -> int:
+        return self.db_server_selection_timeout_ms
+
+    def get_db_options(self) -> dict[str, Any]:
+        # Client options for motor, leaving unset ones to the driver; the
+        # write concern comes from the ingest profile, whose read preference
+        # is only applied per operation (db.ingest_collection)
+        options: dict[str, Any] = {
+            "maxPoolSize": self.db_max_pool_size,
+            "minPoolSize": self.db_min_pool_size,
+            "maxIdleTimeMS": self.db_max_idle_time_ms,
+            "compressors": self.db_compressors or None,
+            "w": self.get_db_write_concern(),
+            "journal": self.get_db_journal(),
+            "connectTimeoutMS": self.db_connect_timeout_ms,
+            "socketTimeoutMS": self.db_socket_timeout_ms,
+            "serverSelectionTimeoutMS": self.db_server_selection_timeout_ms,
+        }
+        return {key: value for key, value in options.items() if value is not None}
+
+
+# The settings of the running command when its options override the
+# environment's (see using)
+_active: Settings | None = None
+
 
 @lru_cache()
-def get_settings() -> Settings:
+def _environment_settings() -> Settings:
 
     return Settings()
+
+
+def get_settings() -> Settings:
+    # The running command's settings, else those of the environment
+    if _active is not None:
+        return _active
+    return _environment_settings()
+
+
+@contextmanager
+def using(settings: Settings) -> Iterator[Settings]:
+    # Make settings the ones get_settings returns while a command runs,
+    # leaving the environment's cached settings as they were
+    global _active
+    previous: Settings | None = _active
+    _active = settings
+    try:
+        yield settings
+    finally:
+        _active = previous
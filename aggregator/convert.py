@@ -4,25 +4,55 @@ Created: 2022-07-24
 Creator: JL
 Change Log: 2022-07-26 - added environment settings
 Summary: convert handles conversion of logs into json
-for upload to the database.
-Functions: lineStartMatch, yield_matches, multiToSingleLine,
-convertLogtoCSV, convert
+for upload to the database. The record layout of each file comes
+from the parser picked for it in parsers.
+Classes: LineStitcher
+Functions: lineStartMatch, yield_matches, yieldRecords, splitRecord,
+chunkOffsets, parseChunks, buildLog, convert, convertRecords, streamRecords
 """
 
 import asyncio
-import csv
 import logging
+import mmap
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Generator
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Pattern,
+    TypeVar,
+)
 
+from beanie import PydanticObjectId
 from beanie.exceptions import CollectionWasNotInitialized
 from pydantic import ValidationError
 from pymongo.errors import ServerSelectionTimeoutError
 
-from aggregator.helper import LOG_NODE_PATTERN, get_node
-from aggregator.model import JavaLog
+from aggregator import parsers
+from aggregator.config import Settings, get_settings
+from aggregator.helper import LOG_NODE_PATTERN, ArchiveInfo, get_node
+from aggregator.model import JavaLog, LogRecord
+from aggregator.parsers import (  # noqa: F401
+    ENCODING,
+    FIELD_SEPARATOR,
+    HEADER,
+    JAVA_TIMESTAMP,
+    RECORD_START,
+    LogParser,
+)
+
+RECORD_JOIN: bytes = b"; "
+NEWLINE: bytes = b"\n"
+
+T = TypeVar("T", JavaLog, LogRecord)
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -38,109 +68,345 @@ def _line_start_match(match: str, string: str) -> bool:
     return matches
 
 
-def _yield_matches(full_log: str) -> Generator:
-    # Yield matches creates a list of logs and yields the list on match
-    log_tmp: list[str] = []
-    for line in full_log.split("\n"):
+class LineStitcher:
+    # Incrementally joins continuation lines onto the open record, so the
+    # multiline stitching works on a stream as well as a whole file
+    def __init__(self, record_start: str = "INFO|WARN|ERROR") -> None:
+        self.record_start: str = record_start
+        self.lines: list[str] = []
+
+    def feed(self, line: str) -> str | None:
+        # Add a line, returning the previous record when this one starts anew
         line = line.strip()
         if line == "":
-            continue
-        if _line_start_match("INFO|WARN|ERROR", line):  # if line matches start
-            if len(log_tmp) > 0:  # if there's already a log
-                log: str = "; ".join(log_tmp)
-                yield log  # yield the log
-                log_tmp = []  # and set the log back to nothing
-        log_tmp.append(line)  # add current line to log (list)
+            return None
+        log: str | None = None
+        if _line_start_match(self.record_start, line):  # if line matches start
+            log = self.flush()  # yield any open log
+        self.lines.append(line)  # add current line to log (list)
         logger.debug(f"Appended: {line} to list")
+        return log
+
+    def flush(self) -> str | None:
+        # Close the open record, if there is one
+        if not self.lines:
+            return None
+        log: str = "; ".join(self.lines)
+        self.lines = []
+        return log
+
+
+def _yield_matches(full_log: str) -> Generator:
+    # Yield matches creates a list of logs and yields the list on match
+    stitcher: LineStitcher = LineStitcher()
+    log: str | None
+    for line in full_log.split("\n"):
+        log = stitcher.feed(line)
+        if log is not None:
+            yield log
+    log = stitcher.flush()
+    if log is not None:
+        yield log
+
+
+def _iter_lines(
+    mm: mmap.mmap, start: int = 0, stop: int | None = None
+) -> Iterator[tuple[bytes, int]]:
+    # Yield each stripped line with the offset just past its newline
+    size: int = len(mm) if stop is None else min(stop, len(mm))
+    pos: int = start
+    while pos < size:
+        newline: int = mm.find(NEWLINE, pos)
+        end: int = size if newline == -1 else newline + 1
+        yield mm[pos:end].strip(), end
+        pos = end
+
+
+def _yield_records(
+    logfile: Path,
+    start: int = 0,
+    stop: int | None = None,
+    record_start: Pattern[bytes] = RECORD_START,
+) -> Generator[tuple[bytes, int], None, None]:
+    # Yield single line records & their end offset from a memory-mapped log
+    with open(logfile, "rb") as file:
+        if os.fstat(file.fileno()).st_size <= start:
+            logger.info(f"Nothing to read in {logfile} from offset {start}")
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            logger.info(f"Mapped {logfile} for reading from offset {start}")
+            record: list[bytes] = []
+            record_end: int = start
+            for line, end in _iter_lines(mm, start, stop):
+                if not line:
+                    continue
+                if record_start.match(line) and record:
+                    yield RECORD_JOIN.join(record), record_end
+                    record = []
+                record.append(line)
+                record_end = end
+            if record:
+                yield RECORD_JOIN.join(record), record_end
+
+
+def _split_record(record: bytes) -> dict[str, Any]:
+    # Split a Java wrapper record into its pipe separated fields, as the
+    # Java parser does
+    return parsers.JAVA_WRAPPER.split(record)
+
+
+def _align_to_record(
+    mm: mmap.mmap, offset: int, record_start: Pattern[bytes] = RECORD_START
+) -> int:
+    # Move offset forward to the start of the next record
+    size: int = len(mm)
+    if offset <= 0:
+        return 0
+    if offset >= size:
+        return size
+    if mm[offset - 1 : offset] != NEWLINE:
+        newline: int = mm.find(NEWLINE, offset)
+        if newline == -1:
+            return size
+        offset = newline + 1
+    for line, end in _iter_lines(mm, offset):
+        if record_start.match(line):
+            return offset
+        offset = end
+    return size
 
-    if len(log_tmp) > 0:  # if there's already a log
-        log = "; ".join(log_tmp)
-    else:
-        log = log_tmp[0]
-    yield log
 
+def _chunk_offsets(
+    logfile: Path,
+    chunk_size: int,
+    start: int = 0,
+    record_start: Pattern[bytes] = RECORD_START,
+) -> list[tuple[int, int]]:
+    # Split a log into (start, stop) byte ranges that begin on a record
+    with open(logfile, "rb") as file:
+        size: int = os.fstat(file.fileno()).st_size
+        if size <= start:
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets: list[int] = [start]
+            for offset in range(start + chunk_size, size, chunk_size):
+                aligned: int = _align_to_record(mm, offset, record_start)
+                if offsets[-1] < aligned < size:
+                    offsets.append(aligned)
+    offsets.append(size)
+    chunks: list[tuple[int, int]] = list(zip(offsets[:-1], offsets[1:]))
+    logger.debug(f"Split {logfile} into {len(chunks)} chunks")
+    return chunks
 
-def _multi_to_single_line(logfile: Path) -> None:
-    # multiToSingleLine converts multiline to single line logs
-    data: str = open(logfile).read()
-    logger.info(f"Opened {logfile} for reading")
-    logs: list[str] = list(_yield_matches(data))
 
-    with open(logfile, "w") as file:
-        for line in logs:
-            file.write(f"{line}\n")
-            logger.debug(f"Wrote: {line} to {file}")
-        logger.info(f"Wrote converted logs to {logfile}")
+def _parse_chunk(
+    logfile: str, start: int, stop: int, parser_name: str = parsers.JAVA_WRAPPER.name
+) -> list[tuple[dict[str, Any], int]]:
+    # Parse one chunk of a log; runs in a worker process
+    parser: LogParser = parsers.PARSERS[parser_name]
+    return [
+        (parser.split(record), end)
+        for record, end in _yield_records(
+            Path(logfile), start, stop, parser.record_start
+        )
+    ]
 
 
-def _strip_whitespace(d: dict) -> dict:
-    for k, v in d.items():
-        try:
-            d[k] = v.strip()
-        except AttributeError as err:
-            logger.exception(f"AttributeError: {err}")
-    return d
+async def _iter_chunks(
+    logfile: Path,
+    chunk_size: int,
+    workers: int,
+    start: int = 0,
+    parser: LogParser = parsers.JAVA_WRAPPER,
+) -> AsyncIterator[list[tuple[dict[str, Any], int]]]:
+    # Parse a log across worker processes, yielding the chunks in order;
+    # only a chunk per worker is parsed ahead of the one being consumed
+    chunks: list[tuple[int, int]] = _chunk_offsets(
+        logfile, chunk_size, start, parser.record_start
+    )
+    logger.info(f"Parsing {logfile} as {len(chunks)} chunks with {workers} workers")
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parsing: deque[asyncio.Future] = deque()
+        for begin, stop in chunks:
+            parsing.append(
+                loop.run_in_executor(
+                    pool, _parse_chunk, str(logfile), begin, stop, parser.name
+                )
+            )
+            if len(parsing) > workers:
+                yield await parsing.popleft()
+        while parsing:
+            yield await parsing.popleft()
 
 
-def _convert_log_to_csv(logfile: Path) -> list[dict[str | Any, str | Any]]:
-    # Converts the CSV log file to a dict
-    header: list[str] = ["severity", "jvm", "datetime", "source", "type", "message"]
-    with open(logfile, "r") as file:
-        reader: csv.DictReader = csv.DictReader(file, delimiter="|", fieldnames=header)
-        logger.info(f"Opened {logfile} as csv.dictReader")
-        return list(reader)
+async def _parse_chunks(
+    logfile: Path,
+    chunk_size: int,
+    workers: int,
+    start: int = 0,
+    parser: LogParser = parsers.JAVA_WRAPPER,
+) -> list[tuple[dict[str, Any], int]]:
+    # Parse a log across worker processes and merge the chunks in order
+    return [
+        record
+        async for chunk in _iter_chunks(logfile, chunk_size, workers, start, parser)
+        for record in chunk
+    ]
 
 
-def _convert_to_datetime(timestamp: str) -> datetime:
+def _convert_to_datetime(timestamp: str, fmt: str = JAVA_TIMESTAMP) -> datetime:
     try:
-        dt: datetime = datetime.strptime(timestamp, "%Y/%m/%d %H:%M:%S")
+        dt: datetime = datetime.strptime(timestamp, fmt)
     except ValueError as err:
         logger.exception(f"ValueError: {err}")
         raise err
     return dt
 
 
-async def convert(file: str) -> list[JavaLog]:
+def _build_log(
+    d: dict[str, Any],
+    node: str,
+    build: Callable[..., T],
+    parser: LogParser = parsers.JAVA_WRAPPER,
+    log_file: PydanticObjectId | None = None,
+) -> T:
+    # Build a log from the fields a parser split out of a record
+    d["node"] = node
+
+    if d["message"] is None and d["type"] is None and d["source"] is not None:
+        d["message"] = d["source"]
+        d["source"] = None
+
+    if d["datetime"] is None:
+        raise ValueError(f"No timestamp in {parser} record: {d['message']}")
+    timestamp: datetime = _convert_to_datetime(d["datetime"], parser.timestamp_format)
+    return build(
+        node=d["node"],
+        severity=d["severity"],
+        jvm=d["jvm"],
+        datetime=timestamp,
+        source=d["source"],
+        type=d["type"],
+        message=d["message"],
+        log_file=log_file,
+    )
+
+
+async def convert(file: str, info: ArchiveInfo | None = None) -> list[JavaLog]:
+    log_list: list[JavaLog]
+    log_list, _ = await _convert(file, JavaLog, info=info)
+    return log_list
+
+
+async def convert_records(
+    file: str,
+    start: int = 0,
+    info: ArchiveInfo | None = None,
+    log_file: PydanticObjectId | None = None,
+) -> tuple[list[LogRecord], list[int]]:
+    # Convert a log from a byte offset into lean records for insertion,
+    # returning each record's end offset
+    return await _convert(file, LogRecord, start, info, log_file)
+
+
+async def stream_records(
+    file: str,
+    start: int = 0,
+    info: ArchiveInfo | None = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[tuple[list[LogRecord], list[int]]]:
+    # Convert a log from a byte offset into batches of lean records & their
+    # end offsets as it is parsed, so only a batch (or a chunk per worker)
+    # of a huge log is held at once
+    batch: list[LogRecord] = []
+    offsets: list[int] = []
+    async for log, end in _iter_logs(file, LogRecord, start, info):
+        batch.append(log)
+        offsets.append(end)
+        if len(batch) >= batch_size:
+            yield batch, offsets
+            batch, offsets = [], []
+    if batch:
+        yield batch, offsets
+
+
+async def _convert(
+    file: str,
+    build: Callable[..., T],
+    start: int = 0,
+    info: ArchiveInfo | None = None,
+    log_file_id: PydanticObjectId | None = None,
+) -> tuple[list[T], list[int]]:
+    log_list: list[T] = []
+    offsets: list[int] = []
+    async for log, end in _iter_logs(file, build, start, info, log_file_id):
+        log_list.append(log)
+        offsets.append(end)
+    return log_list, offsets
+
+
+async def _iter_logs(
+    file: str,
+    build: Callable[..., T],
+    start: int = 0,
+    info: ArchiveInfo | None = None,
+    log_file_id: PydanticObjectId | None = None,
+) -> AsyncIterator[tuple[T, int]]:
     log_file: Path = Path(file)
     logger.info(f"Starting new convert coroutine for {log_file}")
     # Work on log files in logsout
-    log_list: list[JavaLog] = []
-    node: str = get_node(log_file, LOG_NODE_PATTERN)
-
-    _multi_to_single_line(log_file)
-    reader: list[dict[str | Any, str | Any]] = _convert_log_to_csv(log_file)
+    # The archive info is resolved once per archive by extract
+    node: str
+    parser: LogParser
+    if info is None:
+        node = get_node(log_file, LOG_NODE_PATTERN)
+        parser = parsers.get_parser(log_file)
+    else:
+        node = info.node
+        parser = parsers.get_parser(log_file, info.log_type)
 
-    for d in reader:
+    # Huge logs are parsed in chunks across cores, the rest in process
+    settings: Settings = get_settings()
+    workers: int = settings.parse_workers or os.cpu_count() or 1
+    chunks: AsyncIterator[Iterable[tuple[dict[str, Any], int]]]
+    if workers > 1 and os.path.getsize(log_file) - start > settings.parse_chunk_size:
+        chunks = _iter_chunks(
+            log_file, settings.parse_chunk_size, workers, start, parser
+        )
+    else:
+        chunks = _in_process(log_file, start, parser)
 
-        d = _strip_whitespace(d)
+    async for records in chunks:
+        for d, end in records:
 
-        d["node"] = node
+            try:
+                log: T = _build_log(d, node, build, parser, log_file_id)
+                logger.debug(f"Built {log}")
+            except (ValueError, ValidationError) as err:
+                logger.exception(f"Error {type(err)} {err}")
+                continue
+            except (CollectionWasNotInitialized, ServerSelectionTimeoutError) as err:
+                logger.fatal(f"Error: {err=}, {type(err)=}")
+                raise err
+            except BaseException as err:
+                logger.exception(f"Unexpected {err=}, {type(err)=}")
+                continue
+            yield log, end
+            await asyncio.sleep(0)
 
-        if d["message"] is None and d["type"] is None and d["source"] is not None:
-            d["message"] = d["source"]
-            d["source"] = None
+    logger.info(f"Ending convert coroutine for {log_file} and {node}")
 
-        try:
-            timestamp: datetime = _convert_to_datetime(d["datetime"])
-            log: JavaLog = JavaLog(
-                node=d["node"],
-                severity=d["severity"],
-                jvm=d["jvm"],
-                datetime=timestamp,
-                source=d["source"],
-                type=d["type"],
-                message=d["message"],
-            )
-            log_list.append(log)
-            logger.debug(f"Appended {log} to log_list")
-        except (ValueError, ValidationError) as err:
-            logger.exception(f"Error {type(err)} {err}")
-        except (CollectionWasNotInitialized, ServerSelectionTimeoutError) as err:
-            logger.fatal(f"Error: {err=}, {type(err)=}")
-            raise err
-        except BaseException as err:
-            logger.exception(f"Unexpected {err=}, {type(err)=}")
-        await asyncio.sleep(0)
 
-    logger.info(f"Ending convert coroutine for {log_file} and {node}")
-    return log_list
+async def _in_process(
+    log_file: Path, start: int, parser: LogParser
+) -> AsyncIterator[Iterable[tuple[dict[str, Any], int]]]:
+    # The records of a log parsed in this process, as one lazy chunk
+    yield (
+        (parser.split(record), end)
+        for record, end in _yield_records(
+            log_file, start, record_start=parser.record_start
+        )
+    )
@@ -4,41 +4,144 @@ Created: 2022-07-24
 Creator: JL
 Change Log: 2022-07-26 - added environment settings
 Summary: db handles the initialization of the database and all db operations
-Functions: init, saveLogs
+Functions: init, close, getClient, ingestCollection, saveLogs, recordId,
+batchToken, packBatch, applyBatch, writeBatch, replaySpill, drainSpill,
+getLogs, clearLogCache, streamLogs, mergeLogs, countLogs, hourlyCounts,
+guardedInc, writeGuarded, addHourlyCounts, rebuildHourlyCounts, saveAlerts,
+findAlerts, ingestWatermark, logFileFields, getLogFileId, findLogFileIds,
+logFileQuery, catalogBatch, findCatalog
 """
 
 import asyncio
+import calendar
+import hashlib
+import heapq
 import logging
+import os
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Mapping, cast
 
 import beanie
 import motor.motor_asyncio
 from beanie import PydanticObjectId
 from beanie.odm.enums import SortDirection
-from motor.motor_asyncio import AsyncIOMotorClient
+from beanie.odm.queries.find import FindMany
+from bson import CodecOptions, ObjectId
+from bson.raw_bson import RawBSONDocument
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorCollection,
+    AsyncIOMotorCursor,
+)
 from pydantic import ValidationError  # AnyUrl
-from pymongo.errors import InvalidOperation, ServerSelectionTimeoutError
-from pymongo.results import InsertManyResult
+from pymongo import ASCENDING, DESCENDING, ReadPreference, ReturnDocument, UpdateOne
+from pymongo.errors import (
+    BulkWriteError,
+    ConnectionFailure,
+    OperationFailure,
+    PyMongoError,
+    ServerSelectionTimeoutError,
+)
+from pymongo.results import BulkWriteResult, InsertManyResult
 
+from aggregator.cache import ResultCache
 from aggregator.config import Settings, get_settings
-from aggregator.model import JavaLog
+from aggregator.helper import ArchiveInfo
+from aggregator.model import (
+    Alert,
+    CatalogEntry,
+    ExpiryBatch,
+    HourlyCount,
+    JavaLog,
+    LogFile,
+    LogRecord,
+    LogSummary,
+)
+from aggregator.spill import SpillQueue
 
 logger: logging.Logger = logging.getLogger(__name__)
 
-settings: Settings = get_settings()
+
+DOCUMENT_MODELS: list[type[beanie.Document]] = [
+    JavaLog,
+    LogFile,
+    CatalogEntry,
+    LogSummary,
+    ExpiryBatch,
+    HourlyCount,
+    Alert,
+]
+
+# Connection errors cover server selection timeouts & dropped connections;
+# of a bulk write's errors only those with a RETRYABLE_CODES code are retried
+RETRY_ERRORS: tuple[type[Exception], ...] = (ConnectionFailure, BulkWriteError)
+# Server codes for a node that is down, stepping down or out of reach, so
+# the same write can go through once the replica set settles
+RETRYABLE_CODES: frozenset[int] = frozenset(
+    {6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+)
+DUPLICATE_KEY: int = 11000
+HOURLY_FIELDS: list[str] = ["hour", "node", "severity"]
+READ_PREFERENCES: dict[str, Any] = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+# Tokens of the batches a counter has counted, kept to skip a replay
+BATCH_TOKENS: int = 64
+NODE_TIME_INDEX: list[tuple[str, int]] = [("node", ASCENDING), ("datetime", ASCENDING)]
+# Indexes earlier versions created that the models no longer declare
+STALE_INDEXES: list[tuple[type[beanie.Document], str]] = [
+    (CatalogEntry, "path_1_batch_1"),
+    (LogFile, "collection_1"),
+    # A prefix of the node & datetime index
+    (JavaLog, "node_1"),
+    # Alerts are keyed by stream as well
+    (Alert, "node_1_window_start_1_template_1"),
+]
+
+_client: AsyncIOMotorClient | None = None
+_log_file_ids: dict[tuple[int | None, str, str, str], PydanticObjectId] = {}
+# Logs never change once inserted, so fetched logs are cached by id (the
+# ttl bounds how long an expired log is still served) & concurrent
+# fetches of the same id share one query
+_log_cache: ResultCache | None = None
+_log_fetches: dict[PydanticObjectId, asyncio.Future] = {}
 
 
 async def init(
-    database: str = settings.database, connection: str = settings.connection
+    database: str | None = None,
+    connection: str | None = None,
+    options: dict[str, Any] | None = None,
 ) -> AsyncIOMotorClient:
+    # Create the shared client (pool, compression, write concern & timeouts
+    # come from options) & init beanie on it, closing any previous client
+    global _client
+    settings: Settings = get_settings()
+    if database is None:
+        database = settings.database
+    if connection is None:
+        connection = settings.connection
     logger.info(f"Initializing beanie with {database} using {connection}")
+    if _client is not None:
+        _client.close()
+    clear_log_cache()
     try:
-        client: AsyncIOMotorClient = motor.motor_asyncio.AsyncIOMotorClient(connection)
+        client: AsyncIOMotorClient = motor.motor_asyncio.AsyncIOMotorClient(
+            connection, **(options or {})
+        )
+        _client = client
 
         await beanie.init_beanie(
             database=client[database],
-            document_models=[JavaLog],  # type: ignore
+            document_models=DOCUMENT_MODELS,  # type: ignore
             # TODO: Investigate mypy issue
         )
+        await _drop_stale_indexes()
         logger.info(f"Initialized beanie with {database} using {connection}")
     except ServerSelectionTimeoutError as err:
         logger.fatal(
@@ -51,9 +154,170 @@ async def init(
     return client
 
 
+async def _drop_stale_indexes() -> None:
+    for model, name in STALE_INDEXES:
+        collection: AsyncIOMotorCollection = model.get_motor_collection()
+        if name in await collection.index_information():
+            await collection.drop_index(name)
+            logger.info(f"Dropped stale index {name} of {collection.name}")
+
+
+async def close() -> None:
+    # Close the shared client & its connection pool
+    global _client
+    if _client is None:
+        return
+    _client.close()
+    _client = None
+    logger.info("Closed database client")
+
+
+def get_client() -> AsyncIOMotorClient | None:
+    return _client
+
+
+def ingest_collection(model: type[beanie.Document]) -> AsyncIOMotorCollection:
+    # A model's collection with the ingest profile's read preference, for
+    # bulk reads such as exports that can lag the primary; the client (&
+    # so every interactive read) stays on the primary
+    settings: Settings = get_settings()
+    return model.get_motor_collection().with_options(
+        read_preference=READ_PREFERENCES[settings.get_read_preference()]
+    )
+
+
+def _to_document(log: LogRecord | JavaLog | dict[str, Any]) -> dict[str, Any]:
+    # The raw document for a log, as it is spilled to disk
+    if isinstance(log, dict):
+        return log
+    if isinstance(log, LogRecord):
+        return log.to_dict()
+    document: dict[str, Any] = log.model_dump(exclude={"id", "revision_id"})
+    if log.id is not None:
+        document["_id"] = log.id
+    return document
+
+
+def _failed_logs(err: BulkWriteError, logs: list, ordered: bool) -> tuple[list, list]:
+    # The logs a bulk insert did not write, split into those worth retrying
+    # & those the db rejected outright; duplicate keys are already in the
+    # db, e.g. from an earlier attempt whose ack was lost
+    write_errors: list[dict[str, Any]] = err.details.get("writeErrors", [])
+    retry: set[int] = {
+        error["index"] for error in write_errors if error["code"] in RETRYABLE_CODES
+    }
+    rejected: set[int] = {
+        error["index"]
+        for error in write_errors
+        if error["code"] not in RETRYABLE_CODES and error["code"] != DUPLICATE_KEY
+    }
+    if ordered and write_errors:
+        # An ordered insert stops at its first error
+        first: int = min(error["index"] for error in write_errors)
+        retry.update(range(first + 1, len(logs)))
+    return [logs[i] for i in sorted(retry)], [logs[i] for i in sorted(rejected)]
+
+
+def _inserted_ids(logs: list, failed: list) -> list[Any]:
+    # Ids of the logs a partly failed insert did write
+    failed_ids: set[int] = {id(log) for log in failed}
+    return [
+        log["_id"]
+        for log in logs
+        if id(log) not in failed_ids and isinstance(log, dict) and "_id" in log
+    ]
+
+
+def _error_codes(err: BulkWriteError) -> set[int]:
+    return {error["code"] for error in err.details.get("writeErrors", [])}
+
+
+def _transient(err: Exception) -> bool:
+    # Whether a failed write may go through if it is tried again later;
+    # duplicate keys alone are not a failure, the logs are already in
+    if isinstance(err, ConnectionFailure):
+        return True
+    if isinstance(err, BulkWriteError):
+        codes: set[int] = _error_codes(err)
+        return bool(codes & RETRYABLE_CODES) and (
+            codes <= RETRYABLE_CODES | {DUPLICATE_KEY}
+        )
+    return isinstance(err, OperationFailure) and err.code in RETRYABLE_CODES
+
+
+async def _insert_many(logs: list, ordered: bool) -> InsertManyResult:
+    if isinstance(logs[0], dict):
+        # Lean records skip model instantiation & go in as raw documents,
+        # which keep the _id the driver gave them for any retry
+        return await JavaLog.get_motor_collection().insert_many(logs, ordered=ordered)
+    return await JavaLog.insert_many(logs, ordered=ordered)
+
+
+async def _insert_retrying(
+    logs: list, ordered: bool, database: str, spill: SpillQueue | None = None
+) -> tuple[list[Any], list]:
+    # Insert logs, retrying the ones that fail transiently with exponential
+    # backoff & setting aside on the spill the ones the db rejects; returns
+    # the inserted ids & the rejected logs. It raises when retries run out,
+    # or on a rejection with no spill to set it aside on
+    settings: Settings = get_settings()
+    pending: list = logs
+    inserted_ids: list[Any] = []
+    rejected: list = []
+    attempt: int = 0
+    while pending:
+        try:
+            result: InsertManyResult = await _insert_many(pending, ordered)
+            inserted_ids += result.inserted_ids
+            break
+        except RETRY_ERRORS as err:
+            if isinstance(err, BulkWriteError):
+                retry: list
+                failed: list
+                retry, failed = _failed_logs(err, pending, ordered)
+                inserted_ids += _inserted_ids(pending, retry + failed)
+                if failed:
+                    if spill is None:
+                        raise err
+                    spill.set_aside(
+                        [_to_document(log) for log in failed], f"{type(err)}: {err}"
+                    )
+                    rejected += failed
+                pending = retry
+                if not pending:
+                    break
+                if _error_codes(err) == {DUPLICATE_KEY}:
+                    # An ordered insert stopped at logs already in, e.g. a
+                    # batch replayed after a crash: go on with the rest
+                    # without using up an attempt, unordered so the other
+                    # duplicates are all skipped in one go
+                    ordered = False
+                    continue
+            if attempt >= settings.insert_retries:
+                raise err
+            delay: float = settings.insert_retry_backoff * 2**attempt
+            attempt += 1
+            logger.warning(
+                f"ErrorType: {type(err)} - retrying {len(pending)} of "
+                f"{len(logs)} logs for db: {database} in {delay}s "
+                f"({attempt}/{settings.insert_retries})"
+            )
+            await asyncio.sleep(delay)
+    return inserted_ids, rejected
+
+
 async def insert_logs(
-    logs: list | None = None, database: str | None = settings.database
+    logs: list | None = None,
+    database: str | None = None,
+    ordered: bool | None = None,
+    spill: SpillQueue | None = None,
 ) -> InsertManyResult | None:
+    # Insert logs, retrying the ones that fail transiently; with a spill
+    # queue, logs still failing are queued on it (& None returned) & logs
+    # the db rejects are set aside on it, else it raises
+    settings: Settings = get_settings()
+    if database is None:
+        database = settings.database
     if logs is None:
         logger.warning(
             f"Started insert_logs coroutine for {logs} logs into db: " f"{database}"
@@ -66,35 +330,279 @@ async def insert_logs(
     logger.info(
         f"Started insert_logs coroutine for {num_logs} logs into db: " f"{database}"
     )
+    if ordered is None:
+        # Unordered inserts let the server apply a bulk profile batch in
+        # parallel & carry on past a failed document
+        ordered = settings.get_insert_ordered()
+    pending: list = logs
+    if logs and isinstance(logs[0], LogRecord):
+        pending = [log.to_dict() for log in logs]
     await asyncio.sleep(0)
+    inserted_ids: list[Any]
     try:
-        result: InsertManyResult = await JavaLog.insert_many(logs)
+        inserted_ids, _ = await _insert_retrying(pending, ordered, database, spill)
         logger.info(f"Inserted {num_logs} logs into db: " f"{database}")
         for log in logs:
             logger.debug(f"Inserted {log}")
-        # TODO: Implement BulkWriteError
-    except (ServerSelectionTimeoutError, InvalidOperation) as err:
+    except PyMongoError as err:
         logger.error(
             f"ErrorType: {type(err)} - coroutine insert_logs for {num_logs} "
             f"logs failed for db: {database}"
         )
-        raise err
+        if spill is None or not _transient(err):
+            raise err
+        # Logs that did go in keep their _id, so replaying them is a no-op
+        spill.put([{"logs": [_to_document(log) for log in pending]}])
+        return None
     finally:
         logger.info(
             f"Ending insert_logs coroutine for {num_logs} logs " f"into db: {database}"
         )
 
-    return result
+    return InsertManyResult(inserted_ids, True)
+
+
+def record_id(source: str, offset: int, timestamp: datetime) -> PydanticObjectId:
+    # The _id of the record ending at offset in a source: converting it
+    # again gives the same id, so inserting it again hits a duplicate key.
+    # Like a generated ObjectId it leads with a time, the log's own
+    seconds: int = min(max(calendar.timegm(timestamp.utctimetuple()), 0), 2**32 - 1)
+    digest: bytes = hashlib.blake2b(
+        f"{source}:{offset}".encode(), digest_size=8
+    ).digest()
+    return PydanticObjectId(seconds.to_bytes(4, "big") + digest)
+
+
+def batch_token(source: str, start: int, end: int) -> str:
+    # The token a source's batch from start to end is counted under
+    return hashlib.blake2b(
+        f"{source}:{start}:{end}".encode(), digest_size=12
+    ).hexdigest()
+
+
+def pack_batch(
+    logs: list,
+    path: Path | str | None = None,
+    offset: int | None = None,
+    token: str | None = None,
+    log_file: dict[str, Any] | None = None,
+    alerts: list[dict[str, Any]] | None = None,
+) -> dict[str, Any]:
+    # A batch as one document holding everything apply_batch writes for it,
+    # so it can be queued on disk & applied later: the logs (each with its
+    # _id fixed), where they came from & the alerts they raised. The token
+    # guards its counts, a random one if the batch has no stable identity
+    documents: list[dict[str, Any]] = [_to_document(log) for log in logs]
+    for document in documents:
+        document.setdefault("_id", ObjectId())
+    return {
+        "logs": documents,
+        "path": None if path is None else str(path),
+        "offset": offset,
+        "token": token or str(ObjectId()),
+        "log_file": log_file,
+        "alerts": alerts or [],
+    }
+
+
+async def apply_batch(
+    batch: dict[str, Any],
+    spill: SpillQueue | None = None,
+    database: str | None = None,
+) -> int:
+    # Write a batch from pack_batch: its LogFile & logs, then its catalog
+    # entry & hourly counts guarded by its token, then its alerts. Every
+    # step can be repeated, so a batch applied again after a crash or a
+    # spill changes nothing. A bare {"logs"} batch (spilled by insert_logs)
+    # is only inserted. Returns how many logs went in
+    settings: Settings = get_settings()
+    if database is None:
+        database = settings.database
+    logs: list[dict[str, Any]] = batch.get("logs", [])
+    token: str | None = batch.get("token")
+    log_file_id: PydanticObjectId | None = None
+    if logs and batch.get("log_file") is not None:
+        log_file_id = await _log_file_id(batch["log_file"])
+        for log in logs:
+            log["log_file"] = log_file_id
+    rejected: list = []
+    if logs:
+        _, rejected = await _insert_retrying(
+            logs, settings.get_insert_ordered(), database, spill
+        )
+    if rejected:
+        rejected_ids: set[int] = {id(log) for log in rejected}
+        logs = [log for log in logs if id(log) not in rejected_ids]
+    if logs and token is not None:
+        if batch.get("path") is not None:
+            await catalog_batch(
+                batch["path"], batch["offset"], logs, log_file_id, token
+            )
+        await add_hourly_counts(hourly_counts(logs), token)
+    await save_alerts(batch.get("alerts", []))
+    return len(logs)
+
+
+async def write_batch(
+    batch: dict[str, Any],
+    spill: SpillQueue | None = None,
+    database: str | None = None,
+) -> bool:
+    # Apply a batch, queueing it whole on the spill for the drainer if the
+    # db will not take it even after retries; returns whether it was
+    # written, as a queued batch is as good as committed to the caller
+    try:
+        await apply_batch(batch, spill, database)
+    except PyMongoError as err:
+        if spill is None or not _transient(err):
+            raise err
+        logger.error(
+            f"ErrorType: {type(err)} - queueing a batch of "
+            f"{len(batch.get('logs', []))} logs for the drainer"
+        )
+        spill.put([batch])
+        return False
+    return True
+
+
+async def replay_spill(spill: SpillQueue, database: str | None = None) -> int:
+    # Apply queued batches oldest first, committing each, until the queue is
+    # empty or the db still will not take a batch; a batch the db rejects
+    # outright is set aside rather than block the queue. Returns how many
+    # logs were applied
+    if database is None:
+        database = get_settings().database
+    replayed: int = 0
+    while True:
+        batches: list[dict[str, Any]] = spill.get(1)
+        if not batches:
+            break
+        try:
+            replayed += await apply_batch(batches[0], spill, database)
+        except PyMongoError as err:
+            if _transient(err):
+                logger.warning(
+                    f"ErrorType: {type(err)} - Stopped replaying {spill.directory} "
+                    f"with {spill.pending()} bytes left"
+                )
+                break
+            logger.error(f"ErrorType: {type(err)} - Setting aside a spilled batch")
+            spill.set_aside(batches, f"{type(err)}: {err}")
+        spill.commit()
+    if replayed:
+        logger.info(f"Replayed {replayed} spilled logs into db: {database}")
+    return replayed
+
+
+async def drain_spill(
+    spill: SpillQueue,
+    stop: asyncio.Event,
+    database: str | None = None,
+    interval: float | None = None,
+) -> int:
+    # Keep applying queued batches until stop is set, then drain once more;
+    # whatever the db still will not take stays queued for the next run
+    if interval is None:
+        interval = get_settings().spill_drain_interval
+    drained: int = 0
+    while True:
+        stopping: bool = stop.is_set()
+        drained += await replay_spill(spill, database)
+        if stopping:
+            break
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    if spill.pending():
+        logger.warning(f"Left {spill.pending()} bytes queued in {spill.directory}")
+    return drained
+
+
+def _get_log_cache() -> ResultCache:
+    global _log_cache
+    if _log_cache is None:
+        settings: Settings = get_settings()
+        _log_cache = ResultCache(settings.log_cache_size, settings.log_cache_ttl)
+    return _log_cache
+
+
+def clear_log_cache() -> None:
+    if _log_cache is not None:
+        _log_cache.entries.clear()
+
+
+async def _fetch_logs(ids: list[PydanticObjectId]) -> dict[PydanticObjectId, Any]:
+    # Fetch ids in one $in query, sharing the result with any concurrent
+    # get_logs waiting on the same ids
+    futures: dict[PydanticObjectId, asyncio.Future] = {
+        log_id: asyncio.get_running_loop().create_future() for log_id in ids
+    }
+    _log_fetches.update(futures)
+    try:
+        logs: list[JavaLog] = await JavaLog.find({"_id": {"$in": ids}}).to_list()
+        # Logs read back by _id always have one
+        found: dict[PydanticObjectId, Any] = {
+            cast(PydanticObjectId, log.id): log for log in logs
+        }
+        for log_id, log in found.items():
+            _get_log_cache().put(log_id, log, None)
+        for log_id, future in futures.items():
+            future.set_result(found.get(log_id))
+        return found
+    except Exception as err:
+        for future in futures.values():
+            future.set_exception(err)
+            # Waiters re-raise it; mark it seen for when there are none
+            future.exception()
+        raise err
+    finally:
+        for log_id, future in futures.items():
+            # A cancelled fetch cancels its waiters rather than strand them
+            future.cancel()
+            _log_fetches.pop(log_id, None)
+
+
+async def get_logs(ids: list[PydanticObjectId]) -> list[JavaLog | None]:
+    # Get logs by id in order (None where there is no such log) from the
+    # cache, a fetch already in flight or one query for the rest. Each
+    # caller gets its own copy so none can change what the cache holds
+    cache: ResultCache = _get_log_cache()
+    results: dict[PydanticObjectId, Any] = {}
+    waiting: dict[PydanticObjectId, asyncio.Future] = {}
+    missing: list[PydanticObjectId] = []
+    for log_id in dict.fromkeys(ids):
+        cached: JavaLog | None = cache.get(log_id, None)
+        if cached is not None:
+            results[log_id] = cached
+        elif log_id in _log_fetches:
+            waiting[log_id] = _log_fetches[log_id]
+        else:
+            missing.append(log_id)
+    if missing:
+        results.update(await _fetch_logs(missing))
+    for log_id, future in waiting.items():
+        results[log_id] = await future
+    logger.debug(
+        f"Got {len(ids)} logs: {len(ids) - len(missing) - len(waiting)} cached, "
+        f"{len(waiting)} shared & {len(missing)} fetched"
+    )
+    return [
+        None if results.get(log_id) is None else results[log_id].model_copy()
+        for log_id in ids
+    ]
 
 
 async def get_log(
-    log_id: PydanticObjectId | None, database: str | None = settings.database
+    log_id: PydanticObjectId | None, database: str | None = None
 ) -> JavaLog | None:
+    if database is None:
+        database = get_settings().database
     logger.info(f"Starting get_log coroutine for {log_id} from db: " f"{database}")
     try:
         if log_id is None:
             raise ValidationError("Cannot get None log", JavaLog)
-        result: JavaLog | None = await JavaLog.get(log_id)
+        result: JavaLog | None = (await get_logs([log_id]))[0]
         if result:
             logger.info(f"Got {log_id} from db: {database}")
         else:
@@ -113,17 +621,24 @@ async def get_log(
 async def find_logs(
     query,
     sort: str | list[tuple[str, SortDirection]] | None,
-    database: str | None = settings.database,
+    database: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
 ) -> list[JavaLog]:
+    if database is None:
+        database = get_settings().database
     logger.info(
         f"Starting find_logs coroutine for query: {query} "
         f"& sort: {sort} from db: "
         f"{database}"
     )
+    filters: list[dict[str, Any]] = []
+    if start is not None or end is not None:
+        filters = await _time_range_filters(start, end)
     if sort is None:
-        result: list[JavaLog] = await JavaLog.find(query).to_list()
+        result: list[JavaLog] = await JavaLog.find(query, *filters).to_list()
     else:
-        result = await JavaLog.find(query).sort(sort).to_list()
+        result = await JavaLog.find(query, *filters).sort(sort).to_list()
     logger.info(
         f"Found {len(result)} logs in find_logs coroutine for "
         f"query: {query} & sort: {sort} from db: "
@@ -134,3 +649,513 @@ async def find_logs(
         f"from db: {database}"
     )
     return result
+
+
+def _log_collection(bulk: bool = False) -> AsyncIOMotorCollection:
+    # The logs collection decoding to raw BSON, on the primary unless bulk
+    collection: AsyncIOMotorCollection = (
+        ingest_collection(JavaLog) if bulk else JavaLog.get_motor_collection()
+    )
+    return collection.with_options(
+        codec_options=CodecOptions(document_class=RawBSONDocument)
+    )
+
+
+async def stream_logs(
+    query,
+    sort: str | list[tuple[str, SortDirection]] | None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    limit: int = 0,
+    batch_size: int | None = None,
+    bulk: bool = False,
+) -> AsyncIterator[RawBSONDocument]:
+    # Stream matching logs straight off the cursor as raw BSON, skipping
+    # JavaLog instantiation; beanie only builds the filter & sort. A bulk
+    # stream (an export) reads with the ingest profile's read preference
+    filters: list[dict[str, Any]] = []
+    if start is not None or end is not None:
+        filters = await _time_range_filters(start, end)
+    find: FindMany[JavaLog] = JavaLog.find(query, *filters)
+    if sort is not None:
+        find = find.sort(sort)
+    collection: AsyncIOMotorCollection = _log_collection(bulk)
+    logger.info(f"Streaming logs for query: {query} & sort: {sort}")
+    cursor: AsyncIOMotorCursor = collection.find(
+        find.get_filter_query(),
+        sort=find.sort_expressions or None,
+        limit=limit,
+        batch_size=batch_size or get_settings().export_batch_size,
+    )
+    async for document in cursor:
+        yield document
+
+
+async def merge_logs(
+    query: dict[str, Any],
+    start: datetime | None = None,
+    end: datetime | None = None,
+    descending: bool = False,
+    limit: int = 0,
+    batch_size: int | None = None,
+    bulk: bool = False,
+) -> AsyncIterator[RawBSONDocument]:
+    # Stream logs from every node in datetime order without a server-side
+    # sort: each node's logs come off their own cursor already in order
+    # along the (node, datetime) index & a heap of the cursors' heads
+    # yields the next log, so memory is one batch per node
+    match: dict[str, Any] = dict(query)
+    window: dict[str, datetime] = {}
+    if start is not None:
+        window["$gte"] = start
+    if end is not None:
+        window["$lte"] = end
+    if window:
+        match["datetime"] = window
+    collection: AsyncIOMotorCollection = _log_collection(bulk)
+    nodes: list[str] = sorted(await collection.distinct("node", match))
+    logger.info(f"Merging logs from {len(nodes)} nodes for query: {match}")
+    cursors: list[AsyncIOMotorCursor] = [
+        collection.find(
+            {**match, "node": node},
+            sort=[("datetime", DESCENDING if descending else ASCENDING)],
+            hint=NODE_TIME_INDEX,
+            limit=limit,
+            batch_size=batch_size or get_settings().merge_batch_size,
+        )
+        for node in nodes
+    ]
+    heap: list[tuple[Any, int, RawBSONDocument]] = []
+
+    def _push(index: int, document: RawBSONDocument | None) -> None:
+        # Newest first is the max-heap of datetimes, kept as a min-heap of
+        # their distance from datetime.max; the index breaks ties by node
+        if document is not None:
+            timestamp: datetime = document["datetime"]
+            key: Any = datetime.max - timestamp if descending else timestamp
+            heapq.heappush(heap, (key, index, document))
+
+    try:
+        heads: list[RawBSONDocument | None] = await asyncio.gather(
+            *[anext(cursor, None) for cursor in cursors]
+        )
+        for index, document in enumerate(heads):
+            _push(index, document)
+        merged: int = 0
+        while heap and (not limit or merged < limit):
+            _, index, document = heapq.heappop(heap)
+            yield document
+            merged += 1
+            _push(index, await anext(cursors[index], None))
+    finally:
+        for cursor in cursors:
+            await cursor.close()
+
+
+def _hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _counted_hourly(
+    query, by: str, start: datetime | None, end: datetime | None
+) -> bool:
+    # The hourly counts answer a count exactly when it only filters on node
+    # & severity, from the start of an hour if at all, with no end
+    if not isinstance(query, dict) or by not in HOURLY_FIELDS or end is not None:
+        return False
+    if start is not None and start != _hour(start):
+        return False
+    return set(query) <= {"node", "severity"}
+
+
+async def count_logs(
+    query,
+    by: str,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> list[tuple[Any, int]]:
+    # Count matching logs per value of a field (or hour), most common (or
+    # earliest hour) first, from the hourly counts where they can answer
+    sort: dict[str, int] = {"_id": 1} if by == "hour" else {"logs": -1, "_id": 1}
+    pipeline: list[dict[str, Any]]
+    collection: AsyncIOMotorCollection
+    if _counted_hourly(query, by, start, end):
+        match: dict[str, Any] = {**query, "logs": {"$gt": 0}}
+        if start is not None:
+            match["hour"] = {"$gte": start}
+        collection = HourlyCount.get_motor_collection()
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": f"${by}", "logs": {"$sum": "$logs"}}},
+        ]
+    else:
+        filters: list[dict[str, Any]] = []
+        if start is not None or end is not None:
+            filters = await _time_range_filters(start, end)
+        find: FindMany[JavaLog] = JavaLog.find(query, *filters)
+        key: Any = f"${by}"
+        if by == "hour":
+            key = {"$dateTrunc": {"date": "$datetime", "unit": "hour"}}
+        collection = JavaLog.get_motor_collection()
+        pipeline = [
+            {"$match": find.get_filter_query()},
+            {"$group": {"_id": key, "logs": {"$sum": 1}}},
+        ]
+    counts: list[dict[str, Any]] = await collection.aggregate(
+        [*pipeline, {"$sort": sort}]
+    ).to_list(None)
+    logger.info(
+        f"Counted logs by {by} in {len(counts)} groups from {collection.name} "
+        f"for query: {query}"
+    )
+    return [(count["_id"], count["logs"]) for count in counts]
+
+
+def guarded_inc(
+    key: dict[str, Any],
+    inc: dict[str, int],
+    token: str | None = None,
+    **update: dict[str, Any],
+) -> UpdateOne:
+    # An upserted $inc applied once per batch token: a replayed batch finds
+    # its token already on the counter, so its upsert hits the unique key
+    # instead (see write_guarded)
+    if token is None:
+        return UpdateOne(key, {"$inc": inc, **update}, upsert=True)
+    return UpdateOne(
+        {**key, "batches": {"$ne": token}},
+        {
+            "$inc": inc,
+            "$push": {"batches": {"$each": [token], "$slice": -BATCH_TOKENS}},
+            **update,
+        },
+        upsert=True,
+    )
+
+
+async def write_guarded(
+    collection: AsyncIOMotorCollection, requests: list[UpdateOne]
+) -> None:
+    # Write guarded_inc upserts, skipping those already applied. A filter
+    # on batches is not an equality match on the unique key, so the server
+    # does not retry an upsert that lost a race to insert the same key
+    # (e.g. two files of a node counting a new hour at once): each
+    # duplicate key is tried once more as a plain update, which applies
+    # if the counter is new & matches nothing if it holds the token
+    if not requests:
+        return
+    try:
+        await collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as err:
+        write_errors: list[dict[str, Any]] = err.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in write_errors):
+            raise err
+        retries: list[UpdateOne] = [
+            UpdateOne(requests[error["index"]]._filter, requests[error["index"]]._doc)
+            for error in write_errors
+        ]
+        result: BulkWriteResult = await collection.bulk_write(retries, ordered=False)
+        logger.debug(
+            f"Skipped {len(retries) - result.modified_count} counts already applied"
+        )
+
+
+def hourly_counts(logs: list[dict[str, Any]]) -> Counter[tuple[datetime, str, str]]:
+    # Count a batch of log documents per hour, node & severity
+    return Counter(
+        (_hour(log["datetime"]), log["node"], log["severity"]) for log in logs
+    )
+
+
+async def add_hourly_counts(
+    counts: Mapping[tuple[datetime, str, str], int], token: str | None = None
+) -> None:
+    # Add counts (negative to remove logs) with one $inc upsert per key,
+    # once per token if given
+    if not counts:
+        return
+    try:
+        await write_guarded(
+            HourlyCount.get_motor_collection(),
+            [
+                guarded_inc(
+                    {"hour": hour, "node": node, "severity": severity},
+                    {"logs": count},
+                    token,
+                )
+                for (hour, node, severity), count in counts.items()
+            ],
+        )
+    except ServerSelectionTimeoutError as err:
+        logger.error(f"ErrorType: {type(err)} - could not update hourly counts")
+        raise err
+    logger.debug(f"Updated {len(counts)} hourly counts")
+
+
+async def rebuild_hourly_counts() -> int:
+    # Recount the hourly counts from the logs, e.g. for logs ingested
+    # before they were kept; returns how many there are. $out writes them
+    # to a temp collection that atomically replaces the counts (keeping
+    # their indexes) once complete, so stats read the old counts until then
+    collection: AsyncIOMotorCollection = HourlyCount.get_motor_collection()
+    await JavaLog.get_motor_collection().aggregate(
+        [
+            {
+                "$group": {
+                    "_id": {
+                        "hour": {"$dateTrunc": {"date": "$datetime", "unit": "hour"}},
+                        "node": "$node",
+                        "severity": "$severity",
+                    },
+                    "logs": {"$sum": 1},
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "hour": "$_id.hour",
+                    "node": "$_id.node",
+                    "severity": "$_id.severity",
+                    "logs": 1,
+                }
+            },
+            {"$out": collection.name},
+        ]
+    ).to_list(None)
+    rebuilt: int = await collection.count_documents({})
+    logger.info(f"Rebuilt {rebuilt} hourly counts from the logs")
+    return rebuilt
+
+
+async def save_alerts(alerts: list[dict[str, Any]]) -> None:
+    # Upsert alerts by node, stream, window & template, so re-ingesting
+    # the same logs updates an alert rather than repeating it
+    if not alerts:
+        return
+    try:
+        await Alert.get_motor_collection().bulk_write(
+            [
+                UpdateOne(
+                    {
+                        "node": alert["node"],
+                        "stream": alert.get("stream"),
+                        "window_start": alert["window_start"],
+                        "template": alert["template"],
+                    },
+                    {"$set": alert},
+                    upsert=True,
+                )
+                for alert in alerts
+            ],
+            ordered=False,
+        )
+    except ServerSelectionTimeoutError as err:
+        logger.error(f"ErrorType: {type(err)} - could not save {len(alerts)} alerts")
+        raise err
+    logger.info(f"Saved {len(alerts)} alerts")
+
+
+async def find_alerts(
+    node: str | None = None, start: datetime | None = None, limit: int = 0
+) -> list[Alert]:
+    # Alerts for a node (or all) from start, latest first
+    query: dict[str, Any] = {}
+    if node is not None:
+        query["node"] = node
+    if start is not None:
+        query["window_start"] = {"$gte": start}
+    alerts: list[Alert] = (
+        await Alert.find(query).sort("-window_start").limit(limit).to_list()
+    )
+    logger.debug(f"Found {len(alerts)} alerts for {query}")
+    return alerts
+
+
+async def ingest_watermark() -> tuple[int, str | None]:
+    # The log count (from collection metadata) & highest _id: the count
+    # moves whenever logs are inserted or expired & the _id (which leads
+    # with the log's time) when newer logs arrive; both reads are cheap
+    collection: AsyncIOMotorCollection = JavaLog.get_motor_collection()
+    count: int = await collection.estimated_document_count()
+    latest: dict[str, Any] | None = await collection.find_one(
+        {}, {"_id": 1}, sort=[("_id", -1)]
+    )
+    return count, None if latest is None else str(latest["_id"])
+
+
+def log_file_fields(info: ArchiveInfo, file: Path | str) -> dict[str, Any]:
+    # The LogFile a log belongs to, as its fields
+    return {
+        "collection": info.epoch,
+        "fqdn": info.fqdn,
+        "service": info.log_type,
+        "file": os.path.basename(file),
+        "node": info.node,
+    }
+
+
+async def get_log_file_id(info: ArchiveInfo, file: Path | str) -> PydanticObjectId:
+    # Get or create the LogFile entry for a log, caching its id
+    return await _log_file_id(log_file_fields(info, file))
+
+
+async def _log_file_id(fields: dict[str, Any]) -> PydanticObjectId:
+    key: tuple[int | None, str, str, str] = (
+        fields["collection"],
+        fields["fqdn"],
+        fields["service"],
+        fields["file"],
+    )
+    log_file_id: PydanticObjectId | None = _log_file_ids.get(key)
+    if log_file_id is not None:
+        return log_file_id
+    log_file: dict[str, Any] = {
+        "collection": key[0],
+        "fqdn": key[1],
+        "service": key[2],
+        "file": key[3],
+    }
+    try:
+        document: dict[
+            str, Any
+        ] = await LogFile.get_motor_collection().find_one_and_update(
+            log_file,
+            {"$setOnInsert": {"node": fields["node"]}},
+            projection={"_id": True},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except ServerSelectionTimeoutError as err:
+        logger.error(f"ErrorType: {type(err)} - could not register {key[3]}")
+        raise err
+    log_file_id = PydanticObjectId(document["_id"])
+    _log_file_ids[key] = log_file_id
+    logger.debug(f"LogFile {log_file_id} for {key[3]}")
+    return log_file_id
+
+
+async def find_log_file_ids(
+    collection: int | None = None,
+    fqdn: str | None = None,
+    service: str | None = None,
+    file: str | None = None,
+) -> list[PydanticObjectId]:
+    # Find the LogFile ids matching an origin, to filter logs by log_file
+    query: dict[str, Any] = {
+        key: value
+        for key, value in {
+            "collection": collection,
+            "fqdn": fqdn,
+            "service": service,
+            "file": file,
+        }.items()
+        if value is not None
+    }
+    log_files: list[LogFile] = await LogFile.find(query).to_list()
+    logger.info(f"Found {len(log_files)} log files for {query}")
+    return [log_file.id for log_file in log_files]  # type: ignore
+
+
+async def log_file_query(
+    collection: int | None = None,
+    fqdn: str | None = None,
+    service: str | None = None,
+) -> dict[str, Any]:
+    # The filter on JavaLog.log_file for logs of the matching origin, or {}
+    # when no origin is given
+    if collection is None and fqdn is None and service is None:
+        return {}
+    return {"log_file": {"$in": await find_log_file_ids(collection, fqdn, service)}}
+
+
+def _summarize(logs: list[dict[str, Any]]) -> dict[str, Any]:
+    # Zone map of a batch of log documents: time range plus node & severity
+    # counts
+    timestamps: list[datetime] = [log["datetime"] for log in logs]
+    return {
+        "logs": len(logs),
+        "min_datetime": min(timestamps),
+        "max_datetime": max(timestamps),
+        "nodes": dict(Counter(log["node"] for log in logs)),
+        "severities": dict(Counter(log["severity"] for log in logs)),
+    }
+
+
+async def catalog_batch(
+    path: Path | str,
+    offset: int,
+    logs: list[dict[str, Any]],
+    log_file: PydanticObjectId | None = None,
+    token: str | None = None,
+) -> None:
+    # Record the zone map of an inserted batch & fold it into its file's,
+    # once per token if given; entries are keyed by the LogFile too, as
+    # each collection extracted to a path is a different file
+    if not logs:
+        return
+    summary: dict[str, Any] = _summarize(logs)
+    counts: dict[str, int] = {"logs": summary["logs"]}
+    for field in ("nodes", "severities"):
+        for key, value in summary[field].items():
+            counts[f"{field}.{key}"] = value
+    try:
+        await write_guarded(
+            CatalogEntry.get_motor_collection(),
+            [
+                UpdateOne(
+                    {"path": str(path), "log_file": log_file, "batch": offset},
+                    {"$set": summary},
+                    upsert=True,
+                ),
+                guarded_inc(
+                    {"path": str(path), "log_file": log_file, "batch": None},
+                    counts,
+                    token,
+                    **{
+                        "$min": {"min_datetime": summary["min_datetime"]},
+                        "$max": {"max_datetime": summary["max_datetime"]},
+                    },
+                ),
+            ],
+        )
+    except ServerSelectionTimeoutError as err:
+        logger.error(f"ErrorType: {type(err)} - could not catalog {path}")
+        raise err
+    logger.debug(f"Cataloged {len(logs)} logs of {path} from offset {offset}")
+
+
+async def find_catalog(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    batches: bool = False,
+) -> list[CatalogEntry]:
+    # Find the files (or batches) whose time range overlaps start-end
+    query: dict[str, Any] = {"batch": {"$ne": None} if batches else None}
+    if end is not None:
+        query["min_datetime"] = {"$lte": end}
+    if start is not None:
+        query["max_datetime"] = {"$gte": start}
+    entries: list[CatalogEntry] = await CatalogEntry.find(query).to_list()
+    logger.debug(f"Found {len(entries)} catalog entries between {start} & {end}")
+    return entries
+
+
+async def _time_range_filters(
+    start: datetime | None, end: datetime | None
+) -> list[dict[str, Any]]:
+    # Prune logs to the files the catalog says can overlap the window;
+    # logs inserted without a LogFile are never pruned
+    window: dict[str, datetime] = {}
+    if start is not None:
+        window["$gte"] = start
+    if end is not None:
+        window["$lte"] = end
+    entries: list[CatalogEntry] = await find_catalog(start, end)
+    log_files: list[PydanticObjectId] = [
+        entry.log_file for entry in entries if entry.log_file is not None
+    ]
+    logger.info(f"Pruned query to {len(log_files)} log files between {start} & {end}")
+    return [
+        {"datetime": window},
+        {"$or": [{"log_file": {"$in": log_files}}, {"log_file": None}]},
+    ]
@@ -5,38 +5,59 @@ Creator: JL
 Change Log: 2022-07-26 - added environment settings
 Summary: extract.py handles log file extractions.
 
+Archives may be zip, tar (optionally compressed) or gzip files, and
+zips may be nested inside either. Members are filtered by the
+settings.log_globs patterns and streamed to disk.
+
 It assumes log files have been collected using gbmgm.
 Each node has its own log file with the names of the type:
 GBLogs_node.domain.tld_servicetype_epochtimestamp.zip
 
-Files are extracted into the "System" directory.
-Depending on the type of log, they have different internal name
-formats and different log formats.
+Files are stored under the "System" directory of the archive and
+are flattened into the log dir on extraction; a member whose name is
+already taken is prefixed with its directory. Depending on the type of
+log, they have different internal name formats and different log
+formats.
 
 For example, fanapiservice.zip contains fanapiservice.log and
 smb3_1.log and their rolled versions.
 
-Functions: createLogsOutputDir, extract, extractLog
+Functions: createLogsOutputDir, extract, extractArchive, extractLog, archiveFormat,
+rolledLog
 """
 
 import asyncio
+import fnmatch
+import gzip
 import logging
 import os
+import re
+import shutil
+import tarfile
+import tempfile
 import zipfile
 from pathlib import Path
-from shutil import move
-from typing import Any, Coroutine, Literal
+from typing import IO, Any, Coroutine, Iterator, Literal, Pattern, cast
 
 from aggregator import helper
-from aggregator.config import Settings, get_settings
-from aggregator.helper import ZIP_LOG_TYPE_PATTERN, ZIP_NODE_PATTERN
+from aggregator.config import get_settings
 
 READ: Literal["r"] = "r"
+READ_BINARY: Literal["rb"] = "rb"
+WRITE_BINARY: Literal["wb"] = "wb"
 TYPEERROR: str = "Value should not be None"
-DEFAULT_LOG_EXTENSION: str = "service.log"
+ZIP: str = "zip"
+TAR: str = "tar"
+GZIP: str = "gzip"
+GZIP_MAGIC: bytes = b"\x1f\x8b"
+ZIP_EXTENSION: str = ".zip"
+GZIP_EXTENSION: str = ".gz"
+COPY_BUFFER: int = 1024 * 1024
+ROLLED_LOG_PATTERN: Pattern = re.compile(r"^(.+?[.]log)(\d*)$")
+# An archive's info with the logs extracted from it
+ExtractedArchive = tuple[helper.ArchiveInfo, list[Path]]
 
 logger: logging.Logger = logging.getLogger(__name__)
-settings: Settings = get_settings()
 
 
 def _create_log_dir(target: Path) -> None:
@@ -49,88 +70,204 @@ def _create_log_dir(target: Path) -> None:
     logger.debug(f"Created {target}")
 
 
-def _move_files_to_target(target: Path, source: Path) -> None:
-    # Move log files out of System folder where they are by default
-    tmp_logs_out: Path = Path(os.path.join(target, source))
-    for filename in os.listdir(tmp_logs_out):
-        move(os.path.join(tmp_logs_out, filename), os.path.join(target, filename))
-        logger.debug(f"Moved {filename} from {tmp_logs_out} to {target}")
+def _archive_format(archive: Path) -> str | None:
+    # Detect the archive format from its content rather than its name
+    if zipfile.is_zipfile(archive):
+        return ZIP
+    if tarfile.is_tarfile(archive):
+        return TAR
+    with open(archive, READ_BINARY) as file:
+        if file.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+            return GZIP
+    return None
 
 
-def _remove_folder(target: Path) -> None:
-    # Remove System folder
-    try:
-        os.rmdir(target)
-        logger.debug(f"Removed {target}")
-    except FileNotFoundError as err:
-        logger.error(f"FileNotFoundError: {err}")
-        raise err
+def _match_member(member: str, patterns: list[str]) -> str | None:
+    # Return the first glob the member's basename matches
+    basename: str = os.path.basename(member)
+    for pattern in patterns:
+        if fnmatch.fnmatch(basename, pattern):
+            return pattern
+    return None
+
+
+def rolled_log(log_file: Path | str) -> str:
+    # The live log a file is, or is a rolled version of: svc.log for svc.log3
+    name: str = os.path.basename(log_file)
+    match: re.Match[str] | None = ROLLED_LOG_PATTERN.match(name)
+    return name if match is None else match[1]
+
+
+def _rolled_sort_key(log_file: Path) -> tuple[str, int]:
+    # Order rolled logs oldest first: log9 ... log1, then the live .log
+    match: re.Match[str] | None = ROLLED_LOG_PATTERN.match(log_file.name)
+    if match is None:
+        return log_file.name, 0
+    return match[1], -int(match[2] or 0)
+
+
+def _spool(stream: IO[bytes]) -> IO[bytes]:
+    # Copy a non-seekable member to a temp file so it can be opened as an archive
+    spooled: IO[bytes] = tempfile.TemporaryFile()
+    shutil.copyfileobj(stream, spooled, COPY_BUFFER)
+    spooled.seek(0)
+    return spooled
+
+
+def _iter_nested(
+    member: str, stream: IO[bytes]
+) -> Iterator[tuple[str, str, IO[bytes]]]:
+    # Yield the members of a zip nested in an archive, prefixed with its name
+    with _spool(stream) as nested:
+        if zipfile.is_zipfile(nested):
+            logger.debug(f"Descending into nested zip {member}")
+            with zipfile.ZipFile(nested, READ) as nested_zf:
+                yield from _iter_zip_members(nested_zf, f"{Path(member).stem}_")
+
+
+def _iter_zip_members(
+    zf: zipfile.ZipFile, prefix: str = ""
+) -> Iterator[tuple[str, str, IO[bytes]]]:
+    # Yield (member, target name, stream), descending into nested zips
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        with zf.open(info) as stream:
+            if info.filename.endswith(ZIP_EXTENSION):
+                yield from _iter_nested(info.filename, stream)
+                continue
+            yield info.filename, f"{prefix}{os.path.basename(info.filename)}", stream
+
+
+def _iter_tar_members(tf: tarfile.TarFile) -> Iterator[tuple[str, str, IO[bytes]]]:
+    # Yield (member, target name, stream), descending into nested zips
+    for member in tf:
+        if not member.isfile():
+            continue
+        stream: IO[bytes] | None = tf.extractfile(member)
+        if stream is None:
+            continue
+        with stream:
+            if member.name.endswith(ZIP_EXTENSION):
+                yield from _iter_nested(member.name, stream)
+                continue
+            yield member.name, os.path.basename(member.name), stream
+
+
+def _iter_members(
+    archive: Path, archive_format: str
+) -> Iterator[tuple[str, str, IO[bytes]]]:
+    # Dispatch to the member iterator for the archive format
+    if archive_format == ZIP:
+        with zipfile.ZipFile(archive, READ) as zf:
+            yield from _iter_zip_members(zf)
+    elif archive_format == TAR:
+        with tarfile.open(archive, "r:*") as tf:
+            yield from _iter_tar_members(tf)
+    else:
+        # A bare .gz holds a single file named after the archive
+        name: str = os.path.basename(archive)
+        if name.endswith(GZIP_EXTENSION):
+            name = name[: -len(GZIP_EXTENSION)]
+        with gzip.open(archive, READ) as stream:
+            yield name, name, cast(IO[bytes], stream)
+
+
+def _unique_name(member: str, name: str, taken: set[str]) -> str:
+    # Flattening can give two members one name; prefix a later one with its
+    # directory (& a count if that is taken too) rather than overwrite
+    unique: str = name
+    if unique in taken:
+        parent: str = os.path.dirname(member).strip("/").replace("/", "_")
+        prefix: str = f"{parent}_" if parent else ""
+        unique = f"{prefix}{name}"
+        count: int = 1
+        while unique in taken:
+            unique = f"{prefix}{count}_{name}"
+            count += 1
+        logger.warning(f"{member} would overwrite {name}, extracting it as {unique}")
+    taken.add(unique)
+    return unique
 
 
 async def _extract(
-    zip_file: Path, target_dir: Path, extension: str = DEFAULT_LOG_EXTENSION
+    archive: Path, target_dir: Path, patterns: list[str] | None = None
 ) -> list[Path]:
-    logger.info(f"Starting extraction coroutine for {zip_file}")
+    logger.info(f"Starting extraction coroutine for {archive}")
     log_files: list[Path] = []
+    if patterns is None:
+        patterns = get_settings().log_globs
 
-    if not os.path.exists(zip_file):
-        logger.error(f"FileNotFoundError: {zip_file} is not a file")
+    if not os.path.exists(archive):
+        logger.error(f"FileNotFoundError: {archive} is not a file")
         raise FileNotFoundError
-    elif not zipfile.is_zipfile(zip_file):
-        logger.warning(f"BadZipFile: {zip_file} is a BadZipFile")
+    archive_format: str | None = _archive_format(archive)
+    if archive_format is None:
+        logger.warning(f"BadZipFile: {archive} is a BadZipFile")
         raise zipfile.BadZipFile
 
-    # Find zip files and extract (by default) just  files with .log extension
-    with zipfile.ZipFile(zip_file, READ) as zf:
-        filesInZip: list[str] = zf.namelist()
-        for filename in filesInZip:
-            if os.path.basename(filename).endswith(extension):
-                await asyncio.sleep(0)
-                zf.extract(filename, target_dir)
-                logger.info(
-                    f"Extracted *{extension} generating {filename} at {target_dir}"
-                )
+    # Stream matching members straight into the target dir (no System folder)
+    taken: set[str] = set()
+    for member, name, stream in _iter_members(archive, archive_format):
+        pattern: str | None = _match_member(name, patterns)
+        if pattern is None:
+            continue
+        await asyncio.sleep(0)
+        log_file: Path = Path(
+            os.path.join(target_dir, _unique_name(member, name, taken))
+        )
+        with open(log_file, WRITE_BINARY) as out:
+            shutil.copyfileobj(stream, out, COPY_BUFFER)
+        log_files.append(log_file)
+        logger.info(f"Extracted {pattern} generating {member} at {target_dir}")
 
-        # TODO: Extract move_files_to_target & remove_folder
-        _move_files_to_target(target_dir, Path("System"))
+    logger.info(f"Ending extraction coroutine for {archive}")
+    return sorted(log_files, key=_rolled_sort_key)
 
-        _remove_folder(Path(os.path.join(target_dir, "System")))
 
-        for filename in os.listdir(target_dir):
-            filename = os.path.join(target_dir, filename)
-            log_files.append(Path(filename))
+async def _extract_archive(
+    info: helper.ArchiveInfo, archive: Path, logs_dir: Path
+) -> ExtractedArchive:
+    # Extract an archive, returning its info with the logs it held
+    return info, await _extract(archive, logs_dir)
 
-    logger.info(f"Ending extraction coroutine for {zip_file}")
-    return log_files
+
+def gen_extract_fn(
+    src_dir: Path, zip_file: str | Path
+) -> Coroutine[Any, Any, ExtractedArchive]:
+    # Configures the extraction of one archive into its epoch/node/log_type dir
+    try:
+        info: helper.ArchiveInfo | None = helper.get_archive_info(zip_file)
+        if info is None or info.node is None or info.log_type is None:
+            raise TypeError(TYPEERROR)
+        logs_dir: Path = helper.get_log_dir(info.node, info.log_type, info.epoch)
+        if logs_dir is None:
+            raise TypeError(TYPEERROR)
+    except TypeError as err:
+        logger.error(f"TypeError: {err}")
+        raise err
+
+    _create_log_dir(logs_dir)
+    return _extract_archive(info, Path(os.path.join(src_dir, zip_file)), logs_dir)
 
 
 def gen_zip_extract_fn_list(
     src_dir: Path,
-    zip_files_extract_fn_list: list[Coroutine[Any, Any, list[Path]]] | None = [],
-) -> list[Coroutine[Any, Any, list[Path]]] | None:
+    zip_files_extract_fn_list: list[Coroutine[Any, Any, ExtractedArchive]] | None = [],
+) -> list[Coroutine[Any, Any, ExtractedArchive]] | None:
     # Manages the process of extracting the logs
     # Kicks off the conversion process for each in an await
     # Added options to pass in list values for testing purposes
 
     for zip_file in os.listdir(src_dir):
-        try:
-            node: str = helper.get_node(Path(zip_file), ZIP_NODE_PATTERN)
-            log_type: str = helper.get_log_type(Path(zip_file), ZIP_LOG_TYPE_PATTERN)
-            logs_dir: Path = helper.get_log_dir(node, log_type)
-            if node is None or log_type is None or logs_dir is None:
-                raise TypeError(TYPEERROR)
-        except TypeError as err:
-            logger.error(f"TypeError: {err}")
-            raise err
-
-        _create_log_dir(logs_dir)
-        zip_file = os.path.join(src_dir, zip_file)
+        extract_fn: Coroutine[Any, Any, ExtractedArchive] = gen_extract_fn(
+            src_dir, zip_file
+        )
 
         try:
-            zip_files_extract_fn_list.append(  # type: ignore
-                _extract(Path(zip_file), logs_dir)
-            )
+            zip_files_extract_fn_list.append(extract_fn)  # type: ignore
         except AttributeError as err:
+            extract_fn.close()
             logger.error(f"Attribute Error: {err}")
             raise err
 
@@ -138,9 +275,10 @@ def gen_zip_extract_fn_list(
 
 
 async def extract_log(
-    extract_fn_list: list[Coroutine[Any, Any, list[Path]]],
-    log_files: list[str] = [],
-) -> list[str]:
+    extract_fn_list: list[Coroutine[Any, Any, Any]],
+    log_files: list[Any] = [],
+) -> list[Any]:
+    # Gather the extractions, each an ExtractedArchive from gen_extract_fn
     try:
         new_log_files: list = await asyncio.gather(*extract_fn_list)
         log_files.extend(list(new_log_files))
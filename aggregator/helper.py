@@ -16,33 +16,83 @@ formats and different log formats.
 For example, fanapiservice.zip contains fanapiservice.log and
 smb3_1.log and their rolled versions.
 
-The structure of the .log files is outdir/node/service/log.*
+The structure of the .log files is outdir/epoch/node/service/log.*, so
+collections of the same node & service do not overwrite each other.
 
-Functions: getNode, getLogType, getLogOutputDir,
+Archive names are parsed once into a cached ArchiveInfo, which extract
+returns with the logs it extracted so they are tagged with the archive
+they came from; logs found without one are looked up by their dir.
+
+Classes: ArchiveInfo
+Functions: getNode, getLogType, getLogOutputDir, getArchiveInfo,
+getLogInfo, messageTemplate
 """
 
 import logging
 import os
 import re
+from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Pattern
+from typing import NamedTuple, Pattern
 
 from aggregator.config import Settings, get_settings
 
 ZIP_NODE_PATTERN: Pattern = re.compile(
-    r"^.+[L][o][g][s]_(.+?)([.].+|)_.+_\d{13}[.][z][i][p]$"
+    r"^.+[L][o][g][s]_(.+?)([.].+|)_.+_\d{13}[.](?:zip|tar|tgz|tar[.]gz|gz)$"
 )
 LOG_NODE_PATTERN: Pattern = re.compile(
     r"^.+\/([^\/].+?)([.].+|)\/.+\/.+[.][l][o][g](\d|)$"
 )
 ZIP_LOG_TYPE_PATTERN: Pattern = re.compile(
-    r"^.+[L][o][g][s]_.+_(.+?)_\d{13}[.][z][i][p]$"
+    r"^.+[L][o][g][s]_.+_(.+?)_\d{13}[.](?:zip|tar|tgz|tar[.]gz|gz)$"
 )
 LOG_LOG_TYPE_PATTERN: Pattern = re.compile(r"^.+\/.+\/([^\/].+)\/.+[.][l][o][g](\d|)$")
+ARCHIVE_PATTERN: Pattern = re.compile(
+    r"^(?:.+\/)?[^\/]*[L][o][g][s]_([^\/]+?)([.][^\/]+?|)_(?:[^\/]+_)?([^\/_]+?)"
+    r"_(\d{13})[.](?:zip|tar|tgz|tar[.]gz|gz)$"
+)
+LOG_DIR_PATTERN: Pattern = re.compile(r"^(?:.+\/)?([^\/.]+?)([.][^\/]+|)\/([^\/]+)$")
+TEMPLATE_PATTERNS: list[tuple[Pattern, str]] = [
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (
+        re.compile(
+            r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+            r"[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"
+        ),
+        "<uuid>",
+    ),
+    (re.compile(r"\b\d{1,3}(?:[.]\d{1,3}){3}(?::\d+)?\b"), "<ip>"),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b|\b(?=[a-fA-F]*\d)[0-9a-fA-F]{8,}\b"), "<hex>"),
+    (re.compile(r"\b\d+(?:[.]\d+)?\b"), "<num>"),
+]
 
 
 logger: logging.Logger = logging.getLogger(__name__)
-settings: Settings = get_settings()
+
+
+class ArchiveInfo(NamedTuple):
+    node: str
+    domain: str
+    log_type: str
+    epoch: int | None = None
+
+    @property
+    def collected(self) -> datetime | None:
+        # The collection time encoded in the archive name (epoch millis)
+        if self.epoch is None:
+            return None
+        return datetime.fromtimestamp(self.epoch / 1000, tz=timezone.utc)
+
+    @property
+    def fqdn(self) -> str:
+        return f"{self.node}.{self.domain}" if self.domain else self.node
+
+    def source(self, log_file: Path | str) -> str:
+        # Identify a log by its archive & member, wherever it was extracted
+        return "/".join(
+            [str(self.epoch), self.fqdn, self.log_type, os.path.basename(log_file)]
+        )
 
 
 def get_node(file: Path, pattern: Pattern) -> str:
@@ -73,8 +123,55 @@ def get_log_type(file: Path, pattern: Pattern) -> str:
     return log_type
 
 
-def get_log_dir(node: str, log_type: str) -> Path:
-    # Return the output dir as a path
-    out: Path = Path(os.path.join(settings.outdir, node, log_type))
+def get_log_dir(node: str, log_type: str, epoch: int | None = None) -> Path:
+    # Return the output dir as a path, under the collection epoch if given
+    settings: Settings = get_settings()
+    collection: list[str] = [] if epoch is None else [str(epoch)]
+    out: Path = Path(os.path.join(settings.outdir, *collection, node, log_type))
     logger.debug(f"outdir: {out} from {settings.outdir}, {node}, {log_type}")
     return out
+
+
+def get_archive_info(archive: Path | str) -> ArchiveInfo | None:
+    # Return the info of an archive, parsing each archive name only once
+    return _get_archive_name_info(os.path.basename(archive))
+
+
+@lru_cache(maxsize=None)
+def _get_archive_name_info(archive: str) -> ArchiveInfo | None:
+    # Parse node, domain, log type & collection epoch from an archive name
+    match: re.Match[str] | None = ARCHIVE_PATTERN.match(archive)
+    if match is None:
+        logger.warning(f"Wrong filename structure when getting info from {archive}")
+        return None
+    info: ArchiveInfo = ArchiveInfo(
+        node=match[1],
+        domain=match[2].lstrip("."),
+        log_type=match[3],
+        epoch=int(match[4]),
+    )
+    logger.debug(f"info: {info} from {archive}")
+    return info
+
+
+@lru_cache(maxsize=None)
+def _get_log_dir_info(log_dir: str) -> ArchiveInfo | None:
+    # Parse node & log type from an outdir/node/log_type dir
+    match: re.Match[str] | None = LOG_DIR_PATTERN.match(log_dir)
+    if match is None:
+        logger.warning(f"Wrong filename structure when getting info from {log_dir}")
+        return None
+    return ArchiveInfo(node=match[1], domain=match[2].lstrip("."), log_type=match[3])
+
+
+def get_log_info(log_file: Path | str) -> ArchiveInfo | None:
+    # Parse the info of a log's dir for logs not extracted with their archive
+    return _get_log_dir_info(os.path.normpath(os.path.dirname(log_file)))
+
+
+@lru_cache(maxsize=4096)
+def message_template(message: str) -> str:
+    # Reduce a message to its template by masking the variable parts
+    for pattern, placeholder in TEMPLATE_PATTERNS:
+        message = pattern.sub(placeholder, message)
+    return message
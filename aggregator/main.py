@@ -5,7 +5,7 @@ Creator: JL
 Change Log: 2022-07-26 - added environment settings
 Summary: Main is an async function that inits the database &
 extracts the logs from the source directory
-Functions: main, init, extractLog
+Functions: main, init, ingest, extractLog
 Variables: sourcedir
 """
 
@@ -15,9 +15,20 @@ from pathlib import Path
 from typing import Any, Coroutine, cast
 
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.results import InsertManyResult
 
-from aggregator import config, convert, db, extract, logs, model, view
+from aggregator import (
+    anomaly,
+    checkpoint,
+    config,
+    convert,
+    db,
+    extract,
+    helper,
+    logs,
+    model,
+    spill,
+    view,
+)
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -41,13 +52,20 @@ def _get_settings() -> config.Settings:
     return settings
 
 
-async def _init_db(settings: config.Settings = _get_settings()) -> AsyncIOMotorClient:
-    return await db.init(settings.database, settings.connection)
+async def _init_db(settings: config.Settings | None = None) -> AsyncIOMotorClient:
+    # Settings are resolved on call rather than when main is imported
+    if settings is None:
+        settings = _get_settings()
+    return await db.init(
+        settings.database, settings.connection, settings.get_db_options()
+    )
 
 
 async def init_app(
-    settings: config.Settings = _get_settings(),
+    settings: config.Settings | None = None,
 ) -> tuple[AsyncIOMotorClient, config.Settings]:
+    if settings is None:
+        settings = _get_settings()
 
     # Init database
     client: AsyncIOMotorClient = await _init_db(settings)
@@ -57,40 +75,32 @@ async def init_app(
 
 def _get_zip_extract_coro_list(
     sourcedir: Path,
-) -> list[Coroutine[Any, Any, list[Path]]]:
-    zip_coro_list: list[Coroutine[Any, Any, list[Path]]] = []
+) -> list[Coroutine[Any, Any, extract.ExtractedArchive]]:
+    zip_coro_list: list[Coroutine[Any, Any, extract.ExtractedArchive]] = []
     extract.gen_zip_extract_fn_list(sourcedir, zip_coro_list)
     if zip_coro_list is None or zip_coro_list == []:
         err: str = "Zip extract coroutine list is empty"
         logger.error(f"ValueError: {err}")
         raise ValueError(err)
     else:
-        coro_list: list[Coroutine[Any, Any, list[Path]]] = cast(
-            list[Coroutine[Any, Any, list[Path]]], zip_coro_list
+        coro_list: list[Coroutine[Any, Any, extract.ExtractedArchive]] = cast(
+            list[Coroutine[Any, Any, extract.ExtractedArchive]], zip_coro_list
         )
     return coro_list
 
 
-def _get_convert_coro_list(
-    convert_coro_list: list[Coroutine[Any, Any, list[model.JavaLog]]] = [],
-    log_file_list: list[str] = [],
-) -> list[Coroutine[Any, Any, list[model.JavaLog]]]:
-    for log_list in log_file_list:
-        for file in log_list:
-            convert_coro_list.append(convert.convert(file))
-    return convert_coro_list
-
-
-async def _extract_logs(sourcedir: Path) -> list[str]:
+async def _extract_logs(sourcedir: Path) -> list[extract.ExtractedArchive]:
 
     # Extact logs from source directory
     try:
         # Create list of configured extraction functions for zip extraction
-        zip_coro_list: list[Coroutine[Any, Any, list[Path]]] = (
+        zip_coro_list: list[Coroutine[Any, Any, extract.ExtractedArchive]] = (
             _get_zip_extract_coro_list(sourcedir)
         )
 
-        log_file_list: list[str] = await extract.extract_log(zip_coro_list)
+        log_file_list: list[extract.ExtractedArchive] = await extract.extract_log(
+            zip_coro_list
+        )
     except ValueError as err:
         logger.error(f"ValueError: {err}")
         raise ValueError(f"ValueError: {err}")
@@ -98,26 +108,179 @@ async def _extract_logs(sourcedir: Path) -> list[str]:
     return log_file_list
 
 
-async def _convert_log_files(log_file_list: list[str]) -> list[list[model.JavaLog]]:
-    convert_coro_list: list[Coroutine[Any, Any, list[model.JavaLog]]] = []
-
-    convert_coro_list = _get_convert_coro_list(convert_coro_list, log_file_list)
+async def _write_batch(
+    packed: dict[str, Any],
+    spill_queue: spill.SpillQueue | None = None,
+    write_ahead: bool = False,
+) -> None:
+    # Queue a packed batch for the drainer with write_ahead, else write it
+    if write_ahead and spill_queue is not None:
+        spill_queue.put([packed])
+    else:
+        await db.write_batch(packed, spill_queue)
+
+
+async def _ingest_log_file(
+    file: str,
+    checkpoints: checkpoint.CheckpointStore,
+    batch_size: int,
+    spill_queue: spill.SpillQueue | None = None,
+    write_ahead: bool = False,
+    detector: anomaly.SpikeDetector | None = None,
+    info: helper.ArchiveInfo | None = None,
+) -> int:
+    # Convert a log from its checkpoint & write it in checkpointed batches
+    # as it is parsed; with write_ahead batches are queued on disk & every
+    # db write is left to the drainer, so parsing never waits on the db. A
+    # queued or spilled batch counts as committed. Each batch goes with its
+    # catalog entry, hourly counts & any spikes its stream's detector flags
+    # in it, and logs are tagged with the archive they came from
+    if info is None:
+        info = helper.get_log_info(file)
+    # Checkpoints follow the archive member, not where it was extracted to
+    source: str | None = None
+    if info is not None and info.epoch is not None:
+        source = info.source(file)
+    start: checkpoint.Checkpoint = checkpoints.get(file, source)
+    # Records are identified by the file (its source & first bytes) & where
+    # they end in it, so converting one again never duplicates it
+    key: str = f"{source or file}:{checkpoint.file_head(file, start)}"
+    log_file: dict[str, Any] | None = None
+    if info is not None:
+        log_file = db.log_file_fields(info, file)
+    converted: int = 0
+    batch_start: int = start.offset
+    batch: list[model.LogRecord]
+    batch_offsets: list[int]
+    async for batch, batch_offsets in convert.stream_records(
+        str(file), start.offset, info, batch_size
+    ):
+        for log, end in zip(batch, batch_offsets):
+            log.id = db.record_id(key, end, log.datetime)
+        alerts: list[dict[str, Any]] = []
+        if detector is not None:
+            detector.observe_batch(batch)
+            alerts = detector.take_alerts()
+        packed: dict[str, Any] = db.pack_batch(
+            batch,
+            file,
+            batch_start,
+            db.batch_token(key, batch_start, batch_offsets[-1]),
+            log_file,
+            alerts,
+        )
+        await _write_batch(packed, spill_queue, write_ahead)
+        batch_start = batch_offsets[-1]
+        checkpoints.commit(file, batch_start, len(batch), source)
+        converted += len(batch)
+    return converted
+
+
+def _stream(info: helper.ArchiveInfo, file: Path | str) -> str:
+    # The log stream a file belongs to: its node's log & the rolled files
+    return f"{info.fqdn}/{extract.rolled_log(file)}"
+
+
+async def _ingest_stream(
+    files: list[tuple[helper.ArchiveInfo, str]],
+    checkpoints: checkpoint.CheckpointStore,
+    batch_size: int,
+    spill_queue: spill.SpillQueue | None = None,
+    write_ahead: bool = False,
+    detector: anomaly.SpikeDetector | None = None,
+) -> list[int]:
+    # Ingest a stream's files one after the other, oldest first, so its
+    # detector sees the records in time order, then write the alerts of
+    # its open windows
+    converted: list[int] = []
+    for info, file in files:
+        converted.append(
+            await _ingest_log_file(
+                file,
+                checkpoints,
+                batch_size,
+                spill_queue,
+                write_ahead,
+                detector,
+                info,
+            )
+        )
+    if detector is not None:
+        detector.flush()
+        await _write_batch(
+            db.pack_batch([], alerts=detector.take_alerts()), spill_queue, write_ahead
+        )
+    return converted
+
+
+async def _ingest_log_files(
+    log_file_list: list[extract.ExtractedArchive],
+    checkpoints: checkpoint.CheckpointStore,
+    batch_size: int,
+    spill_queue: spill.SpillQueue | None = None,
+    write_ahead: bool = False,
+    detectors: anomaly.StreamDetectors | None = None,
+) -> list[int]:
+    # Ingest the log streams concurrently, each from its earliest archive
+    # & rolled file on; a stream's detector comes from detectors, which
+    # keeps it for the run
+    streams: dict[str, list[tuple[helper.ArchiveInfo, str]]] = {}
+    for info, log_list in sorted(log_file_list, key=lambda item: item[0].epoch or 0):
+        for file in log_list:
+            streams.setdefault(_stream(info, file), []).append((info, str(file)))
+    ingest_coro_list: list[Coroutine[Any, Any, list[int]]] = [
+        _ingest_stream(
+            files,
+            checkpoints,
+            batch_size,
+            spill_queue,
+            write_ahead,
+            None if detectors is None else detectors.get(stream),
+        )
+        for stream, files in streams.items()
+    ]
 
-    converted_log_lists: list[list[model.JavaLog]] = await asyncio.gather(
-        *convert_coro_list
-    )
+    return [
+        converted
+        for stream_converted in await asyncio.gather(*ingest_coro_list)
+        for converted in stream_converted
+    ]
 
-    return converted_log_lists
 
+async def ingest(settings: config.Settings) -> list[int]:
+    # Extract & ingest everything in settings.sourcedir through the running
+    # client, returning the logs inserted per log file
+    checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+        settings.get_checkpoint_file()
+    )
+    spill_queue: spill.SpillQueue = spill.SpillQueue(
+        settings.get_spill_dir(), settings.spill_segment_size
+    )
+    # The drainer inserts queued & spilled logs alongside the ingest
+    stop: asyncio.Event = asyncio.Event()
+    drainer: asyncio.Task[int] = asyncio.create_task(
+        db.drain_spill(spill_queue, stop, settings.database)
+    )
+    try:
+        log_file_list: list[extract.ExtractedArchive] = await _extract_logs(
+            settings.sourcedir
+        )
 
-async def _insert_logs(
-    converted_log_lists: list[list[model.JavaLog]],
-) -> list[InsertManyResult | None] | None:
-    insert_log_fn_list: list[Coroutine[Any, Any, InsertManyResult | None]] = []
-    for log_lists in converted_log_lists:
-        insert_log_fn_list.append(db.insert_logs(log_lists))
+        result: list[int] = await _ingest_log_files(
+            log_file_list,
+            checkpoints,
+            settings.get_insert_batch_size(),
+            spill_queue,
+            settings.write_ahead,
+            anomaly.StreamDetectors(settings),
+        )
+    finally:
+        stop.set()
+        await drainer
+        checkpoints.close()
 
-    return await asyncio.gather(*insert_log_fn_list)
+    logger.info(f"Inserted {sum(result)} logs from {len(result)} log files")
+    return result
 
 
 async def main() -> None:
@@ -128,20 +291,13 @@ async def main() -> None:
     if not isinstance(client, AsyncIOMotorClient):
         exit()
 
-    log_file_list: list[str] = await _extract_logs(settings.sourcedir)
-
-    converted_log_lists: list[list[model.JavaLog]] = await _convert_log_files(
-        log_file_list
-    )
-
-    result: list[InsertManyResult | None] | None = await _insert_logs(
-        converted_log_lists
-    )
-
-    logger.info(f"Output from db insert: {result}")
+    try:
+        await ingest(settings)
 
-    out: list[model.JavaLog] = await db.find_logs(query={}, sort="-datetime")
-    await view.display_result(out)
+        out: list[model.JavaLog] = await db.find_logs(query={}, sort="-datetime")
+        await view.display_result(out)
+    finally:
+        await db.close()
 
 
 if __name__ == "__main__":
@@ -4,18 +4,175 @@ Created: 2022-07-24
 Creator: JL
 Change Log: Initial
 Summary: model manages the document (log) schema
-Classes: Log, JavaLog
+
+The archive & file a log came from is dictionary encoded: each distinct
+(collection, fqdn, service, file) is stored once as a LogFile and logs
+carry its id, so filtering by collection or service is an index lookup.
+
+The catalog keeps a zone map per ingested file & batch (min/max datetime,
+node & severity counts) so time range queries can skip whole files.
+
+Logs past retention are rolled up into hourly LogSummary counts per
+node, severity & message template before they are deleted. Each batch
+of them is kept as an ExpiryBatch until it is done, so an interrupted
+run finishes it rather than counting it twice; counters record the
+tokens of the batches they counted for the same reason.
+
+HourlyCount keeps the number of stored logs per hour, node & severity,
+incremented as batches are ingested & decremented as they expire, so
+count reports read a few summary documents instead of every log.
+Alerts are the error spikes anomaly flagged while ingesting, one per
+node, window & message template (None for the node's whole count).
+Classes: LogFile, CatalogEntry, LogSummary, ExpiryBatch, HourlyCount, Alert,
+Log, JavaLog, LogRecord
 """
 
+import sys
 from datetime import datetime
-from typing import ClassVar, Optional
+from typing import Any, ClassVar, Optional
 
 import pymongo
-from beanie import Document, Indexed
+from beanie import Document, Indexed, PydanticObjectId
+from pymongo import IndexModel
+
+
+class LogFile(Document):
+    collection: Optional[int] = None  # leads the unique index below
+    fqdn: Indexed(str)  # type: ignore
+    node: str
+    service: Indexed(str)  # type: ignore
+    file: str
+
+    class Settings:
+        name: str = "logfiles"
+        indexes: ClassVar[list[IndexModel]] = [
+            IndexModel(
+                [
+                    ("collection", pymongo.ASCENDING),
+                    ("fqdn", pymongo.ASCENDING),
+                    ("service", pymongo.ASCENDING),
+                    ("file", pymongo.ASCENDING),
+                ],
+                unique=True,
+            )
+        ]
+
+
+class CatalogEntry(Document):
+    path: Indexed(str)  # type: ignore
+    batch: Optional[int] = None  # offset the batch starts at, None per file
+    log_file: Optional[PydanticObjectId] = None
+    logs: int = 0
+    min_datetime: datetime
+    max_datetime: datetime
+    nodes: dict[str, int] = {}
+    severities: dict[str, int] = {}
+    batches: list[str] = []  # tokens of the batches a file entry has counted
+
+    class Settings:
+        name: str = "catalog"
+        indexes: ClassVar[list[IndexModel]] = [
+            # A path is reused by each collection extracted to it
+            IndexModel(
+                [
+                    ("path", pymongo.ASCENDING),
+                    ("log_file", pymongo.ASCENDING),
+                    ("batch", pymongo.ASCENDING),
+                ],
+                unique=True,
+            ),
+            IndexModel(
+                [
+                    ("min_datetime", pymongo.ASCENDING),
+                    ("max_datetime", pymongo.ASCENDING),
+                ]
+            ),
+        ]
+
+
+class LogSummary(Document):
+    hour: datetime
+    node: str
+    severity: str
+    template: str
+    logs: int = 0
+    batches: list[str] = []
+
+    class Settings:
+        name: str = "logsummaries"
+        indexes: ClassVar[list[IndexModel]] = [
+            IndexModel(
+                [
+                    ("hour", pymongo.ASCENDING),
+                    ("node", pymongo.ASCENDING),
+                    ("severity", pymongo.ASCENDING),
+                    ("template", pymongo.ASCENDING),
+                ],
+                unique=True,
+            )
+        ]
+
+
+class ExpiryBatch(Document):
+    severity: str
+    ids: list[PydanticObjectId]
+    summaries: list[dict[str, Any]]  # LogSummary keys & their log counts
+
+    class Settings:
+        name: str = "expirybatches"
+
+
+class HourlyCount(Document):
+    hour: datetime
+    node: str
+    severity: str
+    logs: int = 0
+    batches: list[str] = []
+
+    class Settings:
+        name: str = "hourlycounts"
+        indexes: ClassVar[list[IndexModel]] = [
+            IndexModel(
+                [
+                    ("hour", pymongo.ASCENDING),
+                    ("node", pymongo.ASCENDING),
+                    ("severity", pymongo.ASCENDING),
+                ],
+                unique=True,
+            )
+        ]
+
+
+class Alert(Document):
+    node: str
+    stream: Optional[str] = None  # the log & its rolled files it was seen in
+    window_start: datetime
+    window_end: datetime
+    severities: list[str]
+    template: Optional[str] = None
+    logs: int
+    expected: float
+    score: float
+    detected: datetime
+
+    class Settings:
+        name: str = "alerts"
+        indexes: ClassVar[list[IndexModel]] = [
+            IndexModel(
+                [
+                    ("node", pymongo.ASCENDING),
+                    ("stream", pymongo.ASCENDING),
+                    ("window_start", pymongo.ASCENDING),
+                    ("template", pymongo.ASCENDING),
+                ],
+                unique=True,
+            ),
+            IndexModel([("window_start", pymongo.DESCENDING)]),
+        ]
 
 
 class Log(Document):
-    node: Indexed(str)  # type: ignore
+    node: str
     datetime: datetime
     message: Indexed(str, pymongo.DESCENDING)  # type: ignore
 
@@ -35,9 +192,17 @@ class JavaLog(Log):
     jvm: Optional[str] = None
     source: Optional[Indexed(str)] = None  # type: ignore
     type: Optional[Indexed(str)] = None  # type: ignore
+    log_file: Optional[Indexed(PydanticObjectId)] = None  # type: ignore
 
     class Settings:
         name: str = "javalogs"
+        indexes: ClassVar[list[IndexModel]] = [
+            IndexModel(
+                [("severity", pymongo.ASCENDING), ("datetime", pymongo.ASCENDING)]
+            ),
+            # Walked by each node's cursor in db.merge_logs, in either order
+            IndexModel([("node", pymongo.ASCENDING), ("datetime", pymongo.ASCENDING)]),
+        ]
 
     indexes: ClassVar[list[list[tuple[str, str]]]] = [
         [
@@ -48,3 +213,74 @@ class JavaLog(Log):
             ("type", pymongo.TEXT),
         ]
     ]
+
+
+def _intern(value: str | None) -> str | None:
+    # Share one copy of the low cardinality strings between records
+    return None if value is None else sys.intern(value)
+
+
+class LogRecord:
+    # LogRecord is the lean in-flight form of a JavaLog between convert &
+    # insert; it skips pydantic validation & beanie state tracking
+
+    __slots__ = (
+        "node",
+        "severity",
+        "jvm",
+        "datetime",
+        "source",
+        "type",
+        "message",
+        "log_file",
+        "id",
+    )
+
+    def __init__(
+        self,
+        node: str,
+        severity: str,
+        jvm: str | None,
+        datetime: datetime,
+        source: str | None,
+        type: str | None,
+        message: str,
+        log_file: PydanticObjectId | None = None,
+        id: PydanticObjectId | None = None,
+    ) -> None:
+        if message is None:
+            raise ValueError("LogRecord requires a message")
+        self.node: str = sys.intern(node)
+        self.severity: str = sys.intern(severity)
+        self.jvm: str | None = _intern(jvm)
+        # The argument shadows the datetime class, so it is not re-annotated
+        self.datetime = datetime
+        self.source: str | None = _intern(source)
+        self.type: str | None = _intern(type)
+        self.message: str = message
+        self.log_file: PydanticObjectId | None = log_file
+        self.id: PydanticObjectId | None = id  # the _id it is inserted with
+
+    def __repr__(self) -> str:
+        fields: str = ", ".join(
+            f"{key}={getattr(self, key)!r}" for key in self.__slots__
+        )
+        return f"LogRecord({fields})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, LogRecord):
+            return NotImplemented
+        return all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+    def to_dict(self) -> dict[str, Any]:
+        # The record as a javalogs document for a raw insert
+        d: dict[str, Any] = {key: getattr(self, key) for key in self.__slots__}
+        if d["log_file"] is None:
+            del d["log_file"]
+        log_id: PydanticObjectId | None = d.pop("id")
+        if log_id is not None:
+            d["_id"] = log_id
+        return d
+
+    def to_document(self) -> JavaLog:
+        return JavaLog(**self.to_dict())
@@ -0,0 +1,121 @@
+"""
+Module Name: parsers.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: parsers holds the log formats convert knows how to read.
+
+Each format is a LogParser that declares the precompiled pattern a
+record starts with, how a stitched record is split into the HEADER
+fields and how its timestamp is written. Formats are registered against
+a log type (the service dir, e.g. fanapiservice) and a file name glob,
+and one parser is picked per file, so the per-record work for one format
+never pays for the others. Unmatched files use the Java wrapper format.
+
+smb3 logs are assumed to use the Samba debug layout, a header line
+    [2022/07/11 09:12:55.123456,  3] ../source3/smbd/service.c:1125(fn)
+followed by indented message lines; the debug level maps to severity.
+Classes: LogParser
+Functions: register, getParser
+"""
+
+import fnmatch
+import logging
+import re
+from pathlib import Path
+from typing import Any, Callable, Pattern
+
+from aggregator import helper
+
+HEADER: list[str] = ["severity", "jvm", "datetime", "source", "type", "message"]
+RECORD_START: Pattern[bytes] = re.compile(rb"INFO|WARN|ERROR")
+FIELD_SEPARATOR: bytes = b"|"
+ENCODING: str = "utf-8"
+JAVA_TIMESTAMP: str = "%Y/%m/%d %H:%M:%S"
+
+SMB3_RECORD_START: Pattern[bytes] = re.compile(rb"\[\d{4}/\d{2}/\d{2} ")
+SMB3_RECORD: Pattern[bytes] = re.compile(
+    rb"\[(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})[.\d]*,\s*(\d+)[^\]]*\]\s*"
+    rb"(.*?)(?:; (.*))?$",
+    re.DOTALL,
+)
+SMB3_SEVERITY: dict[int, str] = {0: "ERROR", 1: "WARN"}
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class LogParser:
+    def __init__(
+        self,
+        name: str,
+        record_start: Pattern[bytes],
+        split: Callable[[bytes], dict[str, Any]],
+        timestamp_format: str = JAVA_TIMESTAMP,
+    ) -> None:
+        self.name: str = name
+        self.record_start: Pattern[bytes] = record_start
+        self.split: Callable[[bytes], dict[str, Any]] = split
+        self.timestamp_format: str = timestamp_format
+
+    def __repr__(self) -> str:
+        return f"LogParser({self.name!r})"
+
+
+def split_fields(record: bytes) -> dict[str, Any]:
+    # Split a record into its fields, decoding only the fields present
+    fields: list[bytes] = record.split(FIELD_SEPARATOR, len(HEADER) - 1)
+    d: dict[str, Any] = dict.fromkeys(HEADER)
+    for key, field in zip(HEADER, fields):
+        d[key] = field.strip().decode(ENCODING, errors="replace")
+    return d
+
+
+def _split_smb3(record: bytes) -> dict[str, Any]:
+    d: dict[str, Any] = dict.fromkeys(HEADER)
+    match: re.Match[bytes] | None = SMB3_RECORD.match(record)
+    if match is None:
+        d["message"] = record.decode(ENCODING, errors="replace")
+        return d
+    d["severity"] = SMB3_SEVERITY.get(int(match[2]), "INFO")
+    d["datetime"] = match[1].decode(ENCODING)
+    d["type"] = "smb3"
+    source: str = match[3].strip().decode(ENCODING, errors="replace")
+    if match[4] is None:
+        d["message"] = source
+    else:
+        d["source"] = source
+        d["message"] = match[4].strip().decode(ENCODING, errors="replace")
+    return d
+
+
+JAVA_WRAPPER: LogParser = LogParser("java", RECORD_START, split_fields)
+SMB3: LogParser = LogParser("smb3", SMB3_RECORD_START, _split_smb3)
+
+PARSERS: dict[str, LogParser] = {}
+_RULES: list[tuple[str, str, LogParser]] = []
+
+
+def register(parser: LogParser, log_type: str = "*", file: str = "*") -> LogParser:
+    # Register a parser for files matching the log type & file name globs;
+    # rules are tried in registration order
+    PARSERS[parser.name] = parser
+    _RULES.append((log_type, file, parser))
+    logger.debug(f"Registered {parser} for {log_type}/{file}")
+    return parser
+
+
+def get_parser(log_file: Path, log_type: str | None = None) -> LogParser:
+    # Pick the parser for a log file once, defaulting to the Java wrapper
+    if log_type is None:
+        info: helper.ArchiveInfo | None = helper.get_log_info(log_file)
+        log_type = "" if info is None else info.log_type
+    name: str = Path(log_file).name
+    for type_glob, file_glob, parser in _RULES:
+        if fnmatch.fnmatch(log_type, type_glob) and fnmatch.fnmatch(name, file_glob):
+            logger.debug(f"Parsing {log_file} with {parser}")
+            return parser
+    return JAVA_WRAPPER
+
+
+PARSERS[JAVA_WRAPPER.name] = JAVA_WRAPPER
+register(SMB3, file="smb3*.log*")
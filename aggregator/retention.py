@@ -0,0 +1,162 @@
+"""
+Module Name: retention.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: retention expires old logs so javalogs stops growing forever.
+
+Each severity is kept for settings.retention_days[severity] days. Expired
+logs are read in batches of settings.retention_batch_size, rolled up
+into hourly LogSummary counts per node, severity & message template and
+only then deleted, so historical trends stay queryable at a fraction of
+the size. They also come off the HourlyCount counts as they are deleted.
+Severities without a retention are kept.
+
+There are no transactions, so each batch is first saved as an
+ExpiryBatch with its rollup; the summaries & counts are updated once
+per batch (guarded by its id) before the logs & the ExpiryBatch are
+deleted, and a run finishes any batch a previous run left behind
+before expiring more, so an interrupted run neither loses nor double
+counts logs.
+
+A TTL index would drop logs without the rollup, so this runs as a
+scheduled job every settings.retention_interval seconds instead.
+Functions: rollup, finishPending, applyRetention, retain
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from aggregator import config, db, logs, main
+from aggregator.helper import message_template
+from aggregator.model import ExpiryBatch, JavaLog, LogSummary
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS: dict[str, bool] = {"node": True, "datetime": True, "message": True}
+SUMMARY_KEY: list[str] = ["hour", "node", "severity", "template"]
+
+
+def rollup(
+    documents: list[dict[str, Any]], severity: str
+) -> Counter[tuple[datetime, str, str, str]]:
+    # Count logs per hour, node, severity & message template
+    counts: Counter[tuple[datetime, str, str, str]] = Counter()
+    for document in documents:
+        hour: datetime = document["datetime"].replace(minute=0, second=0, microsecond=0)
+        counts[
+            (hour, document["node"], severity, message_template(document["message"]))
+        ] += 1
+    return counts
+
+
+async def _finish_batch(batch: dict[str, Any]) -> None:
+    # Apply a saved batch's rollup & delete its logs; every step can be
+    # repeated, so a batch left behind by an interrupted run is finished
+    token: str = str(batch["_id"])
+    await db.write_guarded(
+        LogSummary.get_motor_collection(),
+        [
+            db.guarded_inc(
+                {key: summary[key] for key in SUMMARY_KEY},
+                {"logs": summary["logs"]},
+                token,
+            )
+            for summary in batch["summaries"]
+        ],
+    )
+    # The hourly counts only count stored logs
+    hourly: Counter[tuple[datetime, str, str]] = Counter()
+    for summary in batch["summaries"]:
+        hourly[(summary["hour"], summary["node"], summary["severity"])] -= summary[
+            "logs"
+        ]
+    await db.add_hourly_counts(hourly, token)
+    await JavaLog.get_motor_collection().delete_many({"_id": {"$in": batch["ids"]}})
+    await ExpiryBatch.get_motor_collection().delete_one({"_id": batch["_id"]})
+
+
+async def finish_pending() -> int:
+    # Finish the batches an interrupted run left behind, returning how many
+    batches: list[dict[str, Any]] = (
+        await ExpiryBatch.get_motor_collection().find({}).to_list(None)
+    )
+    for batch in batches:
+        logger.warning(f"Finishing expiry batch {batch['_id']} of a previous run")
+        await _finish_batch(batch)
+    return len(batches)
+
+
+async def _expire_batch(severity: str, cutoff: datetime, batch_size: int) -> int:
+    # Roll up & delete one batch of expired logs, returning how many
+    collection: AsyncIOMotorCollection = JavaLog.get_motor_collection()
+    documents: list[dict[str, Any]] = await collection.find(
+        {"severity": severity, "datetime": {"$lt": cutoff}}, ROLLUP_FIELDS
+    ).to_list(batch_size)
+    if not documents:
+        return 0
+    counts: Counter[tuple[datetime, str, str, str]] = rollup(documents, severity)
+    batch: dict[str, Any] = {
+        "_id": ObjectId(),
+        "severity": severity,
+        "ids": [document["_id"] for document in documents],
+        "summaries": [
+            {**dict(zip(SUMMARY_KEY, key)), "logs": count}
+            for key, count in counts.items()
+        ],
+    }
+    await ExpiryBatch.get_motor_collection().insert_one(batch)
+    await _finish_batch(batch)
+    logger.debug(
+        f"Rolled up {len(documents)} {severity} logs into {len(counts)} summaries"
+    )
+    return len(documents)
+
+
+async def apply_retention(
+    retention_days: dict[str, int],
+    batch_size: int,
+    now: datetime | None = None,
+) -> dict[str, int]:
+    # Expire every severity past its retention, returning the counts
+    if now is None:
+        now = datetime.now()
+    await finish_pending()
+    expired: dict[str, int] = {}
+    for severity, days in retention_days.items():
+        cutoff: datetime = now - timedelta(days=days)
+        expired[severity] = 0
+        while True:
+            batch: int = await _expire_batch(severity, cutoff, batch_size)
+            if batch == 0:
+                break
+            expired[severity] += batch
+            await asyncio.sleep(0)
+        logger.info(f"Expired {expired[severity]} {severity} logs older than {cutoff}")
+    return expired
+
+
+async def retain(settings: config.Settings | None = None, once: bool = False) -> None:
+    _, settings = await main.init_app(settings)
+    try:
+        while True:
+            await apply_retention(
+                settings.retention_days, settings.retention_batch_size
+            )
+            if once:
+                break
+            await asyncio.sleep(settings.retention_interval)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+
+    logs.configure_logging()
+    asyncio.run(retain())
@@ -0,0 +1,296 @@
+"""
+Module Name: server.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: server is a small local HTTP service answering log queries as
+JSON, so dashboards can poll the aggregator instead of the database.
+
+    GET /logs?node=&severity=&type=&source=&collection=&fqdn=&service=
+        &start=&end=&sort=&limit=
+    GET /logs/<id>
+    GET /stats?by=severity&<filters>
+    GET /health
+
+The filters match the cli's (severity may be repeated, start & end are
+ISO datetimes, limit defaults to 100 & 0 is as many as
+settings.server_max_limit, which caps every limit). Responses are cached
+in a ResultCache keyed by the normalized request, so the same filters in
+any order or spelling hit the same entry. The ingest watermark is read
+at most every settings.cache_watermark_interval seconds & a change
+drops the cache, so results are never staler than that.
+It is built on asyncio streams, one request per connection, & meant to
+listen on localhost only.
+Classes: QueryServer
+Functions: serve
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from http import HTTPStatus
+from typing import Any, Hashable
+from urllib.parse import SplitResult, parse_qs, urlsplit
+
+import bson
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+
+from aggregator import config, db, export, main
+from aggregator.cache import ResultCache
+from aggregator.model import JavaLog
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+STATS_FIELDS: list[str] = ["severity", "node", "type", "source", "hour"]
+MAX_LIMIT: int = 10000
+REQUEST_TIMEOUT: float = 10.0
+MAX_HEADERS: int = 100
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status: HTTPStatus = status
+
+
+def _one(params: dict[str, list[str]], name: str, default: Any = None) -> Any:
+    # The single value of a parameter
+    values: list[str] = params.get(name, [])
+    if len(values) > 1:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} can only be given once")
+    return values[0] if values else default
+
+
+def _datetime(params: dict[str, list[str]], name: str) -> datetime | None:
+    value: str | None = _one(params, name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} is not an ISO datetime")
+
+
+def _filters(
+    params: dict[str, list[str]], max_limit: int = MAX_LIMIT
+) -> dict[str, Any]:
+    # Parse & normalize the filter parameters; severities are sorted so
+    # the same filters always make the same cache key, & limit is capped
+    # at max_limit (0 too) so no request loads & caches every log
+    severity: list[str] = sorted(set(params.get("severity", [])))
+    if not set(severity) <= set(config.SEVERITIES):
+        raise HTTPError(
+            HTTPStatus.BAD_REQUEST, f"severity must be in {config.SEVERITIES}"
+        )
+    limit: str = _one(params, "limit", str(config.QUERY_LIMIT))
+    if not limit.isdigit():
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "limit must be a whole number")
+    collection: str | None = _one(params, "collection")
+    if collection is not None and not collection.isdigit():
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "collection must be a whole number")
+    return {
+        "node": _one(params, "node"),
+        "severity": severity,
+        "type": _one(params, "type"),
+        "source": _one(params, "source"),
+        "collection": None if collection is None else int(collection),
+        "fqdn": _one(params, "fqdn"),
+        "service": _one(params, "service"),
+        "start": _datetime(params, "start"),
+        "end": _datetime(params, "end"),
+        "sort": _one(params, "sort", "-datetime"),
+        "limit": min(int(limit) or max_limit, max_limit),
+    }
+
+
+async def _query(filters: dict[str, Any]) -> dict[str, Any]:
+    # The mongo filter for the parsed filters; origin filters match the
+    # logs of the LogFiles they pick out
+    query: dict[str, Any] = {
+        field: filters[field]
+        for field in ["node", "type", "source"]
+        if filters[field] is not None
+    }
+    if filters["severity"]:
+        query["severity"] = {"$in": filters["severity"]}
+    query.update(
+        await db.log_file_query(
+            filters["collection"], filters["fqdn"], filters["service"]
+        )
+    )
+    return query
+
+
+def _json(value: Any) -> bytes:
+    return json.dumps(value, default=export.json_value).encode("utf-8")
+
+
+class QueryServer:
+    def __init__(
+        self,
+        cache: ResultCache,
+        watermark_interval: float = 1.0,
+        max_limit: int = MAX_LIMIT,
+    ) -> None:
+        self.cache: ResultCache = cache
+        self.watermark_interval: float = watermark_interval
+        self.max_limit: int = max_limit
+        self.watermark: Hashable = None
+        self.watermark_read: float | None = None
+
+    async def current_watermark(self) -> Hashable:
+        # Read the ingest watermark at most every watermark_interval seconds
+        now: float = time.monotonic()
+        if (
+            self.watermark_read is None
+            or now - self.watermark_read >= self.watermark_interval
+        ):
+            self.watermark = await db.ingest_watermark()
+            self.watermark_read = now
+        return self.watermark
+
+    async def _logs(self, filters: dict[str, Any]) -> bytes:
+        logs: list[dict[str, Any]] = [
+            bson.decode(document.raw)
+            async for document in db.stream_logs(
+                await _query(filters),
+                filters["sort"],
+                filters["start"],
+                filters["end"],
+                filters["limit"],
+            )
+        ]
+        return _json({"count": len(logs), "logs": logs})
+
+    async def _log(self, log_id: str) -> bytes:
+        try:
+            object_id: PydanticObjectId = PydanticObjectId(log_id)
+        except InvalidId:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"{log_id} is not a log id")
+        log: JavaLog | None = await db.get_log(object_id)
+        if log is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No log {log_id}")
+        return _json(
+            log.model_dump(mode="json", by_alias=True, exclude={"revision_id"})
+        )
+
+    async def _stats(self, by: str, filters: dict[str, Any]) -> bytes:
+        if by not in STATS_FIELDS:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"by must be in {STATS_FIELDS}")
+        counts: list[tuple[Any, int]] = await db.count_logs(
+            await _query(filters), by, filters["start"], filters["end"]
+        )
+        return _json(
+            {
+                "by": by,
+                "total": sum(count for _, count in counts),
+                "counts": [{by: value, "logs": count} for value, count in counts],
+            }
+        )
+
+    async def respond(self, method: str, target: str) -> tuple[HTTPStatus, bytes]:
+        # Route a request, answering from the cache where possible
+        if method != "GET":
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Only GET is supported")
+        url: SplitResult = urlsplit(target)
+        path: str = url.path.rstrip("/")
+        params: dict[str, list[str]] = parse_qs(url.query)
+        if path == "/health":
+            return HTTPStatus.OK, _json(
+                {
+                    "status": "ok",
+                    "watermark": await self.current_watermark(),
+                    "cache": self.cache.stats(),
+                }
+            )
+        if path != "/logs" and not path.startswith("/logs/") and path != "/stats":
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No route {path}")
+
+        filters: dict[str, Any] = _filters(params, self.max_limit)
+        by: str = _one(params, "by", "severity")
+        key: str = json.dumps([path, by, filters], default=export.json_value)
+        watermark: Hashable = await self.current_watermark()
+        body: bytes | None = self.cache.get(key, watermark)
+        if body is not None:
+            return HTTPStatus.OK, body
+        if path == "/logs":
+            body = await self._logs(filters)
+        elif path == "/stats":
+            body = await self._stats(by, filters)
+        else:
+            body = await self._log(path[len("/logs/") :])
+        self.cache.put(key, body, watermark)
+        return HTTPStatus.OK, body
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # Read one request, answer it & close the connection
+        status: HTTPStatus
+        body: bytes
+        request_line: bytes = b""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            for _ in range(MAX_HEADERS):
+                header: bytes = await asyncio.wait_for(
+                    reader.readline(), REQUEST_TIMEOUT
+                )
+                if header in (b"\r\n", b"\n", b""):
+                    break
+            parts: list[str] = request_line.decode("latin-1").split()
+            if len(parts) != 3:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+            status, body = await self.respond(parts[0], parts[1])
+        except HTTPError as err:
+            status, body = err.status, _json({"error": str(err)})
+        except asyncio.TimeoutError:
+            status = HTTPStatus.REQUEST_TIMEOUT
+            body = _json({"error": "Timed out reading the request"})
+        except Exception as err:
+            logger.error(f"ErrorType: {type(err)} - request failed: {err}")
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            body = _json({"error": "Internal server error"})
+        writer.write(
+            (
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        logger.debug(f"{status.value} {request_line!r}")
+
+
+async def serve(
+    settings: config.Settings | None = None,
+    host: str | None = None,
+    port: int | None = None,
+) -> None:
+    _, settings = await main.init_app(settings)
+    query_server: QueryServer = QueryServer(
+        ResultCache(settings.cache_size, settings.cache_ttl),
+        settings.cache_watermark_interval,
+        settings.server_max_limit,
+    )
+    server: asyncio.Server = await asyncio.start_server(
+        query_server.handle,
+        host or settings.server_host,
+        port or settings.server_port,
+    )
+    logger.info(
+        "Serving log queries on "
+        f"{', '.join(str(sock.getsockname()) for sock in server.sockets)}"
+    )
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await db.close()
@@ -0,0 +1,183 @@
+"""
+Module Name: spill.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: spill is an on-disk write-ahead queue of logs on their way to
+the database. Ingest appends batches (db.pack_batch) as they are parsed
+& moves on at parse speed while a drainer writes them at whatever rate
+the db sustains, and batches the db would not take are spilled to it
+for replay, so neither a slow nor an unavailable db holds parsed logs in
+memory or loses them.
+
+The queue is a directory of append-only segment files of back-to-back
+BSON documents. Every BSON document starts with its int32 length, so a
+segment needs no other framing. A segment is closed once it passes
+settings.spill_segment_size & the next append starts a new one.
+
+Reads start at a cursor (segment & offset) that only moves, and is only
+saved, when the reader commits, so a restart re-delivers what was read
+but not committed. Documents keep their _id, so re-delivering a batch the
+db did take only hits duplicate keys. A torn write at the end of the
+last segment is truncated on open. One process owns a queue directory.
+
+Documents the db rejects outright (rather than could not take for now)
+are set aside in the rejected subdirectory with the error, so they
+neither block the queue nor are lost.
+Classes: SpillQueue
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import bson
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX: str = ".bson"
+CURSOR_FILE: str = "cursor.json"
+REJECTED_DIR: str = "rejected"
+LENGTH_SIZE: int = 4
+
+
+def _read_document(file: BinaryIO) -> bytes | None:
+    # Read the next whole BSON document, or None at the end or a torn write
+    start: int = file.tell()
+    prefix: bytes = file.read(LENGTH_SIZE)
+    if len(prefix) == LENGTH_SIZE:
+        length: int = int.from_bytes(prefix, "little")
+        rest: bytes = file.read(length - LENGTH_SIZE)
+        if length > LENGTH_SIZE and len(rest) == length - LENGTH_SIZE:
+            return prefix + rest
+    file.seek(start)
+    return None
+
+
+class SpillQueue:
+    def __init__(self, directory: Path, segment_size: int = 64 * 1024 * 1024) -> None:
+        self.directory: Path = Path(directory)
+        self.segment_size: int = segment_size
+        self.head: Path | None = None
+        self.cursor: tuple[str, int] = ("", 0)
+        self.read_to: tuple[str, int] = ("", 0)
+        self.load()
+
+    def load(self) -> None:
+        # Load the cursor & drop any torn write left by a crash
+        cursor_path: Path = Path(self.directory, CURSOR_FILE)
+        if cursor_path.exists():
+            with open(cursor_path, "r") as file:
+                data: dict[str, Any] = json.load(file)
+            self.cursor = (data["segment"], data["offset"])
+        segments: list[Path] = self.segments()
+        if not segments:
+            return
+        with open(segments[-1], "r+b") as file:
+            while _read_document(file) is not None:
+                pass
+            if file.tell() < os.path.getsize(segments[-1]):
+                logger.warning(f"Truncating torn write in {segments[-1]}")
+                file.truncate()
+        logger.info(f"Loaded {len(segments)} spill segments from {self.directory}")
+
+    def segments(self) -> list[Path]:
+        # Segments not yet fully committed, oldest first
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def _new_segment(self) -> Path:
+        # Number segments on from the last one, or the cursor's once drained
+        names: list[str] = [segment.stem for segment in self.segments()]
+        if self.cursor[0]:
+            names.append(Path(self.cursor[0]).stem)
+        seq: int = max(int(name) for name in names) + 1 if names else 0
+        return Path(self.directory, f"{seq:012d}{SEGMENT_SUFFIX}")
+
+    def put(self, documents: list[dict[str, Any]]) -> None:
+        # Append a batch to the head segment, starting a new one when full;
+        # a segment left from an earlier run is never appended to
+        if not documents:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.head is None or os.path.getsize(self.head) >= self.segment_size:
+            self.head = self._new_segment()
+        with open(self.head, "ab") as file:
+            file.write(b"".join(bson.encode(document) for document in documents))
+            file.flush()
+            os.fsync(file.fileno())
+        logger.debug(f"Spilled {len(documents)} logs to {self.head}")
+
+    def set_aside(self, documents: list[dict[str, Any]], reason: str) -> None:
+        # Append documents the db rejected, with why, to the rejected file
+        if not documents:
+            return
+        rejected: Path = Path(self.directory, REJECTED_DIR)
+        rejected.mkdir(parents=True, exist_ok=True)
+        with open(Path(rejected, f"rejected{SEGMENT_SUFFIX}"), "ab") as file:
+            file.write(
+                b"".join(
+                    bson.encode({"error": reason, "document": document})
+                    for document in documents
+                )
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        logger.warning(f"Set aside {len(documents)} rejected documents: {reason}")
+
+    def get(self, max_documents: int) -> list[dict[str, Any]]:
+        # Read up to max_documents from the committed cursor; reading again
+        # before a commit returns the same documents
+        documents: list[dict[str, Any]] = []
+        name: str
+        offset: int
+        name, offset = self.cursor
+        for segment in self.segments():
+            if segment.name < name:
+                continue
+            if segment.name > name:
+                name, offset = segment.name, 0
+            with open(segment, "rb") as file:
+                file.seek(offset)
+                while len(documents) < max_documents:
+                    document: bytes | None = _read_document(file)
+                    if document is None:
+                        break
+                    documents.append(bson.decode(document))
+                offset = file.tell()
+            if len(documents) >= max_documents:
+                break
+        self.read_to = (name, offset)
+        return documents
+
+    def commit(self) -> None:
+        # Move the cursor past what was read & drop fully read segments
+        self.cursor = self.read_to
+        for segment in self.segments():
+            if segment.name < self.cursor[0] or (
+                segment.name == self.cursor[0]
+                and segment != self.head
+                and self.cursor[1] >= os.path.getsize(segment)
+            ):
+                os.remove(segment)
+                logger.debug(f"Removed drained segment {segment}")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path: Path = Path(self.directory, f"{CURSOR_FILE}.tmp")
+        with open(tmp_path, "w") as file:
+            json.dump({"segment": self.cursor[0], "offset": self.cursor[1]}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, Path(self.directory, CURSOR_FILE))
+
+    def pending(self) -> int:
+        # Bytes appended but not yet committed
+        pending: int = 0
+        for segment in self.segments():
+            if segment.name >= self.cursor[0]:
+                pending += os.path.getsize(segment)
+            if segment.name == self.cursor[0]:
+                pending -= self.cursor[1]
+        return pending
@@ -0,0 +1,281 @@
+"""
+Module Name: tail.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: tail ingests live plain-text service logs as they grow.
+
+Each file is followed by inode, so when the service rotates svc.log to
+svc.log1 the rest of the old file is drained before the new svc.log is
+read from its start; a truncated file is re-read from offset 0.
+
+Appended lines go through the same multiline stitching as convert. A
+record is held open until the next severity line arrives or no line has
+been seen for settings.tail_record_timeout seconds, and complete records
+are flushed to the database in micro-batches of at most
+settings.tail_batch_size logs, never older than settings.tail_flush_latency.
+Classes: TailReader, LogTailer, MicroBatch
+Functions: tail
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from pydantic import ValidationError
+
+from aggregator import (
+    anomaly,
+    config,
+    convert,
+    db,
+    extract,
+    logs,
+    main,
+    parsers,
+    spill,
+)
+from aggregator.helper import LOG_NODE_PATTERN
+from aggregator.model import LogRecord
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class TailReader:
+    def __init__(self, path: Path, from_start: bool = False) -> None:
+        self.path: Path = Path(path)
+        self.file: BinaryIO | None = None
+        self.inode: int | None = None
+        self.partial: bytes = b""
+        self.seek_end: bool = not from_start
+
+    def _open(self) -> bool:
+        # Open the current file at the path; only the very first open of a
+        # live file skips what is already there
+        seek_end: bool = self.seek_end
+        self.seek_end = False
+        try:
+            self.file = open(self.path, "rb")
+        except FileNotFoundError:
+            logger.debug(f"Waiting for {self.path} to appear")
+            return False
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if seek_end:
+            self.file.seek(0, os.SEEK_END)
+        logger.info(
+            f"Following {self.path} (inode {self.inode}) from offset "
+            f"{self.file.tell()}"
+        )
+        return True
+
+    def _drain(self) -> list[bytes]:
+        # Read everything appended so far, keeping any unfinished line back
+        if self.file is None:
+            return []
+        data: bytes = self.file.read()
+        if not data:
+            return []
+        lines: list[bytes] = (self.partial + data).split(convert.NEWLINE)
+        self.partial = lines.pop()
+        return lines
+
+    def _close(self) -> list[bytes]:
+        # Close the current file, returning its unterminated last line
+        lines: list[bytes] = self._drain()
+        if self.partial:
+            lines.append(self.partial)
+            self.partial = b""
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        return lines
+
+    def read_lines(self) -> list[str]:
+        # Return the complete lines appended since the last read
+        if self.file is None and not self._open():
+            return []
+        lines: list[bytes] = self._drain()
+        stat: os.stat_result | None
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_ino != self.inode:
+            # Rotated: finish the old inode, then start the new file from 0
+            lines += self._close()
+            logger.info(f"{self.path} was rotated, reopening")
+            if stat is not None and self._open():
+                lines += self._drain()
+        elif self.file is not None and stat.st_size < self.file.tell():
+            logger.warning(f"{self.path} was truncated, reading from 0")
+            self.file.seek(0)
+            self.partial = b""
+            lines += self._drain()
+        return [line.decode(convert.ENCODING, errors="replace") for line in lines]
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+
+
+class LogTailer:
+    def __init__(
+        self, path: Path, record_timeout: float, from_start: bool = False
+    ) -> None:
+        self.path: Path = Path(path)
+        self.reader: TailReader = TailReader(self.path, from_start)
+        self.parser: parsers.LogParser = parsers.get_parser(self.path)
+        self.stitcher: convert.LineStitcher = convert.LineStitcher(
+            self.parser.record_start.pattern.decode()
+        )
+        self.record_timeout: float = record_timeout
+        self.last_line: float = time.monotonic()
+        match = LOG_NODE_PATTERN.match(str(self.path))
+        # Live logs sit outside the extract layout, so default to this host
+        self.node: str = match[1] if match else socket.gethostname()
+
+    def _parse(self, record: str) -> LogRecord | None:
+        d: dict = self.parser.split(record.encode(convert.ENCODING))
+        try:
+            return convert._build_log(d, self.node, LogRecord, self.parser)
+        except (ValueError, ValidationError) as err:
+            logger.exception(f"Error {type(err)} {err}")
+            return None
+
+    def poll(self, now: float | None = None) -> list[LogRecord]:
+        # Return the records completed since the last poll
+        if now is None:
+            now = time.monotonic()
+        records: list[str] = []
+        lines: list[str] = self.reader.read_lines()
+        for line in lines:
+            record: str | None = self.stitcher.feed(line)
+            if record is not None:
+                records.append(record)
+        if lines:
+            self.last_line = now
+        elif self.stitcher.lines and now - self.last_line >= self.record_timeout:
+            logger.debug(f"Closing open record in {self.path} after timeout")
+            records.append(self.stitcher.flush())  # type: ignore
+        return [log for log in map(self._parse, records) if log is not None]
+
+    def close(self) -> list[LogRecord]:
+        # Stop following the file, returning the record left open
+        self.reader.close()
+        record: str | None = self.stitcher.flush()
+        if record is None:
+            return []
+        log: LogRecord | None = self._parse(record)
+        return [] if log is None else [log]
+
+
+class MicroBatch:
+    def __init__(self, batch_size: int, latency: float) -> None:
+        self.batch_size: int = batch_size
+        self.latency: float = latency
+        self.logs: list[LogRecord] = []
+        self.oldest: float = 0.0
+
+    def add(self, logs: list[LogRecord], now: float) -> None:
+        if logs and not self.logs:
+            self.oldest = now
+        self.logs.extend(logs)
+
+    def due(self, now: float) -> bool:
+        # A batch goes out when full or when its oldest log has waited long
+        # enough, which bounds the ingest latency
+        if not self.logs:
+            return False
+        return len(self.logs) >= self.batch_size or now - self.oldest >= self.latency
+
+    def take(self) -> list[LogRecord]:
+        batch: list[LogRecord] = self.logs[: self.batch_size]
+        self.logs = self.logs[self.batch_size :]
+        if not self.logs:
+            self.oldest = 0.0
+        return batch
+
+
+async def _insert(
+    records: list[LogRecord],
+    database: str,
+    spill_queue: spill.SpillQueue,
+    detectors: anomaly.StreamDetectors | None = None,
+) -> None:
+    # Write a batch with its counts & any spikes seen since the last one,
+    # queueing it for the drainer if the db will not take it
+    alerts: list[dict[str, Any]] = []
+    if detectors is not None:
+        alerts = [
+            alert
+            for detector in detectors.detectors.values()
+            for alert in detector.take_alerts()
+        ]
+    await db.write_batch(db.pack_batch(records, alerts=alerts), spill_queue, database)
+
+
+def _observe(
+    tailer: LogTailer,
+    records: list[LogRecord],
+    detectors: anomaly.StreamDetectors,
+) -> list[LogRecord]:
+    # Feed a file's records to its stream's detector before they are
+    # batched with other files', as only one stream's records arrive in
+    # time order
+    detector: anomaly.SpikeDetector | None = detectors.get(
+        f"{tailer.node}/{extract.rolled_log(tailer.path)}"
+    )
+    if detector is not None:
+        detector.observe_batch(records)
+    return records
+
+
+async def tail(paths: list[Path], settings: config.Settings | None = None) -> None:
+    _, settings = await main.init_app(settings)
+    tailers: list[LogTailer] = [
+        LogTailer(path, settings.tail_record_timeout) for path in paths
+    ]
+    batch: MicroBatch = MicroBatch(
+        settings.tail_batch_size, settings.tail_flush_latency
+    )
+    # Live logs go straight to the db for latency; only what the db would
+    # not take is spilled, for the drainer to replay
+    spill_queue: spill.SpillQueue = spill.SpillQueue(
+        settings.get_spill_dir(), settings.spill_segment_size
+    )
+    stop: asyncio.Event = asyncio.Event()
+    drainer: asyncio.Task[int] = asyncio.create_task(
+        db.drain_spill(spill_queue, stop, settings.database)
+    )
+    detectors: anomaly.StreamDetectors = anomaly.StreamDetectors(settings)
+    try:
+        while True:
+            now: float = time.monotonic()
+            for tailer in tailers:
+                batch.add(_observe(tailer, tailer.poll(now), detectors), now)
+            while batch.due(now):
+                await _insert(batch.take(), settings.database, spill_queue, detectors)
+            await asyncio.sleep(settings.tail_interval)
+    finally:
+        for tailer in tailers:
+            batch.logs.extend(_observe(tailer, tailer.close(), detectors))
+        for detector in detectors.detectors.values():
+            detector.flush()
+        while batch.logs:
+            await _insert(batch.take(), settings.database, spill_queue, detectors)
+        await _insert([], settings.database, spill_queue, detectors)
+        stop.set()
+        await drainer
+        await db.close()
+
+
+if __name__ == "__main__":
+
+    logs.configure_logging()
+    asyncio.run(tail([Path(path) for path in sys.argv[1:]]))
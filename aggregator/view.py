@@ -4,66 +4,156 @@ Created: 2022-08-08
 Creator: JL
 Change Log: 2022-08-08 - initial commit
 Summary: view displays the output of any find requests
-Functions: display_results
+
+Rows are laid out in fixed-width columns sized from the first
+settings.view_sample_size rows, so the rest stream without a second
+pass. Values wider than their column (at most settings.view_max_width,
+or settings.view_message_width for the message) are truncated. Lines
+are written a page at a time in one write each, so rendering is linear
+in the number of rows, and with settings.view_page_size set an
+interactive terminal pauses after every page.
+Any row with the log attributes (or keys) can be shown, e.g. JavaLog,
+LogRecord or raw documents.
+Functions: columnWidths, formatRow, render, display_results
 """
 
 import logging
-from datetime import datetime
-
-from beanie import PydanticObjectId
+import sys
+from itertools import chain, islice
+from typing import Any, Callable, Iterable, Iterator, Mapping, TextIO
 
 from aggregator.config import Settings, get_settings
 from aggregator.model import JavaLog
 
-settings: Settings = get_settings()
 logger: logging.Logger = logging.getLogger(__name__)
 
+COLUMNS: list[tuple[str, str]] = [
+    ("ObjectId", "id"),
+    ("Node", "node"),
+    ("Severity", "severity"),
+    ("JVM", "jvm"),
+    ("Timestamp", "datetime"),
+    ("Source", "source"),
+    ("Type", "type"),
+    ("Message", "message"),
+]
+HEADERS: list[str] = [header for header, _ in COLUMNS]
+ELLIPSIS: str = "..."
+
+
+def _values(row: Any) -> list[str]:
+    # The row's column values as text, from attributes or dict keys
+    values: list[str] = []
+    for _, attribute in COLUMNS:
+        if isinstance(row, Mapping):
+            value: Any = row.get("_id" if attribute == "id" else attribute)
+        else:
+            value = getattr(row, attribute, None)
+        values.append("" if value is None else str(value))
+    return values
+
+
+def column_widths(
+    sample: list[list[str]], max_width: int, message_width: int
+) -> list[int]:
+    # Size each column to its widest sampled value, within its limit
+    widths: list[int] = [len(header) for header in HEADERS]
+    for values in sample:
+        for i, value in enumerate(values):
+            if len(value) > widths[i]:
+                widths[i] = len(value)
+    limits: list[int] = [max_width] * (len(COLUMNS) - 1) + [message_width]
+    return [
+        max(min(width, limit), len(ELLIPSIS)) for width, limit in zip(widths, limits)
+    ]
+
+
+def _fit(value: str, width: int) -> str:
+    if len(value) > width:
+        return f"{value[: width - len(ELLIPSIS)]}{ELLIPSIS}"
+    return value
+
+
+def format_row(values: list[str], widths: list[int]) -> str:
+    # Pad every column but the last, which is only truncated
+    cells: list[str] = [
+        _fit(value, width).ljust(width)
+        for value, width in zip(values[:-1], widths[:-1])
+    ]
+    cells.append(_fit(values[-1], widths[-1]))
+    return f"| {' | '.join(cells)}\n"
+
+
+def _rule(widths: list[int]) -> str:
+    dashes: list[str] = ["-" * (width + 2) for width in widths[:-1]]
+    return f"|{'|'.join(dashes)}|{'-' * (len(HEADERS[-1]) + 1)}\n"
+
+
+def _more() -> bool:
+    # Ask whether to show the next page
+    try:
+        return input("-- More (enter to continue, q to quit) --").strip() != "q"
+    except EOFError:
+        return False
+
+
+def render(
+    rows: Iterable[Any],
+    file: TextIO,
+    page_size: int = 0,
+    sample_size: int = 1000,
+    max_width: int = 40,
+    message_width: int = 120,
+    more: Callable[[], bool] | None = None,
+) -> int:
+    # Write rows as a table a page (or sample) at a time, returning how
+    # many were written; more is asked before each page after the first
+    row_iter: Iterator[list[str]] = map(_values, rows)
+    sample: list[list[str]] = list(islice(row_iter, sample_size))
+    widths: list[int] = column_widths(sample, max_width, message_width)
+    chunk_size: int = page_size or sample_size or 1
+    lines: list[str] = [format_row(HEADERS, widths), _rule(widths)]
+    written: int = 0
+    for values in chain(sample, row_iter):
+        lines.append(format_row(values, widths))
+        written += 1
+        if written % chunk_size == 0:
+            file.write("".join(lines))
+            lines = []
+            if page_size and more is not None and not more():
+                return written
+    file.write("".join(lines))
+    file.flush()
+    return written
+
 
 async def display_result(
-    result: list[JavaLog] | JavaLog | None, database: str | None = settings.database
+    result: Iterable[Any] | JavaLog | None,
+    database: str | None = None,
+    page_size: int | None = None,
+    file: TextIO | None = None,
 ) -> None:
-    results: list[JavaLog] = []
     if result is None:
         return None
-    elif isinstance(result, JavaLog):
-        results.append(result)
-    else:
-        results = result
+    rows: Iterable[Any] = [result] if isinstance(result, JavaLog) else result
+    if file is None:
+        file = sys.stdout
+    settings: Settings = get_settings()
+    if database is None:
+        database = settings.database
+    if page_size is None:
+        page_size = settings.view_page_size
+    # Only page when someone is there to turn the pages
+    more: Callable[[], bool] | None = _more if sys.stdin.isatty() else None
 
-    num_logs = len(results)
-
-    logger.info(
-        f"Started display_results coroutine for {num_logs} logs" f"from db: {database}"
-    )
-    headers = (
-        "ObjectId\t\t",
-        "Node",
-        "Severity",
-        "JVM",
-        "Timestamp",
-        "Source",
-        "Type",
-        "Message",
+    logger.info(f"Started display_results coroutine for logs from db: {database}")
+    written: int = render(
+        rows,
+        file,
+        page_size if file.isatty() else 0,
+        settings.view_sample_size,
+        settings.view_max_width,
+        settings.view_message_width,
+        more,
     )
-    out: str = "| "
-    for head in headers:
-        out = f"{out}{head}\t| "
-
-    out = out.strip()
-    out = out + "\n"
-
-    for result in results:
-        id: PydanticObjectId | None = result.id
-        node: str = result.node
-        severity: str = result.severity
-        jvm: str | None = result.jvm
-        timestamp: datetime = result.datetime
-        source: str | None = result.source
-        type: str | None = result.type
-        message: str = result.message
-        out = (
-            f"{out}| {id}\t| {node}\t| {severity}\t| {jvm}\t| "
-            f"{timestamp}\t| {source}\t| {type}\t| {message}\t|\n"
-        )
-
-    print(out)
+    logger.info(f"Displayed {written} logs from db: {database}")
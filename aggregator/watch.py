@@ -0,0 +1,197 @@
+"""
+Module Name: watch.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: watch runs the aggregator as a long-running daemon.
+
+It watches settings.sourcedir for new GBLogs_* archives and feeds each
+one through extract, convert & insert using a single database client,
+so new logs become queryable within seconds of being dropped instead
+of waiting for the next batch run.
+
+Change events come from inotify (via the optional watchfiles package)
+with a polling fallback. An archive is only picked up once its size &
+mtime have been stable for settings.watch_debounce seconds and it is a
+readable archive, so partially written zips are left alone. Finished
+archives are marked in the checkpoint journal, so a restarted watcher
+skips them, and forgotten again once they leave the sourcedir.
+Classes: ArchiveWatcher
+Functions: watch
+"""
+
+import asyncio
+import logging
+import os
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, AsyncIterator, Coroutine
+
+from aggregator import anomaly, checkpoint, config, db, extract, logs, main, spill
+from aggregator.helper import ZIP_NODE_PATTERN
+
+try:
+    from watchfiles import awatch
+except ImportError:  # watchfiles is optional, fall back to polling
+    awatch = None
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ArchiveWatcher:
+    def __init__(
+        self,
+        sourcedir: Path,
+        interval: float,
+        debounce: float,
+        checkpoints: checkpoint.CheckpointStore | None = None,
+    ) -> None:
+        self.sourcedir: Path = Path(sourcedir)
+        self.interval: float = interval
+        self.debounce: float = debounce
+        self.pending: dict[Path, tuple[int, float]] = {}
+        self.checkpoints: checkpoint.CheckpointStore | None = checkpoints
+        self.done: set[Path] = set()
+
+    def finish(self, archive: Path) -> None:
+        # Mark an archive as done with, in the journal if there is one
+        self.done.add(archive)
+        if self.checkpoints is not None and os.path.exists(archive):
+            self.checkpoints.finish_archive(archive.name, os.path.getsize(archive))
+
+    def _is_done(self, archive: Path, size: int) -> bool:
+        if archive in self.done:
+            return True
+        if self.checkpoints is not None and self.checkpoints.archive_done(
+            archive.name, size
+        ):
+            self.done.add(archive)
+            return True
+        return False
+
+    def _forget(self, present: set[Path]) -> None:
+        # Archives that left the sourcedir no longer need to be remembered
+        for archive in self.done - present:
+            self.done.discard(archive)
+            if self.checkpoints is not None:
+                self.checkpoints.forget_archive(archive.name)
+        for archive in set(self.pending) - present:
+            del self.pending[archive]
+
+    def scan(self, now: float | None = None) -> list[Path]:
+        # Return archives that have settled since the last scan, oldest first
+        if now is None:
+            now = time.time()
+        ready: list[tuple[float, Path]] = []
+        present: set[Path] = set()
+        for entry in os.scandir(self.sourcedir):
+            archive: Path = Path(entry.path)
+            if not entry.is_file() or ZIP_NODE_PATTERN.match(str(archive)) is None:
+                continue
+            present.add(archive)
+            stat: os.stat_result = entry.stat()
+            if self._is_done(archive, stat.st_size):
+                continue
+            signature: tuple[int, float] = (stat.st_size, stat.st_mtime)
+            previous: tuple[int, float] | None = self.pending.get(archive)
+            self.pending[archive] = signature
+            if previous != signature or now - stat.st_mtime < self.debounce:
+                logger.debug(f"Waiting for {archive} to settle")
+                continue
+            if extract._archive_format(archive) is None:
+                logger.debug(f"{archive} is not a readable archive yet")
+                continue
+            del self.pending[archive]
+            ready.append((stat.st_mtime, archive))
+        self._forget(present)
+        return [archive for _, archive in sorted(ready)]
+
+    async def changes(self) -> AsyncIterator[list[Path]]:
+        # Yield settled archives on each change event or poll interval
+        yield self.scan()
+        if awatch is not None:
+            logger.info(f"Watching {self.sourcedir} with inotify")
+            async for _ in awatch(
+                self.sourcedir,
+                rust_timeout=int(self.interval * 1000),
+                yield_on_timeout=True,
+            ):
+                yield self.scan()
+        else:
+            logger.info(f"Polling {self.sourcedir} every {self.interval}s")
+            while True:
+                await asyncio.sleep(self.interval)
+                yield self.scan()
+
+
+async def _ingest_archive(
+    archive: Path,
+    checkpoints: checkpoint.CheckpointStore,
+    batch_size: int,
+    spill_queue: spill.SpillQueue | None = None,
+    write_ahead: bool = False,
+    detectors: anomaly.StreamDetectors | None = None,
+) -> int:
+    # Extract one archive & ingest its logs through the running client
+    extract_fn: Coroutine[Any, Any, extract.ExtractedArchive] = extract.gen_extract_fn(
+        archive.parent, archive.name
+    )
+    inserted: list[int] = await main._ingest_log_files(
+        [await extract_fn],
+        checkpoints,
+        batch_size,
+        spill_queue,
+        write_ahead,
+        detectors,
+    )
+    logger.info(f"Ingested {sum(inserted)} logs from {archive}")
+    return sum(inserted)
+
+
+async def watch(settings: config.Settings | None = None) -> None:
+    _, settings = await main.init_app(settings)
+    checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+        settings.get_checkpoint_file()
+    )
+    spill_queue: spill.SpillQueue = spill.SpillQueue(
+        settings.get_spill_dir(), settings.spill_segment_size
+    )
+    stop: asyncio.Event = asyncio.Event()
+    drainer: asyncio.Task[int] = asyncio.create_task(
+        db.drain_spill(spill_queue, stop, settings.database)
+    )
+    # A stream's detector carries on from one archive to the next
+    detectors: anomaly.StreamDetectors = anomaly.StreamDetectors(settings)
+    watcher: ArchiveWatcher = ArchiveWatcher(
+        settings.sourcedir,
+        settings.watch_interval,
+        settings.watch_debounce,
+        checkpoints,
+    )
+    try:
+        async for archives in watcher.changes():
+            for archive in archives:
+                try:
+                    await _ingest_archive(
+                        archive,
+                        checkpoints,
+                        settings.get_insert_batch_size(),
+                        spill_queue,
+                        settings.write_ahead,
+                        detectors,
+                    )
+                except (zipfile.BadZipFile, FileNotFoundError, TypeError) as err:
+                    logger.error(f"ErrorType: {type(err)} - Skipping {archive}")
+                watcher.finish(archive)
+    finally:
+        stop.set()
+        await drainer
+        checkpoints.close()
+        await db.close()
+
+
+if __name__ == "__main__":
+
+    logs.configure_logging()
+    asyncio.run(watch())
@@ -0,0 +1,58 @@
+"""
+Module Name: bench_import.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: bench_import reports what importing each aggregator entry point
+costs, from python -X importtime in a fresh interpreter, with the
+heaviest modules it pulls in. The cli should not load the db side
+(beanie, motor, pymongo) until a command needs it.
+Run: python -m benchmarks.bench_import [modules]
+Functions: importTimes, main
+"""
+
+import subprocess
+import sys
+
+ENTRY_POINTS: list[str] = [
+    "aggregator",
+    "aggregator.config",
+    "aggregator.cli",
+    "aggregator.db",
+    "aggregator.main",
+]
+TOP: int = 5
+
+
+def import_times(module: str) -> dict[str, int]:
+    # Cumulative import time in microseconds for each module loaded
+    result: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(modules: list[str]) -> None:
+    for module in modules:
+        times: dict[str, int] = import_times(module)
+        print(f"{module}: {times[module] / 1000:.0f}ms, {len(times)} modules")
+        heaviest: list[tuple[str, int]] = sorted(
+            ((name, us) for name, us in times.items() if "." not in name),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        for name, us in heaviest[:TOP]:
+            print(f"    {name:<28}{us / 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ENTRY_POINTS)
@@ -0,0 +1,80 @@
+"""
+Module Name: bench_ingest.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: bench_ingest compares the bulk & durable ingest profiles by
+timing how long db.insert_logs takes to write a synthetic set of logs
+with each profile's write concern, ordering & batch size, and how long
+a bulk stream_logs (as export uses) takes to read them back with the
+profile's read preference.
+
+It needs a running MongoDB at settings.connection & writes to a scratch
+database that is dropped afterwards. The gap between the profiles grows
+with replication: on a standalone server majority is the one node, so
+the difference is mostly the journal wait.
+Run: python -m benchmarks.bench_ingest [records]
+"""
+
+import asyncio
+import sys
+import time
+
+from aggregator import config, db
+from aggregator.config import INGEST_PROFILES, Settings
+from aggregator.model import JavaLog, LogRecord
+from benchmarks.bench_records import _fields
+
+DATABASE: str = "bench_ingest"
+
+
+async def _bench_profile(profile: str, logs: list[LogRecord]) -> tuple[float, float]:
+    # Time inserting & reading back the logs with one profile, made the
+    # settings every db call reads for the run
+    settings: Settings = Settings.model_validate(
+        {"ingest_profile": profile, "database": DATABASE}
+    )
+    with config.using(settings):
+        client = await db.init(DATABASE, settings.connection, settings.get_db_options())
+        batch_size: int = settings.get_insert_batch_size()
+        await JavaLog.get_motor_collection().delete_many({})
+        try:
+            start: float = time.perf_counter()
+            for i in range(0, len(logs), batch_size):
+                await db.insert_logs(
+                    logs[i : i + batch_size], DATABASE, settings.get_insert_ordered()
+                )
+            inserted: float = time.perf_counter() - start
+
+            start = time.perf_counter()
+            async for _ in db.stream_logs(
+                {"severity": "ERROR"}, "-datetime", bulk=True
+            ):
+                pass
+            found: float = time.perf_counter() - start
+        finally:
+            await client.drop_database(DATABASE)
+            await db.close()
+    return inserted, found
+
+
+async def _bench(records: int) -> None:
+    logs: list[LogRecord] = [LogRecord(**_fields(i)) for i in range(records)]
+    print(f"Ingest profiles ({records} logs)")
+    for profile, options in INGEST_PROFILES.items():
+        inserted: float
+        found: float
+        inserted, found = await _bench_profile(profile, logs)
+        print(
+            f"  {profile:<8} w={options['w']!s:<9}j={options['journal']!s:<6}"
+            f"ordered={options['ordered']!s:<6}batch={options['batch_size']:<6}"
+            f"{records / inserted:>10.0f} logs/s  stream_logs {found:.2f}s"
+        )
+
+
+def main(records: int = 100000) -> None:
+    asyncio.run(_bench(records))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
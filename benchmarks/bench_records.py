@@ -0,0 +1,100 @@
+"""
+Module Name: bench_records.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: bench_records measures the memory held per in-flight log
+between convert & insert for each record representation, and the
+time convert_records takes to parse a synthetic log.
+
+Field values are shared with the parser output, so the figures are the
+per-record container overhead. JavaLog is built with model_construct
+as full construction needs an initialized database; its figure is
+therefore a lower bound.
+Run: python -m benchmarks.bench_records [records]
+"""
+
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from aggregator import convert
+from aggregator.model import JavaLog, LogRecord
+
+SEVERITIES: list[str] = ["INFO", "WARN", "ERROR"]
+SOURCES: list[str] = [
+    "tld.main.java.cmp.api.impl.Network",
+    "tld.main.java.cmp.file.server.ServiceImpl",
+    "tld.main.java.cmp.database.proxy.ProxyManager",
+]
+TYPES: list[str] = ["SMB", "async", "event", "process"]
+
+
+def _fields(i: int) -> dict[str, Any]:
+    # Fresh strings per record, as the parser produces them
+    return {
+        "node": "".join(["node", "1"]),
+        "severity": "".join(SEVERITIES[i % 3]),
+        "jvm": "".join(["jvm ", "1"]),
+        "datetime": datetime(2022, 7, 11) + timedelta(seconds=i),
+        "source": "".join(SOURCES[i % 3]),
+        "type": "".join(TYPES[i % 4]),
+        "message": f"Exec proxy request {i} completed",
+    }
+
+
+def _bytes_per_record(build: Callable[[dict[str, Any]], Any], records: int) -> float:
+    fields: list[dict[str, Any]] = [_fields(i) for i in range(records)]
+    gc.collect()
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    built: list[Any] = [build(d) for d in fields]
+    after: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del fields
+    assert len(built) == records
+    return (after - before) / records
+
+
+def _write_log(path: str, records: int) -> None:
+    with open(path, "w") as file:
+        for i in range(records):
+            d: dict[str, Any] = _fields(i)
+            file.write(
+                f"{d['severity']} | {d['jvm']} | "
+                f"{d['datetime']:%Y/%m/%d %H:%M:%S} | {d['source']} | "
+                f"{d['type']} | {d['message']}\n"
+            )
+
+
+def main(records: int = 100000) -> None:
+    representations: dict[str, Callable[[dict[str, Any]], Any]] = {
+        "dict (csv.DictReader row)": lambda d: dict(d),
+        "JavaLog (model_construct)": lambda d: JavaLog.model_construct(**d),
+        "LogRecord (__slots__)": lambda d: LogRecord(**d),
+    }
+    print(f"Memory per in-flight record ({records} records)")
+    for name, build in representations.items():
+        print(f"  {name:<28}{_bytes_per_record(build, records):>10.1f} bytes")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path: str = os.path.join(tmp, "node", "svc", "svc.log")
+        os.makedirs(os.path.dirname(path))
+        _write_log(path, records)
+        start: float = time.perf_counter()
+        parsed, _ = asyncio.run(convert.convert_records(path))
+        elapsed: float = time.perf_counter() - start
+    print(
+        f"convert_records parsed {len(parsed)} records in {elapsed:.2f}s "
+        f"({len(parsed) / elapsed:.0f} records/s)"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
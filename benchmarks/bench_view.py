@@ -0,0 +1,56 @@
+"""
+Module Name: bench_view.py
+Created: 2026-10-19
+Creator: JL
+Change Log: Initial
+Summary: bench_view times rendering result sets of growing size with
+view.render against the previous string concatenation display, which
+copied the whole output on every row. Concatenation is quadratic, so it
+is only run up to CONCATENATE_LIMIT rows.
+Run: python -m benchmarks.bench_view [rows]
+"""
+
+import io
+import sys
+import time
+from typing import Any, Callable
+
+from aggregator import view
+from aggregator.model import LogRecord
+from benchmarks.bench_records import _fields
+
+CONCATENATE_LIMIT: int = 20000
+
+
+def _concatenate(rows: list[Any]) -> str:
+    # The previous display_result loop
+    out: str = "| ObjectId\t\t\t| Node\t| Severity\t| JVM\t| Timestamp\t|\n"
+    for row in rows:
+        out = (
+            f"{out}| {None}\t| {row.node}\t| {row.severity}\t| {row.jvm}\t| "
+            f"{row.datetime}\t| {row.source}\t| {row.type}\t| {row.message}\t|\n"
+        )
+    return out
+
+
+def _time(fn: Callable[[], Any]) -> float:
+    start: float = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main(rows: int = 100000) -> None:
+    logs: list[LogRecord] = [LogRecord(**_fields(i)) for i in range(rows)]
+    print(f"{'rows':>8}{'concatenation':>16}{'view.render':>14}")
+    size: int = 5000
+    while size <= rows:
+        concatenated: str = "-"
+        if size <= CONCATENATE_LIMIT:
+            concatenated = f"{_time(lambda: _concatenate(logs[:size])):.2f}s"
+        rendered: float = _time(lambda: view.render(logs[:size], io.StringIO()))
+        print(f"{size:>8}{concatenated:>16}{rendered:>13.2f}s")
+        size *= 2
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
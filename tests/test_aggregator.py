@@ -1,8 +1,47 @@
+import subprocess
+import sys
+
 import pytest
 
 from aggregator import __version__
 
+DB_MODULES: list[str] = ["beanie", "motor", "pymongo"]
+
+
+def _imported(statement: str) -> set[str]:
+    # Modules a fresh interpreter has loaded after running statement
+    result: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-c", f"{statement}; import sys; print(*sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(result.stdout.split())
+
 
 @pytest.mark.unit
 def test_version() -> None:
     assert __version__ == "0.1.0"
+
+
+@pytest.mark.unit
+def test_import_is_lazy() -> None:
+    # Given a fresh interpreter
+    # When the package is imported
+    modules: set[str] = _imported("import aggregator")
+
+    # Then no submodule is loaded until it is used
+    assert not [module for module in modules if module.startswith("aggregator.")]
+    assert "aggregator.db" in _imported("import aggregator; aggregator.db")
+
+
+@pytest.mark.unit
+def test_cli_import_skips_db() -> None:
+    # Given a fresh interpreter
+    # When the cli builds its parser
+    modules: set[str] = _imported(
+        "from aggregator import cli; cli.build_parser().format_help()"
+    )
+
+    # Then the db side is not loaded
+    assert not [module for module in modules if module.split(".")[0] in DB_MODULES]
@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta
+from typing import Any
+
+import pytest
+
+from aggregator import anomaly, config
+from aggregator.model import LogRecord
+
+start: datetime = datetime(2022, 7, 11, 9)
+
+
+def _logs(
+    minute: int,
+    count: int,
+    message: str = "Timeout after 30s",
+    node: str = "node",
+    severity: str = "ERROR",
+) -> list[LogRecord]:
+    return [
+        LogRecord(
+            node=node,
+            severity=severity,
+            jvm="jvm 1",
+            datetime=start + timedelta(minutes=minute, seconds=i % 60),
+            source=None,
+            type=None,
+            message=message,
+        )
+        for i in range(count)
+    ]
+
+
+def _detector(**kwargs) -> anomaly.SpikeDetector:
+    return anomaly.SpikeDetector(min_count=5, warmup=3, **kwargs)
+
+
+@pytest.mark.unit
+def test_sketch_estimates() -> None:
+    # Given a sketch of two keys
+    sketch: anomaly.CountMinSketch = anomaly.CountMinSketch(64, 4)
+    sketch.add("a", 3)
+    sketch.add("b")
+
+    # When they are estimated
+    # Then each is at least its count & blending moves it alpha of the way
+    assert sketch.estimate("a") >= 3
+    assert sketch.estimate("b") >= 1
+    other: anomaly.CountMinSketch = anomaly.CountMinSketch(64, 4)
+    other.blend(sketch, 0.5)
+    assert other.estimate("a") == sketch.estimate("a") / 2
+    sketch.clear()
+    assert sketch.estimate("a") == 0
+
+
+@pytest.mark.unit
+def test_node_spike() -> None:
+    # Given a node logging a few errors a minute
+    detector: anomaly.SpikeDetector = _detector()
+    for minute in range(5):
+        detector.observe_batch(_logs(minute, 3, message=f"Error {minute % 2}"))
+
+    # When a minute has many times as many & the next one starts
+    detector.observe_batch(_logs(5, 40, message="Disk 3 full"))
+    detector.observe_batch(_logs(6, 1))
+
+    # Then the node & the new template are flagged for that minute
+    alerts: list[dict[str, Any]] = detector.take_alerts()
+    assert [(alert["template"], alert["logs"]) for alert in alerts] == [
+        (None, 40),
+        ("Disk <num> full", 40),
+    ]
+    assert alerts[0]["window_start"] == start + timedelta(minutes=5)
+    assert alerts[0]["window_end"] == start + timedelta(minutes=6)
+    assert alerts[0]["severities"] == ["ERROR"]
+    assert alerts[0]["expected"] == 3
+    assert not detector.take_alerts()
+
+
+@pytest.mark.unit
+def test_template_spike() -> None:
+    # Given a node whose error count is steady but made of other templates
+    detector: anomaly.SpikeDetector = _detector()
+    for minute in range(5):
+        detector.observe_batch(_logs(minute, 20, message="Known noise"))
+
+    # When one template makes up the same count
+    detector.observe_batch(_logs(5, 20, message="Connection refused"))
+    detector.flush()
+
+    # Then only the template is flagged
+    alerts: list[dict[str, Any]] = detector.take_alerts()
+    assert [alert["template"] for alert in alerts] == ["Connection refused"]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "minutes,count,severity",
+    [
+        (2, 40, "ERROR"),
+        (5, 4, "ERROR"),
+        (5, 40, "INFO"),
+    ],
+)
+def test_no_alert(minutes: int, count: int, severity: str) -> None:
+    # Given a node in warmup, a burst under min_count or of another severity
+    detector: anomaly.SpikeDetector = _detector()
+    for minute in range(minutes):
+        detector.observe_batch(_logs(minute, 1))
+
+    # When the burst is judged
+    detector.observe_batch(_logs(minutes, count, severity=severity))
+    detector.flush()
+
+    # Then nothing is flagged
+    assert not detector.take_alerts()
+
+
+@pytest.mark.unit
+def test_quiet_windows_decay_history() -> None:
+    # Given a node with a high error rate
+    detector: anomaly.SpikeDetector = _detector()
+    for minute in range(5):
+        detector.observe_batch(_logs(minute, 30))
+
+    # When it is quiet for an hour & then logs the same rate
+    detector.observe_batch(_logs(65, 30))
+    detector.flush()
+
+    # Then the quiet minutes count as zero & the rate is flagged again
+    node: anomaly.NodeWindow = detector.nodes["node"]
+    assert node.windows == 65
+    assert node.mean < 1
+    assert [alert["logs"] for alert in detector.take_alerts()] == [30, 30]
+
+
+@pytest.mark.unit
+def test_interleaved_files() -> None:
+    # Given a node's rotated & current files logging a steady error rate,
+    # ingested concurrently so their batches interleave
+    rotated: list[list[LogRecord]] = [_logs(minute, 3) for minute in range(10)]
+    current: list[list[LogRecord]] = [_logs(minute, 3) for minute in range(10, 20)]
+
+    # When each file's batches go to its own detector
+    detectors: list[anomaly.SpikeDetector] = [_detector(), _detector()]
+    for batches in zip(rotated, current):
+        for detector, batch in zip(detectors, batches):
+            detector.observe_batch(batch)
+
+    # Then neither sees the other's minutes as a spike
+    for detector in detectors:
+        detector.flush()
+        assert not detector.take_alerts()
+        assert detector.late == 0
+
+
+@pytest.mark.unit
+def test_stream_detectors() -> None:
+    # Given the detectors of a run
+    detectors: anomaly.StreamDetectors = anomaly.StreamDetectors(
+        config.Settings(anomaly_min_count=5, anomaly_warmup=3)
+    )
+
+    # When a stream's rolled files are fed to its detector one after another
+    for minute in range(5):
+        detector: anomaly.SpikeDetector | None = detectors.get("node/svc.log")
+        assert detector is not None
+        detector.observe_batch(_logs(minute, 3))
+    first: anomaly.SpikeDetector | None = detectors.get("node/svc.log")
+    assert first is not None
+    first.observe_batch(_logs(5, 40))
+    first.flush()
+
+    # Then its history carries across them, its alerts name the stream &
+    # another stream gets a detector of its own
+    assert [alert["stream"] for alert in first.take_alerts()] == ["node/svc.log"] * 2
+    assert detectors.get("node/smb3_1.log") is not first
+    assert list(detectors.detectors) == ["node/svc.log", "node/smb3_1.log"]
+    assert (
+        anomaly.StreamDetectors(config.Settings(anomaly_detection=False)).get(
+            "node/svc.log"
+        )
+        is None
+    )
+
+
+@pytest.mark.unit
+def test_late_records_dropped() -> None:
+    # Given a node logging a few errors a minute
+    detector: anomaly.SpikeDetector = _detector()
+    for minute in range(5):
+        detector.observe_batch(_logs(minute, 3))
+
+    # When a burst from a minute already judged arrives
+    detector.observe_batch(_logs(1, 40))
+    detector.flush()
+
+    # Then it is dropped rather than counted in the open minute
+    assert not detector.take_alerts()
+    assert detector.late == 40
+    assert detector.nodes["node"].count == 3
+
+
+@pytest.mark.unit
+def test_from_settings() -> None:
+    # Given settings with detection on & off
+    settings: config.Settings = config.Settings(anomaly_window=300, anomaly_warmup=2)
+
+    # When detectors are made from them
+    detector: anomaly.SpikeDetector | None = anomaly.from_settings(settings)
+    settings.anomaly_detection = False
+
+    # Then they follow the settings
+    assert detector is not None
+    assert detector.window == timedelta(minutes=5)
+    assert detector.warmup == 2
+    assert anomaly.from_settings(settings) is None
@@ -0,0 +1,74 @@
+import pytest
+
+from aggregator.cache import ResultCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.unit
+def test_cache_hit_and_miss() -> None:
+    # Given a cache with a result in it
+    cache: ResultCache = ResultCache(2, 60.0)
+    cache.put("a", b"result", 1)
+
+    # When it & a missing key are looked up
+    # Then the result is returned & the missing key misses
+    assert cache.get("a", 1) == b"result"
+    assert cache.get("b", 1) is None
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+
+@pytest.mark.unit
+def test_cache_evicts_least_recently_used() -> None:
+    # Given a full cache whose oldest entry was just used
+    cache: ResultCache = ResultCache(2, 60.0)
+    cache.put("a", 1, 1)
+    cache.put("b", 2, 1)
+    cache.get("a", 1)
+
+    # When another result is stored
+    cache.put("c", 3, 1)
+
+    # Then the least recently used entry is evicted
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get("b", 1) is None
+
+
+@pytest.mark.unit
+def test_cache_ttl() -> None:
+    # Given a cached result
+    clock: Clock = Clock()
+    cache: ResultCache = ResultCache(2, 60.0, clock)
+    cache.put("a", 1, 1)
+
+    # When it is looked up at & past its ttl
+    clock.now = 60.0
+    fresh: int | None = cache.get("a", 1)
+    clock.now = 60.1
+
+    # Then it is returned until it expires
+    assert fresh == 1
+    assert cache.get("a", 1) is None
+    assert not cache.entries
+
+
+@pytest.mark.unit
+def test_cache_watermark_drops_results() -> None:
+    # Given results cached at a watermark
+    cache: ResultCache = ResultCache(4, 60.0)
+    cache.put("a", 1, (10, "id"))
+    cache.put("b", 2, (10, "id"))
+
+    # When a lookup is made after the watermark moved
+    result: int | None = cache.get("a", (11, "new id"))
+
+    # Then every result cached before it is dropped
+    assert result is None
+    assert not cache.entries
+    assert cache.watermark == (11, "new id")
@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Literal
+
+import pytest
+
+from aggregator import checkpoint
+
+module_name: Literal["aggregator.checkpoint"] = "aggregator.checkpoint"
+
+
+@pytest.fixture()
+def log_file(tmp_path: Path) -> Path:
+    file: Path = Path(os.path.join(tmp_path, "fanapiservice.log"))
+    with open(file, "w") as f:
+        f.write("INFO | a\nINFO | b\nINFO | c\n")
+    return file
+
+
+@pytest.fixture()
+def store_path(tmp_path: Path) -> Path:
+    return Path(os.path.join(tmp_path, "state", "checkpoint.json"))
+
+
+@pytest.mark.unit
+def test_get_without_checkpoint(store_path: Path, log_file: Path) -> None:
+    # Given an empty checkpoint store
+    store: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+
+    # When it gets the checkpoint for a file
+    cp: checkpoint.Checkpoint = store.get(log_file)
+
+    # Then it starts from the beginning
+    assert cp.offset == 0
+    assert cp.records == 0
+
+
+@pytest.mark.unit
+def test_commit_survives_reload(store_path: Path, log_file: Path) -> None:
+    # Given a store with two committed batches
+    store: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+    store.commit(log_file, 9, 1)
+    store.commit(log_file, 18, 1)
+
+    # When a new store is loaded from the same path
+    reloaded: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+    cp: checkpoint.Checkpoint = reloaded.get(log_file)
+
+    # Then it resumes after the last committed batch
+    assert cp.offset == 18
+    assert cp.records == 2
+    assert cp.size == os.path.getsize(log_file)
+
+    # And no temp file is left behind
+    assert os.listdir(os.path.dirname(store_path)) == ["checkpoint.json"]
+
+
+@pytest.mark.unit
+def test_get_truncated_file_restarts(
+    store_path: Path, log_file: Path, logger: pytest.LogCaptureFixture
+) -> None:
+    # Given a committed checkpoint
+    store: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+    store.commit(log_file, 27, 3)
+
+    # And the file has since been replaced by a smaller one
+    with open(log_file, "w") as f:
+        f.write("INFO | a\n")
+
+    # When it gets the checkpoint
+    cp: checkpoint.Checkpoint = store.get(log_file)
+
+    # Then it restarts from the beginning
+    assert cp.offset == 0
+
+    # And the logger logs it
+    assert logger.record_tuples[-1] == (
+        module_name,
+        logging.WARNING,
+        f"{log_file} is smaller than when checkpointed, restarting from 0",
+    )
+
+    # And the records restart with it
+    assert store.commit(log_file, 9, 1).records == 1
+
+
+@pytest.mark.unit
+def test_get_replaced_file_restarts(store_path: Path, log_file: Path) -> None:
+    # Given a committed checkpoint
+    store: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+    store.commit(log_file, 18, 2)
+
+    # And the file has since been replaced by a larger one with other logs
+    with open(log_file, "w") as f:
+        f.write("WARN | x\nWARN | y\nWARN | z\nWARN | w\n")
+
+    # When it gets the checkpoint
+    # Then it restarts from the beginning rather than the old offset
+    assert store.get(log_file).offset == 0
+    assert checkpoint.CheckpointStore(store_path).get(log_file).offset == 0
+
+
+@pytest.mark.unit
+def test_checkpoints_keyed_by_source(
+    store_path: Path, log_file: Path, tmp_path: Path
+) -> None:
+    # Given a checkpoint for a member of one archive
+    store: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+    store.commit(log_file, 18, 2, "1/n11/svc/fanapiservice.log")
+
+    # And the same member extracted somewhere else
+    moved: Path = Path(tmp_path, "moved.log")
+    moved.write_bytes(log_file.read_bytes())
+
+    # When it gets the checkpoints by source
+    # Then the same member resumes wherever it is & a newer archive does not
+    assert store.get(moved, "1/n11/svc/fanapiservice.log").offset == 18
+    assert store.get(log_file, "2/n11/svc/fanapiservice.log").offset == 0
+
+
+@pytest.mark.unit
+def test_commit_appends_to_journal(store_path: Path, log_file: Path) -> None:
+    # Given a store with three commits
+    store: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+    for offset in (9, 18, 27):
+        store.commit(log_file, offset, 1)
+    store.close()
+
+    # When the journal is read & the store reloaded
+    with open(store_path, "r") as f:
+        lines: list[str] = f.readlines()
+    checkpoint.CheckpointStore(store_path)
+
+    # Then each commit appended a line
+    assert [json.loads(line)["checkpoint"]["offset"] for line in lines] == [
+        9,
+        18,
+        27,
+    ]
+    # And loading compacted it to one line per checkpoint
+    with open(store_path, "r") as f:
+        assert len(f.readlines()) == 1
+
+
+@pytest.mark.unit
+def test_load_single_dict_file(store_path: Path, log_file: Path) -> None:
+    # Given a checkpoint file in the older single json dict format
+    os.makedirs(os.path.dirname(store_path))
+    with open(store_path, "w") as f:
+        json.dump(
+            {str(log_file): {"path": str(log_file), "offset": 18, "records": 2}}, f
+        )
+
+    # When it loads the store
+    store: checkpoint.CheckpointStore = checkpoint.CheckpointStore(store_path)
+
+    # Then the checkpoints resume
+    assert store.get(log_file).offset == 18
+    assert store.commit(log_file, 27, 1).records == 3
+
+
+@pytest.mark.unit
+def test_load_corrupt_file(store_path: Path, logger: pytest.LogCaptureFixture) -> None:
+    # Given a corrupt checkpoint file
+    os.makedirs(os.path.dirname(store_path))
+    with open(store_path, "w") as f:
+        f.write("{not json")
+
+    # When it loads the store
+    # Then it raises a ValueError
+    with pytest.raises(json.JSONDecodeError):
+        checkpoint.CheckpointStore(store_path)
+
+    # And the logger logs it
+    assert logger.record_tuples[-1][1] == logging.ERROR
@@ -0,0 +1,277 @@
+import argparse
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from aggregator import cli, config, db, export, logs, main
+
+
+def _args(argv: list[str]) -> argparse.Namespace:
+    return cli.build_parser().parse_args(argv)
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_query_filters() -> None:
+    # Given filter options
+    args: argparse.Namespace = _args(
+        [
+            "query",
+            "--node",
+            "node",
+            "--severity",
+            "WARN",
+            "--severity",
+            "ERROR",
+            "--type",
+            "SMB",
+            "--start",
+            "2022-07-11T09:00:00",
+        ]
+    )
+
+    # When the query is built
+    query: dict[str, Any] = await cli._query(args)
+
+    # Then it matches every filter & the time range & defaults are kept
+    assert query == {
+        "node": "node",
+        "severity": {"$in": ["WARN", "ERROR"]},
+        "type": "SMB",
+    }
+    assert args.start == datetime(2022, 7, 11, 9)
+    assert args.end is None
+    assert args.sort == "-datetime"
+    assert args.limit == config.QUERY_LIMIT
+    assert args.format == "table"
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_query_origin_filters(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given origin options & the log files they match
+    calls: list[tuple[Any, ...]] = []
+
+    async def _find_log_file_ids(*args) -> list[str]:
+        calls.append(args)
+        return ["file 1", "file 2"]
+
+    monkeypatch.setattr(db, "find_log_file_ids", _find_log_file_ids)
+    args: argparse.Namespace = _args(
+        ["export", "--collection", "1657530000", "--service", "fanapiservice"]
+    )
+
+    # When the query is built
+    query: dict[str, Any] = await cli._query(args)
+
+    # Then it matches the logs of those log files
+    assert query == {"log_file": {"$in": ["file 1", "file 2"]}}
+    assert calls == [(1657530000, None, "fanapiservice")]
+
+
+@pytest.mark.unit
+def test_parser_rejects_bad_options() -> None:
+    # Given options the parser does not accept
+    # When they are parsed
+    # Then the parser exits
+    with pytest.raises(SystemExit):
+        _args(["query", "--severity", "DEBUG"])
+    with pytest.raises(SystemExit):
+        _args(["export", "--format", "xml"])
+    with pytest.raises(SystemExit):
+        _args(["stats", "--limit", "5"])
+    with pytest.raises(SystemExit):
+        _args(["query", "--start", "yesterday"])
+    with pytest.raises(SystemExit):
+        cli.run(["search", "--regex", "("])
+    with pytest.raises(SystemExit):
+        cli.run(["query", "--merge", "--sort", "node"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_search_escapes_pattern(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given a search for text & one for a regex
+    queries: list[dict[str, Any]] = []
+
+    async def _show(args, settings, query) -> int:
+        queries.append(query)
+        return 0
+
+    monkeypatch.setattr(cli, "_show", _show)
+
+    # When they are run
+    await cli._search(_args(["search", "a.b", "--node", "node"]), config.Settings())
+    await cli._search(_args(["search", "a.b", "--regex"]), config.Settings())
+
+    # Then text is matched literally & the regex as is, ignoring case
+    assert queries == [
+        {"node": "node", "message": {"$regex": r"a\.b", "$options": "i"}},
+        {"message": {"$regex": "a.b", "$options": "i"}},
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_stats(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    # Given counts per severity
+    async def _count_logs(query, by, start, end) -> list[tuple[Any, int]]:
+        assert query == {"node": "node"}
+        assert by == "severity"
+        return [("INFO", 12), ("ERROR", 3)]
+
+    monkeypatch.setattr(db, "count_logs", _count_logs)
+
+    # When stats are run
+    await cli._stats(_args(["stats", "--node", "node"]), config.Settings())
+
+    # Then each count & the total are printed
+    assert capsys.readouterr().out.splitlines() == [
+        "severity       logs",
+        "INFO             12",
+        "ERROR             3",
+        "total            15",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_alerts(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    # Given a node spike & a template spike
+    async def _find_alerts(node, start, limit) -> list[SimpleNamespace]:
+        assert (node, start, limit) == ("node", None, 20)
+        return [
+            SimpleNamespace(
+                window_start=datetime(2022, 7, 11, 9, 5),
+                node="node",
+                logs=40,
+                expected=3.0,
+                score=17.5,
+                template=template,
+            )
+            for template in [None, "Disk <num> full"]
+        ]
+
+    monkeypatch.setattr(db, "find_alerts", _find_alerts)
+
+    # When alerts are shown
+    await cli._alerts(_args(["alerts", "--node", "node"]), config.Settings())
+
+    # Then each is a row & node spikes have no template
+    lines: list[str] = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == [
+        "window",
+        "node",
+        "logs",
+        "expected",
+        "score",
+        "template",
+    ]
+    assert lines[1].split() == [
+        "2022-07-11",
+        "09:05:00",
+        "node",
+        "40",
+        "3.0",
+        "17.5",
+        "*",
+    ]
+    assert lines[2].endswith("17.5 Disk <num> full")
+
+
+@pytest.mark.unit
+@pytest.mark.mock
+def test_settings_overrides(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given environment settings & ingest options
+    settings: config.Settings = config.Settings()
+    monkeypatch.setattr(config, "get_settings", lambda: settings)
+    args: argparse.Namespace = _args(
+        [
+            "--database",
+            "other",
+            "ingest",
+            "--workers",
+            "4",
+            "--profile",
+            "bulk",
+            "--no-write-ahead",
+        ]
+    )
+
+    # When the settings for the run are resolved
+    result: config.Settings = cli._settings(args)
+
+    # Then the options given override a copy of them & the rest are kept
+    assert result is not settings
+    assert settings.database == "logs"
+    assert settings.write_ahead is True
+    assert result.database == "other"
+    assert result.parse_workers == 4
+    assert result.ingest_profile == "bulk"
+    assert result.write_ahead is False
+    assert result.insert_batch_size is None
+
+
+@pytest.mark.unit
+@pytest.mark.mock
+def test_run_export(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    # Given an export command & no database
+    calls: list[Any] = []
+
+    async def _init_app(settings) -> tuple[None, config.Settings]:
+        calls.append("init")
+        return None, settings
+
+    async def _close() -> None:
+        calls.append("close")
+
+    async def _export_logs(*args) -> int:
+        calls.append(args)
+        return 2
+
+    monkeypatch.setattr(config, "get_settings", config.Settings)
+    monkeypatch.setattr(logs, "configure_logging", lambda: None)
+    monkeypatch.setattr(main, "init_app", _init_app)
+    monkeypatch.setattr(db, "close", _close)
+    monkeypatch.setattr(export, "export_logs", _export_logs)
+    output: Path = Path(tmp_path, "logs.csv")
+
+    # When it is run
+    result: int = cli.run(
+        ["export", "--format", "csv", "--output", str(output), "--severity", "ERROR"]
+    )
+
+    # Then the logs are exported between opening & closing the client
+    assert result == 0
+    assert calls == [
+        "init",
+        (
+            {"severity": {"$in": ["ERROR"]}},
+            "-datetime",
+            output,
+            "csv",
+            None,
+            None,
+            0,
+            False,
+        ),
+        "close",
+    ]
+
+
+@pytest.mark.unit
+def test_export_formats() -> None:
+    # Given the formats the cli offers without loading export
+    # Then they are the ones export writes
+    assert cli.EXPORT_FORMATS == list(export.EXPORTERS)
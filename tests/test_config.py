@@ -4,6 +4,7 @@ from pathlib import Path
 
 import pytest
 
+from aggregator import config
 from aggregator.config import Settings
 
 settings: Settings = Settings()
@@ -61,6 +62,75 @@ def test_settings_get_testing_from_test_conf(settings_override: Settings) -> Non
         (settings.get_testdatadir(), Path("./testsource")),
         (settings.get_database(), "logs"),
         (settings.get_log_level(), logging.INFO),
+        (settings.get_log_globs(), ["*.log", "*.log[0-9]"]),
+        (settings.get_parse_workers(), 0),
+        (settings.get_parse_chunk_size(), 64 * 1024 * 1024),
+        (settings.get_checkpoint_file(), Path("./out/checkpoint.json")),
+        (settings.get_insert_batch_size(), 10000),
+        (settings.get_insert_retries(), 3),
+        (settings.get_insert_retry_backoff(), 0.5),
+        (settings.get_spill_dir(), Path("./out/spill")),
+        (settings.get_spill_segment_size(), 64 * 1024 * 1024),
+        (settings.get_spill_drain_interval(), 1.0),
+        (settings.get_write_ahead(), True),
+        (settings.get_view_page_size(), 0),
+        (settings.get_view_sample_size(), 1000),
+        (settings.get_view_max_width(), 40),
+        (settings.get_view_message_width(), 120),
+        (settings.get_export_batch_size(), 10000),
+        (settings.get_export_buffer_size(), 1024 * 1024),
+        (settings.get_ingest_profile(), "durable"),
+        (settings.get_insert_ordered(), True),
+        (settings.get_read_preference(), "primary"),
+        (settings.get_watch_interval(), 2.0),
+        (settings.get_watch_debounce(), 5.0),
+        (settings.get_tail_interval(), 0.25),
+        (settings.get_tail_flush_latency(), 1.0),
+        (settings.get_tail_record_timeout(), 2.0),
+        (settings.get_tail_batch_size(), 1000),
+        (
+            settings.get_retention_days(),
+            {"INFO": 14, "WARN": 90, "ERROR": 180},
+        ),
+        (settings.get_retention_batch_size(), 10000),
+        (settings.get_retention_interval(), 3600.0),
+        (settings.get_server_host(), "127.0.0.1"),
+        (settings.get_server_port(), 8080),
+        (settings.get_cache_size(), 256),
+        (settings.get_cache_ttl(), 60.0),
+        (settings.get_cache_watermark_interval(), 1.0),
+        (settings.get_log_cache_size(), 1024),
+        (settings.get_log_cache_ttl(), 300.0),
+        (settings.get_anomaly_detection(), True),
+        (settings.get_anomaly_window(), 60.0),
+        (settings.get_anomaly_alpha(), 0.1),
+        (settings.get_anomaly_threshold(), 4.0),
+        (settings.get_anomaly_min_count(), 10),
+        (settings.get_anomaly_warmup(), 5),
+        (settings.get_anomaly_severities(), ["ERROR"]),
+        (settings.get_anomaly_sketch_width(), 1024),
+        (settings.get_anomaly_sketch_depth(), 4),
+        (settings.get_merge_batch_size(), 1000),
+        (settings.get_db_max_pool_size(), 100),
+        (settings.get_db_min_pool_size(), 0),
+        (settings.get_db_max_idle_time_ms(), None),
+        (settings.get_db_compressors(), []),
+        (settings.get_db_write_concern(), "majority"),
+        (settings.get_db_journal(), True),
+        (settings.get_db_connect_timeout_ms(), 20000),
+        (settings.get_db_socket_timeout_ms(), None),
+        (settings.get_db_server_selection_timeout_ms(), 30000),
+        (
+            settings.get_db_options(),
+            {
+                "maxPoolSize": 100,
+                "minPoolSize": 0,
+                "w": "majority",
+                "journal": True,
+                "connectTimeoutMS": 20000,
+                "serverSelectionTimeoutMS": 30000,
+            },
+        ),
     ],
 )
 @pytest.mark.unit
@@ -104,3 +174,43 @@ def test_connection_for_no_user_id() -> None:
 
     # Then the connection log string is the same
     assert env_settings.get_connection_log() == env_settings.get_connection()
+
+
+@pytest.mark.unit
+def test_bulk_ingest_profile() -> None:
+    # Given settings with the bulk ingest profile
+    bulk_settings: Settings = Settings(ingest_profile="bulk")
+
+    # When you check the insert path & read settings
+    # Then they trade durability & freshness for throughput
+    assert bulk_settings.get_db_write_concern() == 1
+    assert bulk_settings.get_db_journal() is False
+    assert bulk_settings.get_insert_ordered() is False
+    assert bulk_settings.get_insert_batch_size() == 50000
+    assert bulk_settings.get_read_preference() == "secondaryPreferred"
+    # But not on the client, so interactive reads stay on the primary
+    assert "readPreference" not in bulk_settings.get_db_options()
+
+    # And explicit settings override the profile
+    bulk_settings = Settings(
+        ingest_profile="bulk", insert_batch_size=500, db_journal=True
+    )
+    assert bulk_settings.get_insert_batch_size() == 500
+    assert bulk_settings.get_db_journal() is True
+    assert bulk_settings.get_db_write_concern() == 1
+
+
+@pytest.mark.unit
+def test_using_settings() -> None:
+    # Given the environment settings & a copy with an option overridden
+    environment: config.Settings = config.get_settings()
+    override: config.Settings = environment.model_copy(update={"database": "other"})
+
+    # When a command runs with the copy
+    with config.using(override):
+        active: config.Settings = config.get_settings()
+
+    # Then it is what settings are read as until it ends
+    assert active is override
+    assert config.get_settings() is environment
+    assert environment.database != "other"
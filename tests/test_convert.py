@@ -1,4 +1,5 @@
 import logging
+import os
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Literal
@@ -7,8 +8,9 @@ import pytest
 from beanie.exceptions import CollectionWasNotInitialized
 from motor.motor_asyncio import AsyncIOMotorClient
 
-from aggregator import convert, db
-from aggregator.model import JavaLog
+from aggregator import convert, db, parsers
+from aggregator.config import get_settings
+from aggregator.model import JavaLog, LogRecord
 
 module_name: Literal["aggregator.convert"] = "aggregator.convert"
 
@@ -172,46 +174,121 @@ def test_yield_matches_ignores_empty_lines() -> None:
 
 @pytest.mark.unit
 @pytest.mark.parametrize("make_logs", ["multi_line_log.log"], indirect=["make_logs"])
-def test_multi_to_single_line(make_logs: str) -> None:
+def test_yield_records(make_logs: str) -> None:
     # Given a logfile with 5 lines & 3 individual logs (multi_line_log)
     log_file: Path = Path(make_logs)
 
-    # When it opens the logfile
-    convert._multi_to_single_line(log_file)
+    # When it maps the logfile
+    records: list[tuple[bytes, int]] = list(convert._yield_records(log_file))
 
-    # Then it converts any multiline logs into single lines
+    # Then it converts any multiline logs into single records
+    assert [record for record, _ in records] == [
+        b"INFO | This is a log",
+        b"ERROR | This is an error log; with multiple lines; and more lines",
+        b"INFO | And this is a separate log",
+    ]
+
+    # And the last record ends at the end of the file
+    assert records[-1][1] == os.path.getsize(log_file)
+
+    # And the file is left untouched
     with open(log_file, "r") as file:
-        lines: int = len(file.readlines())
-    assert lines == 3
+        assert len(file.readlines()) == 5
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("make_logs", ["multi_line_log.log"], indirect=["make_logs"])
+def test_yield_records_from_offset(make_logs: str) -> None:
+    # Given a logfile with 3 individual logs (multi_line_log)
+    log_file: Path = Path(make_logs)
 
-    # And it logs it
-    # TODO: These checks
+    # And the end offset of the first record
+    first_end: int = next(convert._yield_records(log_file))[1]
 
+    # When it maps the logfile from that offset
+    records: list[tuple[bytes, int]] = list(convert._yield_records(log_file, first_end))
 
-# TODO: Add unhappy paths
+    # Then it resumes at the second record
+    assert len(records) == 2
+    assert records[0][0].startswith(b"ERROR | This is an error log")
 
 
 @pytest.mark.unit
-@pytest.mark.parametrize("make_logs", ["multi_line_log.log"], indirect=["make_logs"])
-def test_convert_log_to_csv_success(make_logs: Path) -> None:
-    # Given a logfile with 5 lines & 3 individual logs (multi_line_log)
-    log_file: Path = make_logs
+def test_yield_records_empty_file(tmp_path: Path) -> None:
+    # Given an empty logfile
+    log_file: Path = Path(os.path.join(tmp_path, "empty.log"))
+    log_file.touch()
+
+    # When it maps the logfile
+    # Then it yields nothing
+    assert list(convert._yield_records(log_file)) == []
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "record, expected",
+    [
+        (
+            b"INFO    | jvm 1 | 2022/07/11 09:12:02 | ttl.test | SMB | Exec proxy",
+            ["INFO", "jvm 1", "2022/07/11 09:12:02", "ttl.test", "SMB", "Exec proxy"],
+        ),
+        (
+            b"INFO | jvm 1 | 2022/07/11 09:12:55 | SecondaryMonitor",
+            ["INFO", "jvm 1", "2022/07/11 09:12:55", "SecondaryMonitor", None, None],
+        ),
+        (
+            b"WARN | jvm 1 | 2022/07/11 09:13:01 | ttl | async | a | b",
+            ["WARN", "jvm 1", "2022/07/11 09:13:01", "ttl", "async", "a | b"],
+        ),
+    ],
+)
+def test_split_record(record: bytes, expected: list[str | None]) -> None:
+    # Given a single line record
+    # When it splits the record
+    d: dict[str, Any] = convert._split_record(record)
+
+    # Then it maps each field to the header & keeps pipes in the message
+    assert d == dict(zip(convert.HEADER, expected))
+
 
-    # And it has converted the file to single lines
-    convert._multi_to_single_line(log_file)
+@pytest.mark.unit
+def test_build_log_short_line() -> None:
+    # Given a split wrapper record with only a message after the timestamp
+    d: dict[str, Any] = convert._split_record(
+        b"INFO | jvm 1 | 2022/07/11 09:12:55 | SecondaryMonitor"
+    )
 
-    # When it tries to convert the CSV log file to a dict
-    result: list[dict[str | Any, str | Any]] = convert._convert_log_to_csv(log_file)
+    # When it builds the log
+    log: LogRecord = convert._build_log(d, "node", LogRecord)
 
-    # Then it succeeds
-    assert isinstance(result, list)
-    assert isinstance(result[0], dict)
+    # Then the text is moved from the source to the message
+    assert log.source is None
+    assert log.message == "SecondaryMonitor"
+    assert log.datetime == datetime(2022, 7, 11, 9, 12, 55)
 
-    # TODO: Improve checks
-    # And add logging
 
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_convert_records_skips_record_without_timestamp(
+    logger: pytest.LogCaptureFixture, tmp_path: Path, mock_get_node: str
+) -> None:
+    # Given a wrapper log with a record that has no timestamp
+    log_file: Path = Path(os.path.join(tmp_path, "svc.log"))
+    log_file.write_text(
+        "INFO | jvm 1\nINFO | jvm 1 | 2022/07/11 09:12:55 | SecondaryMonitor\n"
+    )
+
+    # When it converts the logs
+    records: list[LogRecord]
+    records, _ = await convert.convert_records(str(log_file))
 
-# TODO: Add unhappy paths
+    # Then the record is skipped & logged as a ValueError (a TypeError from
+    # strptime before parsers existed) & the rest are converted
+    assert [record.message for record in records] == ["SecondaryMonitor"]
+    assert any(
+        message.startswith("Error <class 'ValueError'> No timestamp")
+        for _, _, message in logger.record_tuples
+    )
 
 
 @pytest.mark.unit
@@ -408,3 +485,128 @@ async def test_convert_bad_timestamp(
         # Set manual teardown
         client: AsyncIOMotorClient = AsyncIOMotorClient(conn)
         await client.drop_database(database)
+
+
+@pytest.fixture()
+def big_log(tmp_path: Path, testdata_log_dir: str) -> Path:
+    # A log made of many copies of simple_svc.log (with multi-line records)
+    with open(os.path.join(testdata_log_dir, "simple_svc.log"), "rb") as f:
+        content: bytes = f.read().rstrip(b"\n") + b"\n"
+    log_file: Path = Path(os.path.join(tmp_path, "big.log"))
+    with open(log_file, "wb") as f:
+        f.write(content * 200)
+    return log_file
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("chunk_size", [1, 100, 4096, 10**9])
+def test_chunk_offsets_align_to_records(big_log: Path, chunk_size: int) -> None:
+    # Given a big log & a chunk size
+    # When it splits the log into chunks
+    chunks: list[tuple[int, int]] = convert._chunk_offsets(big_log, chunk_size)
+
+    # Then the chunks cover the file without gaps
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == os.path.getsize(big_log)
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+
+    # And each chunk starts on a record
+    with open(big_log, "rb") as f:
+        content: bytes = f.read()
+    assert all(
+        convert.RECORD_START.match(content[start:stop].lstrip())
+        for start, stop in chunks
+    )
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_parse_chunks_matches_sequential(big_log: Path) -> None:
+    # Given the records of a big log parsed sequentially
+    expected: list[tuple[dict[str, Any], int]] = [
+        (parsers.JAVA_WRAPPER.split(record), end)
+        for record, end in convert._yield_records(big_log)
+    ]
+
+    # When it parses the log in chunks across workers
+    parsed: list[tuple[dict[str, Any], int]] = await convert._parse_chunks(
+        big_log, 4096, 2
+    )
+
+    # Then it returns the same records & offsets in the same order
+    assert len(parsed) == 1000
+    assert parsed == expected
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_parse_chunks_from_offset(big_log: Path) -> None:
+    # Given the end offset of the 10th record of a big log
+    records: list[tuple[bytes, int]] = list(convert._yield_records(big_log))
+    start: int = records[9][1]
+
+    # When it parses the log in chunks from that offset
+    parsed: list[tuple[dict[str, Any], int]] = await convert._parse_chunks(
+        big_log, 4096, 2, start
+    )
+
+    # Then it skips the first 10 records
+    assert [end for _, end in parsed] == [end for _, end in records[10:]]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+@pytest.mark.parametrize("make_logs", ["simple_svc.log"], indirect=["make_logs"])
+async def test_convert_records(make_logs: Path, mock_get_node: str) -> None:
+    # Given a target log file
+    tgt_log_file: Path = make_logs
+
+    # When it converts the logs to records (without a database)
+    records: list[LogRecord]
+    offsets: list[int]
+    records, offsets = await convert.convert_records(str(tgt_log_file))
+
+    # Then it returns a lean record & end offset per log
+    assert len(records) == 5
+    assert all(isinstance(record, LogRecord) for record in records)
+    assert offsets == sorted(offsets)
+    assert offsets[-1] == os.path.getsize(tgt_log_file)
+    assert [record.severity for record in records] == [
+        "INFO",
+        "INFO",
+        "WARN",
+        "ERROR",
+        "INFO",
+    ]
+    # And the source only log has its source moved to the message
+    assert records[1].source is None
+    assert records[1].message.startswith("SecondaryMonitor")
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+@pytest.mark.parametrize("workers", [1, 2])
+async def test_stream_records_batches(
+    monkeypatch: pytest.MonkeyPatch, big_log: Path, mock_get_node: str, workers: int
+) -> None:
+    # Given a big log parsed in process or in chunks across workers
+    monkeypatch.setattr(get_settings(), "parse_workers", workers)
+    monkeypatch.setattr(get_settings(), "parse_chunk_size", 4096)
+    expected: list[LogRecord]
+    offsets: list[int]
+    expected, offsets = await convert.convert_records(str(big_log), 100)
+
+    # When it streams the records in batches of 300
+    batches: list[tuple[list[LogRecord], list[int]]] = [
+        batch async for batch in convert.stream_records(str(big_log), 100, None, 300)
+    ]
+
+    # Then the batches hold the same records & offsets in order
+    assert [len(records) for records, _ in batches] == [
+        300,
+        300,
+        300,
+        len(expected) - 900,
+    ]
+    assert [record for records, _ in batches for record in records] == expected
+    assert [end for _, ends in batches for end in ends] == offsets
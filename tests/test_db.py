@@ -1,22 +1,34 @@
+import asyncio
 import logging
+from collections import Counter
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Coroutine, Literal, NoReturn
+from types import SimpleNamespace
+from typing import Any, Coroutine, Iterator, Literal, NoReturn, cast
 
 import beanie
+import bson
 import motor.motor_asyncio
 import pytest
 from beanie import PydanticObjectId
-from beanie.odm.operators.find import BaseFindOperator
 from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
 from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import ValidationError
-from pymongo.errors import InvalidOperation, ServerSelectionTimeoutError
+from pymongo import ReadPreference, UpdateOne
+from pymongo.errors import (
+    AutoReconnect,
+    BulkWriteError,
+    InvalidOperation,
+    OperationFailure,
+    ServerSelectionTimeoutError,
+)
 from pymongo.results import InsertManyResult
 from pytest_mock_resources import create_mongo_fixture
 
-from aggregator import convert, db
-from aggregator.model import JavaLog
+from aggregator import config, convert, db, helper, spill
+from aggregator.config import get_settings
+from aggregator.model import Alert, CatalogEntry, HourlyCount, JavaLog, LogRecord
 
 module_name: Literal["aggregator.db"] = "aggregator.db"
 wrong_id: PydanticObjectId = PydanticObjectId("608da169eb9e17281f0ab2ff")
@@ -131,7 +143,7 @@ async def test_init_server_timeout(
 
     finally:
         # Set manual teardown
-        client = AsyncIOMotorClient(conn)
+        client: AsyncIOMotorClient = AsyncIOMotorClient(conn)
         await client.drop_database(database)
 
 
@@ -533,7 +545,7 @@ async def test_get_log_server_timeout(
     def mock_javalog_server_timeout(*args, **kwargs):
         return MockJavaLog.server_timeout()
 
-    monkeypatch.setattr(JavaLog, "get", mock_javalog_server_timeout)
+    monkeypatch.setattr(JavaLog, "find", mock_javalog_server_timeout)
 
     # And a motor_conn & database
     database: str
@@ -600,7 +612,7 @@ async def test_find_logs_successfully(
         await db.insert_logs(logs, database)
 
         # And it has a query
-        query: BaseFindOperator = JavaLog.node == "testnode"
+        query: dict[str, Any] = {"node": "testnode"}
 
         # When it tries to find the logs
         result: list[JavaLog] = await db.find_logs(query, sort=None, database=database)
@@ -696,7 +708,7 @@ async def test_find_logs_with_sort(
         await db.insert_logs(logs)
 
         # And it has a query
-        query: str = JavaLog.node == "node"
+        query: dict[str, Any] = {"node": "node"}
 
         # And it has a sort
         sort: str = "-datetime"
@@ -749,3 +761,1244 @@ async def test_db_pmr(
         # Set Manual Teardown
         client = await db.init(database, conn)
         await client.drop_database(database)
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.db
+async def test_log_file_ids(
+    motor_conn: tuple[str, str], get_datetime: datetime
+) -> None:
+    # Given a motor_conn & database
+    database: str
+    conn: str
+    database, conn = motor_conn
+
+    try:
+        client: AsyncIOMotorClient = await db.init(database, conn)
+
+        # And the info of an archive
+        info: helper.ArchiveInfo = helper.ArchiveInfo(
+            "node", "domain.tld", "fanapiservice", 1657563227839
+        )
+
+        # When it registers two files of the archive, one twice
+        first: PydanticObjectId = await db.get_log_file_id(info, "a/fanapiservice.log")
+        db._log_file_ids.clear()
+        again: PydanticObjectId = await db.get_log_file_id(info, "fanapiservice.log")
+        other: PydanticObjectId = await db.get_log_file_id(info, "smb3_1.log")
+
+        # Then each file gets one LogFile entry
+        assert first == again
+        assert first != other
+
+        # And logs that reference it can be found by their origin
+        await db.insert_logs(
+            [
+                LogRecord(
+                    node="node",
+                    severity="INFO",
+                    jvm="jvm",
+                    datetime=get_datetime,
+                    source=None,
+                    type=None,
+                    message="This is a log",
+                    log_file=first,
+                )
+            ],
+            database,
+        )
+        ids: list[PydanticObjectId] = await db.find_log_file_ids(
+            collection=1657563227839, fqdn="node.domain.tld", file="fanapiservice.log"
+        )
+        assert ids == [first]
+        assert await JavaLog.find({"log_file": {"$in": ids}}).count() == 1
+
+    finally:
+        db._log_file_ids.clear()
+        client = await db.init(database, conn)
+        await client.drop_database(database)
+
+
+@pytest.mark.unit
+def test_summarize() -> None:
+    # Given a batch of records from two nodes
+    logs: list[LogRecord] = [
+        LogRecord("a", "INFO", None, datetime(2022, 7, 11, 9, 12, 2), None, None, "1"),
+        LogRecord("b", "WARN", None, datetime(2022, 7, 11, 9, 15, 1), None, None, "2"),
+        LogRecord("a", "INFO", None, datetime(2022, 7, 11, 9, 13, 5), None, None, "3"),
+    ]
+
+    # When it summarizes the batch
+    summary: dict[str, Any] = db._summarize([log.to_dict() for log in logs])
+
+    # Then it has the time range & counts
+    assert summary == {
+        "logs": 3,
+        "min_datetime": datetime(2022, 7, 11, 9, 12, 2),
+        "max_datetime": datetime(2022, 7, 11, 9, 15, 1),
+        "nodes": {"a": 2, "b": 1},
+        "severities": {"INFO": 2, "WARN": 1},
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.db
+async def test_find_logs_prunes_with_catalog(motor_conn: tuple[str, str]) -> None:
+    # Given a motor_conn & database
+    database: str
+    conn: str
+    database, conn = motor_conn
+
+    try:
+        client: AsyncIOMotorClient = await db.init(database, conn)
+
+        # And two cataloged files from different hours
+        info: helper.ArchiveInfo = helper.ArchiveInfo("node", "", "svc", 1)
+        for hour in (9, 10):
+            path: str = f"out/node/svc/svc.log{hour}"
+            log_file: PydanticObjectId = await db.get_log_file_id(info, path)
+            logs: list[LogRecord] = [
+                LogRecord(
+                    node="node",
+                    severity="INFO",
+                    jvm=None,
+                    datetime=datetime(2022, 7, 11, hour, minute),
+                    source=None,
+                    type=None,
+                    message=f"log {hour}:{minute}",
+                    log_file=log_file,
+                )
+                for minute in (0, 30)
+            ]
+            await db.insert_logs(logs, database)
+            await db.catalog_batch(path, 0, [log.to_dict() for log in logs], log_file)
+
+        # When it finds logs in a window that only the first file covers
+        result: list[JavaLog] = await db.find_logs(
+            {},
+            None,
+            database,
+            start=datetime(2022, 7, 11, 9, 15),
+            end=datetime(2022, 7, 11, 9, 45),
+        )
+
+        # Then only the matching log is returned
+        assert [log.message for log in result] == ["log 9:30"]
+        # And the catalog only lists the overlapping file
+        entries: list = await db.find_catalog(
+            datetime(2022, 7, 11, 9, 15), datetime(2022, 7, 11, 9, 45)
+        )
+        assert [entry.path for entry in entries] == ["out/node/svc/svc.log9"]
+        assert entries[0].severities == {"INFO": 2}
+
+        # And a later collection extracted to the same path is cataloged as
+        # its own file
+        later: PydanticObjectId = await db.get_log_file_id(
+            helper.ArchiveInfo("node", "", "svc", 2), "out/node/svc/svc.log9"
+        )
+        await db.catalog_batch(
+            "out/node/svc/svc.log9", 0, [log.to_dict() for log in logs], later
+        )
+        entries = await db.find_catalog(datetime(2022, 7, 11, 10), None)
+        assert sorted(str(entry.log_file) for entry in entries) == sorted(
+            [str(log_file), str(later)]
+        )
+
+    finally:
+        db._log_file_ids.clear()
+        client = await db.init(database, conn)
+        await client.drop_database(database)
+
+
+class MockMotorClient:
+    # MockMotorClient records how the client was created & closed
+
+    def __init__(self, connection: str, **options) -> None:
+        self.connection: str = connection
+        self.options: dict[str, Any] = options
+        self.closed: bool = False
+
+    def __getitem__(self, database: str) -> str:
+        return database
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_init_client_options_and_close(
+    monkeypatch: pytest.MonkeyPatch, settings_override
+) -> None:
+    # Given a mock motor client & beanie
+    monkeypatch.setattr(motor.motor_asyncio, "AsyncIOMotorClient", MockMotorClient)
+
+    async def mock_init_beanie(*args, **kwargs) -> None:
+        return None
+
+    monkeypatch.setattr(beanie, "init_beanie", mock_init_beanie)
+    monkeypatch.setattr(db, "_drop_stale_indexes", mock_init_beanie)
+
+    # And settings for a tuned pool with compression & write concern
+    settings_override.db_max_pool_size = 8
+    settings_override.db_compressors = ["zstd", "snappy"]
+    settings_override.db_write_concern = 1
+    settings_override.db_journal = False
+
+    try:
+        # When it inits the database with the settings' options
+        client: Any = await db.init(
+            "test-logs", "mongodb://localhost", settings_override.get_db_options()
+        )
+
+        # Then the client is created with them
+        assert client.options["maxPoolSize"] == 8
+        assert client.options["compressors"] == ["zstd", "snappy"]
+        assert client.options["w"] == 1
+        assert client.options["journal"] is False
+        assert db.get_client() is client
+
+        # And a new init replaces & closes the previous client
+        new_client: Any = await db.init("test-logs", "mongodb://localhost")
+        assert client is not None
+        assert client.closed
+        assert new_client.options == {}
+
+        # And close closes the shared client
+        await db.close()
+        assert new_client.closed
+        assert db.get_client() is None
+    finally:
+        settings_override.db_max_pool_size = 100
+        settings_override.db_compressors = []
+        settings_override.db_write_concern = None
+        settings_override.db_journal = None
+        await db.close()
+
+
+class MockCollection:
+    # MockCollection records the insert_many options
+
+    def __init__(self) -> None:
+        self.kwargs: dict[str, Any] = {}
+
+    async def insert_many(self, documents: list[dict], **kwargs) -> InsertManyResult:
+        self.kwargs = kwargs
+        return InsertManyResult([], True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+@pytest.mark.parametrize("profile, ordered", [("bulk", False), ("durable", True)])
+async def test_insert_logs_ordered_by_profile(
+    monkeypatch: pytest.MonkeyPatch, profile: str, ordered: bool
+) -> None:
+    # Given a mock collection & an ingest profile
+    collection: MockCollection = MockCollection()
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+    monkeypatch.setattr(get_settings(), "ingest_profile", profile)
+    log: LogRecord = LogRecord(
+        node="node",
+        severity="INFO",
+        jvm="jvm 1",
+        datetime=datetime(2022, 7, 11, 9, 12, 55),
+        source=None,
+        type=None,
+        message="a log",
+    )
+
+    # When it inserts logs
+    await db.insert_logs([log])
+
+    # Then the inserts are ordered by the profile
+    assert collection.kwargs == {"ordered": ordered}
+
+    # And an explicit ordering wins
+    await db.insert_logs([log], ordered=not ordered)
+    assert collection.kwargs == {"ordered": not ordered}
+
+
+class MockAggregateCollection:
+    # MockAggregateCollection records bulk writes & aggregate pipelines
+
+    def __init__(self, name: str, result: list[dict[str, Any]]) -> None:
+        self.name: str = name
+        self.result: list[dict[str, Any]] = result
+        self.requests: list[UpdateOne] = []
+        self.pipelines: list[list[dict[str, Any]]] = []
+
+    async def bulk_write(self, requests: list[UpdateOne], **kwargs) -> None:
+        self.requests += requests
+
+    def aggregate(self, pipeline: list[dict[str, Any]]) -> SimpleNamespace:
+        self.pipelines.append(pipeline)
+
+        async def to_list(length: int | None) -> list[dict[str, Any]]:
+            return self.result
+
+        return SimpleNamespace(to_list=to_list)
+
+
+class FlakyCollection:
+    # FlakyCollection fails each insert_many with the next planned error
+
+    def __init__(self, errors: list[Exception | None]) -> None:
+        self.errors: list[Exception | None] = errors
+        self.calls: list[list[dict]] = []
+
+    async def insert_many(self, documents: list[dict], **kwargs) -> InsertManyResult:
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+        self.calls.append(list(documents))
+        error: Exception | None = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        return InsertManyResult([document["_id"] for document in documents], True)
+
+
+class StoredCollection:
+    # StoredCollection keeps the _ids inserted into it & fails duplicates
+    # like the server: an ordered insert stops at the first, an unordered
+    # one reports them all
+
+    def __init__(self) -> None:
+        self.ids: set[Any] = set()
+        self.calls: list[tuple[int, bool]] = []
+
+    async def insert_many(
+        self, documents: list[dict], ordered: bool = True, **kwargs
+    ) -> InsertManyResult:
+        self.calls.append((len(documents), ordered))
+        errors: list[dict[str, Any]] = []
+        for index, document in enumerate(documents):
+            if document["_id"] in self.ids:
+                errors.append({"index": index, "code": db.DUPLICATE_KEY})
+                if ordered:
+                    break
+            else:
+                self.ids.add(document["_id"])
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return InsertManyResult([document["_id"] for document in documents], True)
+
+
+def _records(count: int) -> list[LogRecord]:
+    return [
+        LogRecord(
+            node="node",
+            severity="INFO",
+            jvm="jvm 1",
+            datetime=datetime(2022, 7, 11, 9, 12, i),
+            source=None,
+            type=None,
+            message=f"log {i}",
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_insert_logs_retries_failed_documents(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Given an unordered bulk insert where one log fails & one is a duplicate
+    collection: FlakyCollection = FlakyCollection(
+        [
+            BulkWriteError(
+                {
+                    "writeErrors": [
+                        {"index": 1, "code": 91, "errmsg": "shutting down"},
+                        {"index": 2, "code": db.DUPLICATE_KEY, "errmsg": "dup"},
+                    ],
+                    "nInserted": 1,
+                }
+            ),
+            None,
+        ]
+    )
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+    monkeypatch.setattr(get_settings(), "insert_retry_backoff", 0)
+
+    # When it inserts 3 logs
+    result: InsertManyResult | None = await db.insert_logs(_records(3), ordered=False)
+
+    # Then only the failed log is retried
+    assert [len(call) for call in collection.calls] == [3, 1]
+    assert collection.calls[1][0]["message"] == "log 1"
+
+    # And the ids of the logs that went in are returned
+    assert result is not None
+    assert result.inserted_ids == [
+        collection.calls[0][0]["_id"],
+        collection.calls[0][2]["_id"],
+        collection.calls[1][0]["_id"],
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_replay_inserted_batch_ordered(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given a batch that went in under the durable profile's ordered inserts
+    collection: StoredCollection = StoredCollection()
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+    settings: config.Settings = config.Settings(
+        ingest_profile="durable", insert_retries=3, insert_retry_backoff=0
+    )
+    documents: list[dict[str, Any]] = db.pack_batch(_records(50))["logs"]
+    with config.using(settings):
+        await db.insert_logs([dict(document) for document in documents])
+
+        # When it is replayed, e.g. after a crash before its checkpoint
+        result: InsertManyResult | None = await db.insert_logs(
+            [dict(document) for document in documents]
+        )
+
+    # Then the duplicates are skipped in two calls rather than one per
+    # attempt, without running out of retries
+    assert result is not None
+    assert collection.calls == [(50, True), (50, True), (49, False)]
+    assert len(collection.ids) == 50
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "code,ordered,expected",
+    [
+        (91, True, (["b", "c", "d"], [])),
+        (91, False, (["b"], [])),
+        (121, True, (["c", "d"], ["b"])),
+        (121, False, ([], ["b"])),
+    ],
+)
+def test_failed_logs(
+    code: int, ordered: bool, expected: tuple[list[str], list[str]]
+) -> None:
+    # Given a bulk insert whose second log failed transiently or was rejected
+    err: BulkWriteError = BulkWriteError(
+        {"writeErrors": [{"index": 1, "code": code, "errmsg": "failed"}]}
+    )
+
+    # When it picks the logs to retry & to set aside
+    # Then a transient failure is retried (with the logs after it, if
+    # ordered), while a rejected log is not
+    assert db._failed_logs(err, ["a", "b", "c", "d"], ordered) == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "err,transient",
+    [
+        (AutoReconnect(), True),
+        (BulkWriteError({"writeErrors": [{"index": 0, "code": 91}]}), True),
+        (BulkWriteError({"writeErrors": [{"index": 0, "code": 121}]}), False),
+        (BulkWriteError({"writeErrors": []}), False),
+        (BulkWriteError({"writeErrors": [{"index": 0, "code": 11000}]}), False),
+        (OperationFailure("stepping down", 189), True),
+        (OperationFailure("bad value", 2), False),
+        (InvalidOperation(), False),
+    ],
+)
+def test_transient(err: Exception, transient: bool) -> None:
+    # Given a write error
+    # When it is judged
+    # Then only connection failures & retryable codes are worth retrying
+    assert db._transient(err) is transient
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_insert_logs_sets_aside_rejected(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    # Given a db that rejects one log of a batch outright
+    collection: FlakyCollection = FlakyCollection(
+        [
+            BulkWriteError(
+                {
+                    "writeErrors": [
+                        {"index": 1, "code": 121, "errmsg": "failed validation"}
+                    ]
+                }
+            )
+        ]
+    )
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path)
+
+    # When it inserts 3 logs
+    result: InsertManyResult | None = await db.insert_logs(
+        _records(3), ordered=False, spill=queue
+    )
+
+    # Then the rejected log is set aside, not retried or queued
+    assert len(collection.calls) == 1
+    assert result is not None
+    assert len(result.inserted_ids) == 2
+    assert queue.pending() == 0
+    with open(Path(tmp_path, spill.REJECTED_DIR, "rejected.bson"), "rb") as file:
+        rejected: list[dict[str, Any]] = bson.decode_all(file.read())
+    assert [entry["document"]["message"] for entry in rejected] == ["log 1"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_insert_logs_spills_after_retries(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    # Given a db that keeps dropping the connection & a spill queue
+    collection: FlakyCollection = FlakyCollection([AutoReconnect()] * 3)
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+    monkeypatch.setattr(get_settings(), "insert_retries", 2)
+    monkeypatch.setattr(get_settings(), "insert_retry_backoff", 0)
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path)
+
+    # When it inserts logs
+    result: InsertManyResult | None = await db.insert_logs(_records(2), spill=queue)
+
+    # Then it retries with backoff & then spills the batch, returning None
+    assert result is None
+    assert len(collection.calls) == 3
+    spilled: list[dict[str, Any]] = queue.get(10)[0]["logs"]
+    assert [document["message"] for document in spilled] == ["log 0", "log 1"]
+
+    # And without a spill queue the error is raised
+    collection.errors = [AutoReconnect()] * 3
+    with pytest.raises(AutoReconnect):
+        await db.insert_logs(_records(2))
+
+    # And the spilled batch is replayed with its ids once the db is back
+    replayed: int = await db.replay_spill(queue)
+    assert replayed == 2
+    assert queue.pending() == 0
+    assert [document["_id"] for document in collection.calls[-1]] == [
+        document["_id"] for document in spilled
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_drain_spill_until_stopped(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    # Given a queue the db is briefly unavailable for
+    collection: FlakyCollection = FlakyCollection([AutoReconnect()])
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+    monkeypatch.setattr(get_settings(), "insert_retries", 0)
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path)
+    queue.put([{"logs": [record.to_dict() for record in _records(3)]}])
+
+    # When a drainer runs while logs keep being queued
+    stop: asyncio.Event = asyncio.Event()
+    drainer: asyncio.Task[int] = asyncio.create_task(
+        db.drain_spill(queue, stop, interval=0.01)
+    )
+    await asyncio.sleep(0.05)
+    queue.put([{"logs": [record.to_dict() for record in _records(1)]}])
+    stop.set()
+
+    # Then it drains everything once the db is back & before it stops
+    assert await drainer == 4
+    assert queue.pending() == 0
+    assert [len(call) for call in collection.calls] == [3, 3, 1]
+
+
+@pytest.mark.unit
+def test_record_id_is_stable() -> None:
+    # Given a record ending at an offset of a source
+    timestamp: datetime = datetime(2022, 7, 11, 9, 12, 55)
+
+    # When its id is made again & for other records
+    record: ObjectId = db.record_id("1657/n11/svc/svc.log:head", 120, timestamp)
+
+    # Then it is the same id, other records get others & it leads with the
+    # log's time
+    assert record == db.record_id("1657/n11/svc/svc.log:head", 120, timestamp)
+    assert record != db.record_id("1657/n11/svc/svc.log:head", 240, timestamp)
+    assert record != db.record_id("1658/n11/svc/svc.log:head", 120, timestamp)
+    assert record.generation_time.replace(tzinfo=None) == timestamp
+    assert db.batch_token("a", 0, 120) == db.batch_token("a", 0, 120)
+    assert db.batch_token("a", 0, 120) != db.batch_token("a", 120, 240)
+
+
+def _mock_batch_collections(
+    monkeypatch: pytest.MonkeyPatch, errors: list[Exception | None]
+) -> tuple[FlakyCollection, dict[type, MockAggregateCollection]]:
+    # Mock the collections a batch is written to, the logs failing with errors
+    logs: FlakyCollection = FlakyCollection(errors)
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: logs)
+    collections: dict[type, MockAggregateCollection] = {
+        model: MockAggregateCollection(model.Settings.name, [])
+        for model in (CatalogEntry, HourlyCount, Alert)
+    }
+    for model, collection in collections.items():
+        monkeypatch.setattr(model, "get_motor_collection", lambda c=collection: c)
+    monkeypatch.setattr(get_settings(), "insert_retries", 0)
+    return logs, collections
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_write_batch_queues_and_replays(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    # Given a db that drops the connection once & a spill queue
+    logs: FlakyCollection
+    collections: dict[type, MockAggregateCollection]
+    logs, collections = _mock_batch_collections(monkeypatch, [AutoReconnect()])
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path)
+    alert: dict[str, Any] = {
+        "node": "node",
+        "window_start": datetime(2022, 7, 11, 9),
+        "template": None,
+    }
+    batch: dict[str, Any] = db.pack_batch(
+        _records(2), "out/svc.log", 0, "token", alerts=[alert]
+    )
+
+    # When the batch is written
+    written: bool = await db.write_batch(batch, queue)
+
+    # Then it is queued whole, with none of its side effects written
+    assert not written
+    assert queue.pending() > 0
+    assert all(not collection.requests for collection in collections.values())
+
+    # And the drainer applies it all with the same ids & token
+    assert await db.replay_spill(queue) == 2
+    assert queue.pending() == 0
+    assert [log["_id"] for log in logs.calls[-1]] == [
+        log["_id"] for log in batch["logs"]
+    ]
+    catalog: list[UpdateOne] = collections[CatalogEntry].requests
+    assert catalog[1]._filter["batches"] == {"$ne": "token"}
+    hourly: list[UpdateOne] = collections[HourlyCount].requests
+    assert hourly[0]._filter["batches"] == {"$ne": "token"}
+    assert len(collections[Alert].requests) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_replay_spill_sets_aside_rejected_batch(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    # Given a queued batch whose catalog entry the db rejects outright
+    _mock_batch_collections(monkeypatch, [])
+    monkeypatch.setattr(
+        CatalogEntry, "get_motor_collection", lambda: MockGuardedCollection([121])
+    )
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path)
+    queue.put([db.pack_batch(_records(2), "out/svc.log", 0, "token")])
+    queue.put([db.pack_batch(_records(1))])
+
+    # When the queue is replayed
+    replayed: int = await db.replay_spill(queue)
+
+    # Then the rejected batch is set aside & the one after it still applied
+    assert replayed == 1
+    assert queue.pending() == 0
+    assert Path(tmp_path, spill.REJECTED_DIR, "rejected.bson").exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.db
+async def test_stream_logs_raw(motor_conn: tuple[str, str]) -> None:
+    # Given an initialized database with 3 logs
+    database: str
+    conn: str
+    database, conn = motor_conn
+    try:
+        client: AsyncIOMotorClient = await db.init(database, conn)
+        await db.insert_logs(_records(3), database)
+
+        # When it streams the logs newest first with a limit
+        documents: list = [
+            document
+            async for document in db.stream_logs({"node": "node"}, "-datetime", limit=2)
+        ]
+
+        # Then the raw documents come back sorted & limited
+        assert all(isinstance(document, RawBSONDocument) for document in documents)
+        assert [document["message"] for document in documents] == ["log 2", "log 1"]
+    finally:
+        client = await db.init(database, conn)
+        await client.drop_database(database)
+
+
+class MockNodeCursor:
+    # MockNodeCursor serves one node's documents, noting how many were read
+
+    def __init__(self, documents: list[RawBSONDocument]) -> None:
+        self.documents: Iterator[RawBSONDocument] = iter(documents)
+        self.read: int = 0
+        self.closed: bool = False
+
+    def __aiter__(self) -> "MockNodeCursor":
+        return self
+
+    async def __anext__(self) -> RawBSONDocument:
+        for document in self.documents:
+            self.read += 1
+            return document
+        raise StopAsyncIteration
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class MockMergeCollection:
+    # MockMergeCollection holds logs per node & opens a cursor per find
+
+    def __init__(self, logs: dict[str, list[int]]) -> None:
+        self.logs: dict[str, list[int]] = logs
+        self.finds: list[tuple[dict[str, Any], dict[str, Any]]] = []
+        self.cursors: list[MockNodeCursor] = []
+
+    def with_options(self, **kwargs) -> "MockMergeCollection":
+        return self
+
+    async def distinct(self, field: str, match: dict[str, Any]) -> list[str]:
+        return list(self.logs)
+
+    def find(self, match: dict[str, Any], **kwargs) -> MockNodeCursor:
+        self.finds.append((match, kwargs))
+        minutes: list[int] = sorted(
+            self.logs[match["node"]], reverse=kwargs["sort"][0][1] == -1
+        )
+        cursor: MockNodeCursor = MockNodeCursor(
+            [
+                RawBSONDocument(
+                    bson.encode(
+                        {
+                            "node": match["node"],
+                            "datetime": datetime(2022, 7, 11, 9, minute),
+                        }
+                    )
+                )
+                for minute in minutes
+            ]
+        )
+        self.cursors.append(cursor)
+        return cursor
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+@pytest.mark.parametrize(
+    "descending,limit,expected",
+    [
+        (False, 0, [("b", 1), ("a", 2), ("c", 3), ("a", 4), ("b", 5), ("a", 6)]),
+        (True, 0, [("a", 6), ("b", 5), ("a", 4), ("c", 3), ("a", 2), ("b", 1)]),
+        (False, 3, [("b", 1), ("a", 2), ("c", 3)]),
+    ],
+)
+async def test_merge_logs(
+    monkeypatch: pytest.MonkeyPatch,
+    descending: bool,
+    limit: int,
+    expected: list[tuple[str, int]],
+) -> None:
+    # Given logs from 3 nodes that interleave in time
+    collection: MockMergeCollection = MockMergeCollection(
+        {"a": [2, 4, 6], "b": [1, 5], "c": [3]}
+    )
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+
+    # When they are merged over a window
+    documents: list[RawBSONDocument] = [
+        document
+        async for document in db.merge_logs(
+            {"severity": "ERROR"},
+            datetime(2022, 7, 11, 9),
+            None,
+            descending,
+            limit,
+            batch_size=2,
+        )
+    ]
+
+    # Then they come back in datetime order from one indexed cursor per
+    # node, reading no further ahead than each node's next log
+    assert [
+        (document["node"], document["datetime"].minute) for document in documents
+    ] == expected
+    match: dict[str, Any]
+    options: dict[str, Any]
+    match, options = collection.finds[0]
+    assert match == {
+        "severity": "ERROR",
+        "datetime": {"$gte": datetime(2022, 7, 11, 9)},
+        "node": "a",
+    }
+    assert options["hint"] == db.NODE_TIME_INDEX
+    assert options["limit"] == limit
+    assert options["batch_size"] == 2
+    assert [cursor.closed for cursor in collection.cursors] == [True] * 3
+    if limit:
+        assert [cursor.read for cursor in collection.cursors] == [2, 2, 1]
+
+
+class MockOptionsCollection:
+    # MockOptionsCollection records the options a collection is taken with
+
+    def __init__(self) -> None:
+        self.options: list[dict[str, Any]] = []
+
+    def with_options(self, **kwargs) -> "MockOptionsCollection":
+        self.options.append(kwargs)
+        return self
+
+
+@pytest.mark.unit
+@pytest.mark.mock
+@pytest.mark.parametrize(
+    "profile,bulk,read_preference",
+    [
+        ("bulk", True, ReadPreference.SECONDARY_PREFERRED),
+        ("bulk", False, None),
+        ("durable", True, ReadPreference.PRIMARY),
+    ],
+)
+def test_log_collection_read_preference(
+    monkeypatch: pytest.MonkeyPatch,
+    profile: str,
+    bulk: bool,
+    read_preference: Any,
+) -> None:
+    # Given an ingest profile
+    collection: MockOptionsCollection = MockOptionsCollection()
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: collection)
+    monkeypatch.setattr(get_settings(), "ingest_profile", profile)
+
+    # When the logs collection is taken for a bulk or interactive read
+    db._log_collection(bulk)
+
+    # Then only bulk reads get the profile's read preference
+    preferences: list[Any] = [
+        options["read_preference"]
+        for options in collection.options
+        if "read_preference" in options
+    ]
+    assert preferences == ([] if read_preference is None else [read_preference])
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.db
+async def test_merge_logs_db(motor_conn: tuple[str, str]) -> None:
+    # Given an initialized database with logs from 2 nodes
+    database: str
+    conn: str
+    database, conn = motor_conn
+    try:
+        client: AsyncIOMotorClient = await db.init(database, conn)
+        other: list[LogRecord] = _records(2)
+        for record in other:
+            record.node = "other"
+        await db.insert_logs(_records(3) + other, database)
+
+        # When they are merged newest first
+        documents: list = [
+            document async for document in db.merge_logs({}, descending=True)
+        ]
+
+        # Then both nodes' logs come back interleaved by datetime
+        assert [document["datetime"].second for document in documents] == [
+            2,
+            1,
+            1,
+            0,
+            0,
+        ]
+    finally:
+        client = await db.init(database, conn)
+        await client.drop_database(database)
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.db
+async def test_ingest_watermark(motor_conn: tuple[str, str]) -> None:
+    # Given an initialized, empty database
+    database: str
+    conn: str
+    database, conn = motor_conn
+    try:
+        client: AsyncIOMotorClient = await db.init(database, conn)
+        empty: tuple[int, str | None] = await db.ingest_watermark()
+
+        # When logs are inserted
+        result: InsertManyResult | None = await db.insert_logs(_records(3), database)
+
+        # Then the watermark moves to the count & newest log
+        assert empty == (0, None)
+        assert result is not None
+        assert await db.ingest_watermark() == (3, str(max(result.inserted_ids)))
+    finally:
+        client = await db.init(database, conn)
+        await client.drop_database(database)
+
+
+class MockFind:
+    # MockFind answers JavaLog.find $in queries from a dict of logs,
+    # recording the ids each query asked for & holding it until released
+
+    def __init__(self, logs: list[JavaLog]) -> None:
+        self.logs: dict[PydanticObjectId, JavaLog] = {
+            cast(PydanticObjectId, log.id): log for log in logs
+        }
+        self.queries: list[list[PydanticObjectId]] = []
+        self.release: asyncio.Event = asyncio.Event()
+        self.release.set()
+        self.error: Exception | None = None
+
+    def find(self, query: dict[str, Any]) -> SimpleNamespace:
+        ids: list[PydanticObjectId] = query["_id"]["$in"]
+        self.queries.append(ids)
+        return SimpleNamespace(to_list=lambda: self._to_list(ids))
+
+    async def _to_list(self, ids: list[PydanticObjectId]) -> list[JavaLog]:
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return [self.logs[log_id] for log_id in ids if log_id in self.logs]
+
+
+@pytest.fixture()
+def mock_find(monkeypatch: pytest.MonkeyPatch) -> Iterator[MockFind]:
+    logs: list[JavaLog] = [
+        JavaLog.model_construct(id=PydanticObjectId(), message=f"log {i}")
+        for i in range(3)
+    ]
+    find: MockFind = MockFind(logs)
+    monkeypatch.setattr(JavaLog, "find", find.find)
+    db.clear_log_cache()
+    yield find
+    db.clear_log_cache()
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_get_logs_batches_and_caches(mock_find: MockFind) -> None:
+    # Given 3 stored logs & an unknown id
+    ids: list[PydanticObjectId] = list(mock_find.logs)
+    unknown: PydanticObjectId = PydanticObjectId()
+
+    # When they are got in any order, with repeats
+    logs: list[JavaLog | None] = await db.get_logs(
+        [ids[2], unknown, ids[0], ids[2], ids[1]]
+    )
+
+    # Then they come back in that order from one query
+    assert logs == [
+        mock_find.logs[ids[2]],
+        None,
+        mock_find.logs[ids[0]],
+        mock_find.logs[ids[2]],
+        mock_find.logs[ids[1]],
+    ]
+    assert mock_find.queries == [[ids[2], unknown, ids[0], ids[1]]]
+
+    # And found logs are served from the cache after that, as copies
+    cached: JavaLog | None = await db.get_log(ids[0])
+    assert cached == mock_find.logs[ids[0]]
+    assert cached is not mock_find.logs[ids[0]]
+    assert cached is not await db.get_log(ids[0])
+    assert await db.get_logs([ids[1], unknown]) == [mock_find.logs[ids[1]], None]
+    assert mock_find.queries[1:] == [[unknown]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_get_logs_coalesces_concurrent_fetches(mock_find: MockFind) -> None:
+    # Given a fetch of 2 logs still waiting on the db
+    ids: list[PydanticObjectId] = list(mock_find.logs)
+    mock_find.release.clear()
+    first: asyncio.Task = asyncio.create_task(db.get_logs(ids[:2]))
+    await asyncio.sleep(0)
+
+    # When the same & another log are asked for meanwhile
+    second: asyncio.Task = asyncio.create_task(db.get_logs(ids[1:]))
+    await asyncio.sleep(0)
+    mock_find.release.set()
+
+    # Then the shared log is fetched once & both get what they asked for
+    assert await first == [mock_find.logs[ids[0]], mock_find.logs[ids[1]]]
+    assert await second == [mock_find.logs[ids[1]], mock_find.logs[ids[2]]]
+    assert mock_find.queries == [ids[:2], ids[2:]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_get_logs_shares_errors(mock_find: MockFind) -> None:
+    # Given a fetch that will fail & a request waiting on it
+    ids: list[PydanticObjectId] = list(mock_find.logs)
+    mock_find.release.clear()
+    mock_find.error = ServerSelectionTimeoutError("down")
+    first: asyncio.Task = asyncio.create_task(db.get_logs(ids[:1]))
+    await asyncio.sleep(0)
+    second: asyncio.Task = asyncio.create_task(db.get_logs(ids[:1]))
+    await asyncio.sleep(0)
+
+    # When the db fails
+    mock_find.release.set()
+
+    # Then both raise, nothing is cached & the next request queries again
+    with pytest.raises(ServerSelectionTimeoutError):
+        await first
+    with pytest.raises(ServerSelectionTimeoutError):
+        await second
+    mock_find.error = None
+    assert await db.get_logs(ids[:1]) == [mock_find.logs[ids[0]]]
+    assert len(mock_find.queries) == 2
+
+
+@pytest.mark.unit
+def test_hourly_counts() -> None:
+    # Given logs from two hours & severities
+    logs: list[LogRecord] = _records(3)
+    logs[2].severity = "ERROR"
+    logs[1].datetime = datetime(2022, 7, 11, 10, 59, 59)
+
+    # When they are counted
+    counts: Counter = db.hourly_counts([log.to_dict() for log in logs])
+
+    # Then they are counted per hour, node & severity
+    assert counts == {
+        (datetime(2022, 7, 11, 9), "node", "INFO"): 1,
+        (datetime(2022, 7, 11, 10), "node", "INFO"): 1,
+        (datetime(2022, 7, 11, 9), "node", "ERROR"): 1,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_add_hourly_counts_increments(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given a batch of 3 logs in one hour
+    collection: MockAggregateCollection = MockAggregateCollection("hourlycounts", [])
+    monkeypatch.setattr(HourlyCount, "get_motor_collection", lambda: collection)
+
+    # When it is counted
+    await db.add_hourly_counts(db.hourly_counts([log.to_dict() for log in _records(3)]))
+
+    # Then one $inc upsert adds all 3
+    assert collection.requests == [
+        UpdateOne(
+            {"hour": datetime(2022, 7, 11, 9), "node": "node", "severity": "INFO"},
+            {"$inc": {"logs": 3}},
+            upsert=True,
+        )
+    ]
+
+
+@pytest.mark.unit
+def test_guarded_inc() -> None:
+    # Given a counter key & a batch token
+    key: dict[str, Any] = {"hour": datetime(2022, 7, 11, 9), "node": "node"}
+
+    # When a guarded $inc is made for the batch
+    request: UpdateOne = db.guarded_inc(key, {"logs": 3}, "batch")
+
+    # Then it only matches a counter that has not counted the batch & records it
+    assert request == UpdateOne(
+        {**key, "batches": {"$ne": "batch"}},
+        {
+            "$inc": {"logs": 3},
+            "$push": {"batches": {"$each": ["batch"], "$slice": -db.BATCH_TOKENS}},
+        },
+        upsert=True,
+    )
+
+
+class MockGuardedCollection:
+    # MockGuardedCollection fails the first bulk write with the given error
+    # codes & records the requests of each
+
+    def __init__(self, codes: list[int], modified: int = 0) -> None:
+        self.codes: list[int] = codes
+        self.modified: int = modified
+        self.calls: list[list[UpdateOne]] = []
+
+    async def bulk_write(self, requests: list[UpdateOne], **kwargs) -> Any:
+        self.calls.append(requests)
+        if len(self.calls) == 1:
+            raise BulkWriteError(
+                {
+                    "writeErrors": [
+                        {"index": i, "code": code} for i, code in enumerate(self.codes)
+                    ]
+                }
+            )
+        return SimpleNamespace(modified_count=self.modified)
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_write_guarded_skips_applied() -> None:
+    # Given guarded upserts whose batch was already counted
+    requests: list[UpdateOne] = [db.guarded_inc({"node": "a"}, {"logs": 1}, "b")]
+
+    # When they are written
+    collection: MockGuardedCollection = MockGuardedCollection([db.DUPLICATE_KEY])
+    await db.write_guarded(collection, requests)  # type: ignore
+
+    # Then the duplicate key is tried once more without upserting, which
+    # applies it if another write only just inserted the counter
+    assert collection.calls[1] == [
+        UpdateOne(
+            {"node": "a", "batches": {"$ne": "b"}},
+            {
+                "$inc": {"logs": 1},
+                "$push": {"batches": {"$each": ["b"], "$slice": -db.BATCH_TOKENS}},
+            },
+        )
+    ]
+    # And any other error raises
+    with pytest.raises(BulkWriteError):
+        await db.write_guarded(
+            MockGuardedCollection([db.DUPLICATE_KEY, 121]), requests  # type: ignore
+        )
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_save_alerts_upserts(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given an alert for a node's window & none at all
+    collection: MockAggregateCollection = MockAggregateCollection("alerts", [])
+    monkeypatch.setattr(Alert, "get_motor_collection", lambda: collection)
+    alert: dict[str, Any] = {
+        "node": "node",
+        "stream": "node/svc.log",
+        "window_start": datetime(2022, 7, 11, 9),
+        "template": None,
+        "logs": 40,
+    }
+
+    # When they are saved
+    await db.save_alerts([alert])
+    await db.save_alerts([])
+
+    # Then the alert is upserted by node, stream, window & template
+    assert collection.requests == [
+        UpdateOne(
+            {
+                "node": "node",
+                "stream": "node/svc.log",
+                "window_start": datetime(2022, 7, 11, 9),
+                "template": None,
+            },
+            {"$set": alert},
+            upsert=True,
+        )
+    ]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "query, by, start, end, hourly",
+    [
+        ({}, "severity", None, None, True),
+        ({"node": "a", "severity": {"$in": ["ERROR"]}}, "hour", None, None, True),
+        ({"node": "a"}, "node", datetime(2022, 7, 11, 9), None, True),
+        ({"node": "a"}, "node", datetime(2022, 7, 11, 9, 30), None, False),
+        ({"node": "a"}, "node", None, datetime(2022, 7, 11, 9), False),
+        ({"type": "SMB"}, "severity", None, None, False),
+        ({}, "source", None, None, False),
+    ],
+)
+def test_counted_hourly(
+    query: Any, by: str, start: datetime | None, end: datetime | None, hourly: bool
+) -> None:
+    # Given a count
+    # When it is checked against the hourly counts
+    # Then only counts they hold exactly are answered from them
+    assert db._counted_hourly(query, by, start, end) is hourly
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_count_logs_reads_hourly_counts(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Given hourly counts & the logs they count
+    hourly: MockAggregateCollection = MockAggregateCollection(
+        "hourlycounts", [{"_id": "ERROR", "logs": 7}]
+    )
+    logs: MockAggregateCollection = MockAggregateCollection("javalogs", [])
+    monkeypatch.setattr(HourlyCount, "get_motor_collection", lambda: hourly)
+    monkeypatch.setattr(JavaLog, "get_motor_collection", lambda: logs)
+
+    # When a node's logs are counted by severity from an hour
+    counts: list[tuple[Any, int]] = await db.count_logs(
+        {"node": "a"}, "severity", datetime(2022, 7, 11, 9)
+    )
+
+    # Then the hourly counts are summed & the logs are not read
+    assert counts == [("ERROR", 7)]
+    assert hourly.pipelines == [
+        [
+            {
+                "$match": {
+                    "node": "a",
+                    "logs": {"$gt": 0},
+                    "hour": {"$gte": datetime(2022, 7, 11, 9)},
+                }
+            },
+            {"$group": {"_id": "$severity", "logs": {"$sum": "$logs"}}},
+            {"$sort": {"logs": -1, "_id": 1}},
+        ]
+    ]
+    assert not logs.pipelines
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.db
+async def test_hourly_counts_match_logs(motor_conn: tuple[str, str]) -> None:
+    # Given an initialized database
+    database: str
+    conn: str
+    database, conn = motor_conn
+    try:
+        client: AsyncIOMotorClient = await db.init(database, conn)
+
+        # And logs inserted & counted in two batches
+        logs: list[LogRecord] = _records(5)
+        logs[4].severity = "ERROR"
+        for batch in (logs[:3], logs[3:]):
+            await db.apply_batch(db.pack_batch(batch), database=database)
+
+        # When they are counted from the hourly counts & from the logs
+        hourly: list[tuple[Any, int]] = await db.count_logs({}, "severity")
+        raw: list[tuple[Any, int]] = await db.count_logs({}, "source")
+
+        # Then the hourly counts hold every log
+        assert hourly == [("INFO", 4), ("ERROR", 1)]
+        assert raw == [(None, 5)]
+
+        # And a rebuild from the logs recounts the same
+        assert await db.rebuild_hourly_counts() == 2
+        assert await db.count_logs({}, "severity") == hourly
+    finally:
+        client = await db.init(database, conn)
+        await client.drop_database(database)
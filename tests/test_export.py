@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+import bson
+import pytest
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+from aggregator import db, export
+
+log_id: ObjectId = ObjectId("608da169eb9e17281f0ab2ff")
+documents: list[dict[str, Any]] = [
+    {
+        "_id": log_id,
+        "node": "node",
+        "severity": "INFO",
+        "jvm": "jvm 1",
+        "datetime": datetime(2022, 7, 11, 9, 12, 2),
+        "source": "ttl.test",
+        "type": "SMB",
+        "message": 'Exec "proxy", done',
+    },
+    {
+        "_id": ObjectId(),
+        "node": "node",
+        "severity": "WARN",
+        "jvm": "jvm 1",
+        "datetime": datetime(2022, 7, 11, 9, 13, 1),
+        "message": "FileIO",
+    },
+]
+
+
+async def _stream(*args, **kwargs) -> AsyncIterator[RawBSONDocument]:
+    for document in documents:
+        yield RawBSONDocument(bson.encode(document))
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_write_jsonl() -> None:
+    # Given raw logs & an output
+    file: io.StringIO = io.StringIO()
+
+    # When they are written as JSON Lines
+    written: int = await export.write_jsonl(_stream(), file)
+
+    # Then each log is a JSON object on its own line
+    lines: list[dict[str, Any]] = [
+        json.loads(line) for line in file.getvalue().splitlines()
+    ]
+    assert written == 2
+    assert lines[0]["_id"] == str(log_id)
+    assert lines[0]["datetime"] == "2022-07-11T09:12:02"
+    assert lines[0]["message"] == 'Exec "proxy", done'
+    assert "source" not in lines[1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_write_csv() -> None:
+    # Given raw logs & an output
+    file: io.StringIO = io.StringIO()
+
+    # When they are written as CSV
+    written: int = await export.write_csv(_stream(), file)
+
+    # Then there is a header & a quoted row per log with blanks for gaps
+    rows: list[list[str]] = list(csv.reader(io.StringIO(file.getvalue())))
+    assert written == 2
+    assert rows[0] == export.FIELDS
+    assert rows[1][:5] == [str(log_id), "node", "INFO", "jvm 1", "2022-07-11T09:12:02"]
+    assert rows[1][7] == 'Exec "proxy", done'
+    assert rows[2][5] == ""
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_write_arrow() -> None:
+    # Given pyarrow, raw logs & an output
+    pyarrow = pytest.importorskip("pyarrow")
+    file: io.BytesIO = io.BytesIO()
+
+    # When they are written as Arrow IPC in batches of 1
+    written: int = await export.write_arrow(_stream(), file, batch_size=1)
+
+    # Then the file reads back as a table of the logs
+    table = pyarrow.ipc.open_file(pyarrow.BufferReader(file.getvalue())).read_all()
+    assert written == 2
+    assert table.column("_id").to_pylist()[0] == str(log_id)
+    assert table.column("severity").to_pylist() == ["INFO", "WARN"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_export_logs_to_file(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    # Given a mock stream of logs
+    monkeypatch.setattr(db, "stream_logs", _stream)
+    output: Path = Path(tmp_path, "logs.csv")
+
+    # When they are exported as CSV to a file
+    written: int = await export.export_logs({}, "-datetime", output, "csv")
+
+    # Then the file holds the header & logs
+    assert written == 2
+    assert len(output.read_text().splitlines()) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_export_logs_unknown_format() -> None:
+    # Given an unknown format
+    # When it exports
+    # Then it raises a ValueError
+    with pytest.raises(ValueError):
+        await export.export_logs({}, None, None, "xml")
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.parametrize("sort", [None, "node", [("datetime", 1)]])
+async def test_export_logs_merge_needs_datetime_sort(sort: Any) -> None:
+    # Given a merged export sorted other than by datetime
+    # When it exports
+    # Then it raises a ValueError
+    with pytest.raises(ValueError):
+        await export.export_logs({}, sort, None, "jsonl", merge=True)
@@ -1,8 +1,10 @@
 import asyncio
+import gzip
 import inspect
 import logging
 import os
 import shutil
+import tarfile
 from pathlib import Path
 from typing import Any, Coroutine, Literal, NoReturn
 from zipfile import BadZipFile, ZipFile
@@ -10,7 +12,6 @@ from zipfile import BadZipFile, ZipFile
 import pytest
 
 from aggregator import config, extract, helper
-from aggregator.helper import LOG_LOG_TYPE_PATTERN, ZIP_NODE_PATTERN
 
 filename_example: Path = Path("GBLogs_n11_fanapiservice_1657563227839.zip")
 badzipfile_example: Path = Path("not_a_zip.zip")
@@ -107,68 +108,6 @@ def test_create_log_dir_exist_ok_false(
     )
 
 
-@pytest.mark.unit
-def test_move_files_to_target(logger: pytest.LogCaptureFixture, tmp_path: Path) -> None:
-    # Given a filename
-    filename: str = "test.txt"
-    # And a source directory
-    system: Path = Path(os.path.join(tmp_path, "System"))
-    os.mkdir(system)
-    file: str = os.path.join(system, filename)
-    # And a target path
-    target: str = os.path.join(tmp_path, filename)
-    # And content in the file
-    with open(file, "w") as f:
-        f.write("text to test")
-
-    # When it moves files to target
-    extract._move_files_to_target(tmp_path, system)
-
-    # Then the file will be in the source directory
-    assert filename in os.listdir(tmp_path)
-    # And the content of the file will remain as above
-    with open(target, "r") as f:
-        assert f.read() == "text to test"
-    # And the file will not be in the sub directory
-    assert filename not in os.listdir(system)
-    # And the logger will log it
-    assert logger.record_tuples[0] == (
-        module_name,
-        logging.DEBUG,
-        f"Moved {filename} from {system} to {tmp_path}",
-    )
-
-
-@pytest.mark.unit
-def test_remove_folder(logger: pytest.LogCaptureFixture, tmp_path: Path) -> None:
-    # Given a folder (tmpdir)
-
-    # When it tries to remove the folder
-    extract._remove_folder(tmp_path)
-
-    # Then the folder no longer exists
-    assert os.path.exists(tmp_path) is False
-
-    # And the logger logs the removal
-    assert logger.record_tuples == [(module_name, logging.DEBUG, f"Removed {tmp_path}")]
-
-
-@pytest.mark.unit
-def test_remove_folder_fnf(logger: pytest.LogCaptureFixture, tmp_path: Path) -> None:
-    # Given a non-existent temp dir
-    os.rmdir(tmp_path)
-
-    # When it tries to remove the folder
-    # Then it raises a FileNotFoundError
-    with pytest.raises(FileNotFoundError):
-        extract._remove_folder(tmp_path)
-
-    # And the logger logs it
-    assert logger.record_tuples[0][0] == module_name
-    assert logger.record_tuples[0][1] == logging.ERROR
-    assert logger.record_tuples[0][2].startswith("FileNotFoundError:")
-
-
 class MockZip:
     # Mock for Zip to return test namelist
     @staticmethod
@@ -202,6 +141,8 @@ async def test_extract_successful_run(
     shutil.copy(src_file, tmp_path)
     # And an example extension
     extension: str = "service.log"
+    # And an example glob
+    pattern: str = f"*{extension}"
     # And an empty log_filename
     log_file: str = ""
 
@@ -210,7 +151,7 @@ async def test_extract_successful_run(
         if filename.endswith(extension):
             log_file = filename
     # And it tries to extract a file
-    await extract._extract(tgt_zip, tmp_path, extension)
+    await extract._extract(tgt_zip, tmp_path, [pattern])
 
     # Then it extracts the file
     target_log: Path = Path(os.path.join(tmp_path, os.path.basename(log_file)))
@@ -226,7 +167,7 @@ async def test_extract_successful_run(
     assert logs[1] == (
         module_name,
         logging.INFO,
-        f"Extracted *{extension} generating {log_file} at {tmp_path}",
+        f"Extracted {pattern} generating {log_file} at {tmp_path}",
     )
     # And the logger logs the end of the coroutine
     assert logs[-1] == (
@@ -302,9 +243,9 @@ async def test_gen_extract_fn_list(
     monkeypatch.setattr(os, "listdir", mock_listdir)
 
     # When it tries to generate the extract files list
-    zip_files_extract_fn_list: list[Coroutine[Any, Any, list[Path]]] | None = (
-        extract.gen_zip_extract_fn_list(tmp_path)
-    )
+    zip_files_extract_fn_list: (
+        list[Coroutine[Any, Any, extract.ExtractedArchive]] | None
+    ) = extract.gen_zip_extract_fn_list(tmp_path)
 
     # Then it returns a list of functions
     assert zip_files_extract_fn_list is not None
@@ -327,7 +268,7 @@ async def test_gen_extract_fn_list_empty(
     monkeypatch.setattr(os, "listdir", mock_listdir)
 
     # When it tries to extract files without a list of functions
-    coro_list: list[Coroutine[Any, Any, list[Path]]] | None = []
+    coro_list: list[Coroutine[Any, Any, extract.ExtractedArchive]] | None = []
     # Then it raises an AttributeError
     with pytest.raises(FileNotFoundError):
         coro_list = extract.gen_zip_extract_fn_list(tmp_path, coro_list)
@@ -339,21 +280,22 @@ async def test_gen_extract_fn_list_empty(
 
 
 @pytest.mark.parametrize(
-    "get_node, get_log_type, get_log_dir",
+    "get_archive_info, get_log_dir",
     [
         (
             MockNone.get_none(),
-            helper.get_log_type(filename_example, LOG_LOG_TYPE_PATTERN),
             helper.get_log_dir("node", "fanapiservice"),
         ),
         (
-            helper.get_node(filename_example, ZIP_NODE_PATTERN),
-            MockNone.get_none(),
+            helper.ArchiveInfo(None, "", "fanapiservice"),  # type: ignore
+            helper.get_log_dir("node", "fanapiservice"),
+        ),
+        (
+            helper.ArchiveInfo("node", "", None),  # type: ignore
             helper.get_log_dir("node", "fanapiservice"),
         ),
         (
-            helper.get_node(filename_example, ZIP_NODE_PATTERN),
-            helper.get_log_type(filename_example, LOG_LOG_TYPE_PATTERN),
+            helper.get_archive_info(filename_example),
             MockNone.get_none(),
         ),
     ],
@@ -366,8 +308,7 @@ async def test_gen_extract_fn_list_helper_none_returns(
     logger: pytest.LogCaptureFixture,
     tmp_path: Path,
     monkeypatch: pytest.MonkeyPatch,
-    get_node: str,
-    get_log_type: str,
+    get_archive_info: helper.ArchiveInfo | None,
     get_log_dir: Path,
 ) -> None:
     # Given a source directory
@@ -376,17 +317,11 @@ async def test_gen_extract_fn_list_helper_none_returns(
 
     monkeypatch.setattr(os, "listdir", mock_listdir)
 
-    # And a node
-    def mock_helper_get_node(*args, **kwargs) -> str:
-        return get_node
+    # And the archive info
+    def mock_helper_get_archive_info(*args, **kwargs) -> helper.ArchiveInfo | None:
+        return get_archive_info
 
-    monkeypatch.setattr(helper, "get_node", mock_helper_get_node)
-
-    # And a log_type
-    def mock_helper_get_log_type(*args, **kwargs) -> str:
-        return get_log_type
-
-    monkeypatch.setattr(helper, "get_log_type", mock_helper_get_log_type)
+    monkeypatch.setattr(helper, "get_archive_info", mock_helper_get_archive_info)
 
     # And a log_dir returned
 
@@ -398,7 +333,7 @@ async def test_gen_extract_fn_list_helper_none_returns(
     # When it tries to extract the zip function list
     # Then it raises an TypeError
     with pytest.raises(TypeError):
-        coro_list: list[Coroutine[Any, Any, list[Path]]] | None = (
+        coro_list: list[Coroutine[Any, Any, extract.ExtractedArchive]] | None = (
             extract.gen_zip_extract_fn_list(tmp_path, None)
         )
         assert coro_list is not None
@@ -451,6 +386,38 @@ async def test_gen_extract_fn_list_None_list(
     )
 
 
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_gen_extract_fn_per_collection(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    settings_override: config.Settings,
+) -> None:
+    # Given two collections of the same node & service
+    monkeypatch.setattr(settings_override, "outdir", Path(tmp_path, "out"))
+    src_dir: Path = Path(tmp_path, "src")
+    src_dir.mkdir()
+    src: Path = Path(settings_override.get_sourcedir(), filename_example)
+    archives: list[str] = [
+        "GBLogs_n11_fanapiservice_1657563227839.zip",
+        "GBLogs_n11_fanapiservice_1657563227840.zip",
+    ]
+    for archive in archives:
+        shutil.copy(src, Path(src_dir, archive))
+
+    # When it extracts both
+    extracted: list[extract.ExtractedArchive] = await extract.extract_log(
+        [extract.gen_extract_fn(src_dir, archive) for archive in archives], []
+    )
+
+    # Then each returns its own archive's info with its own logs
+    assert [info.epoch for info, _ in extracted] == [1657563227839, 1657563227840]
+    paths: list[Path] = [log_files[0] for _, log_files in extracted]
+    assert paths[0] != paths[1]
+    assert all(path.name == "fanapiservice.log" for path in paths)
+    assert paths[0].parent == helper.get_log_dir("n11", "fanapiservice", 1657563227839)
+
+
 @pytest.mark.asyncio
 @pytest.mark.mock
 @pytest.mark.integration
@@ -489,7 +456,7 @@ async def test_extract_log_returns_log_files(
     assert logger.record_tuples[1] == (
         module_name,
         logging.INFO,
-        f"Extracted *service.log generating System/fanapiservice.log at {target}",
+        f"Extracted *.log generating System/fanapiservice.log at {target}",
     )
 
 
@@ -572,3 +539,154 @@ async def test_extract_log_asyncio_gather_type(
         logging.ERROR,
         f"FileNotFoundError: {file} is not a file",
     )
+
+
+@pytest.fixture()
+def rolled_logs(tmp_path: Path) -> list[Path]:
+    # Rolled fanapiservice logs plus an smb3 log & a non-log file
+    src: Path = Path(os.path.join(tmp_path, "src", "System"))
+    src.mkdir(parents=True)
+    names: list[str] = [
+        "fanapiservice.log",
+        "fanapiservice.log1",
+        "fanapiservice.log2",
+        "smb3_1.log",
+        "readme.txt",
+    ]
+    for name in names:
+        with open(os.path.join(src, name), "w") as f:
+            f.write(f"INFO | jvm 1 | 2022/07/11 09:12:02 | {name}\n")
+    return [Path(os.path.join(src, name)) for name in names]
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz"])
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_extract_tar_rolled_order(
+    tmp_path: Path, rolled_logs: list[Path], mode: Literal["w", "w:gz"]
+) -> None:
+    # Given a (compressed) tar with rolled logs
+    archive: Path = Path(os.path.join(tmp_path, "GBLogs_n1_fanapiservice.tar"))
+    with tarfile.open(archive, mode) as tf:
+        for log in rolled_logs:
+            tf.add(log, arcname=f"System/{log.name}")
+    target: Path = Path(os.path.join(tmp_path, "target"))
+    target.mkdir()
+
+    # When it extracts the archive
+    log_files: list[Path] = await extract._extract(archive, target)
+
+    # Then only the logs are extracted, oldest rolled file first
+    assert [log.name for log in log_files] == [
+        "fanapiservice.log2",
+        "fanapiservice.log1",
+        "fanapiservice.log",
+        "smb3_1.log",
+    ]
+    # And they are flattened into the target directory
+    assert all(log.parent == target for log in log_files)
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_extract_nested_zip(tmp_path: Path, rolled_logs: list[Path]) -> None:
+    # Given a zip nested within a zip
+    inner: Path = Path(os.path.join(tmp_path, "inner.zip"))
+    with ZipFile(inner, "w") as zf:
+        zf.write(rolled_logs[0], arcname=f"System/{rolled_logs[0].name}")
+    archive: Path = Path(os.path.join(tmp_path, "outer.zip"))
+    with ZipFile(archive, "w") as zf:
+        zf.write(inner, arcname="System/inner.zip")
+        zf.write(rolled_logs[3], arcname=f"System/{rolled_logs[3].name}")
+    target: Path = Path(os.path.join(tmp_path, "target"))
+    target.mkdir()
+
+    # When it extracts the archive
+    log_files: list[Path] = await extract._extract(archive, target)
+
+    # Then the nested log is extracted with the nested archive as prefix
+    assert sorted(log.name for log in log_files) == [
+        "inner_fanapiservice.log",
+        "smb3_1.log",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_extract_name_clash(
+    logger: pytest.LogCaptureFixture, tmp_path: Path, rolled_logs: list[Path]
+) -> None:
+    # Given an archive with two logs of the same name in different folders
+    archive: Path = Path(os.path.join(tmp_path, "clash.zip"))
+    with ZipFile(archive, "w") as zf:
+        zf.write(rolled_logs[0], arcname=f"System/{rolled_logs[0].name}")
+        zf.write(rolled_logs[1], arcname=f"Other/{rolled_logs[0].name}")
+    target: Path = Path(os.path.join(tmp_path, "target"))
+    target.mkdir()
+
+    # When it extracts the archive
+    log_files: list[Path] = await extract._extract(archive, target)
+
+    # Then the second is prefixed with its folder instead of overwriting
+    assert sorted(log.name for log in log_files) == [
+        "Other_fanapiservice.log",
+        "fanapiservice.log",
+    ]
+    with open(os.path.join(target, "fanapiservice.log"), "r") as f:
+        assert f.read().endswith("fanapiservice.log\n")
+    # And the logger warns about it
+    assert (
+        module_name,
+        logging.WARNING,
+        "Other/fanapiservice.log would overwrite fanapiservice.log, "
+        "extracting it as Other_fanapiservice.log",
+    ) in logger.record_tuples
+
+
+@pytest.mark.unit
+def test_unique_name() -> None:
+    # Given names already taken
+    taken: set[str] = {"a.log", "x_a.log", "x_1_a.log"}
+
+    # When a clashing name is made unique
+    # Then it is prefixed with its folder & then a count
+    assert extract._unique_name("x/a.log", "a.log", taken) == "x_2_a.log"
+    assert extract._unique_name("a.log", "a.log", taken) == "1_a.log"
+    assert extract._unique_name("y/b.log", "b.log", taken) == "b.log"
+    assert {"x_2_a.log", "1_a.log", "b.log"} <= taken
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_extract_gzip(tmp_path: Path, rolled_logs: list[Path]) -> None:
+    # Given a gzipped log
+    archive: Path = Path(os.path.join(tmp_path, "fanapiservice.log1.gz"))
+    with open(rolled_logs[1], "rb") as src, gzip.open(archive, "wb") as gz:
+        shutil.copyfileobj(src, gz)
+    target: Path = Path(os.path.join(tmp_path, "target"))
+    target.mkdir()
+
+    # When it extracts the archive
+    log_files: list[Path] = await extract._extract(archive, target)
+
+    # Then it decompresses the log under its own name
+    assert log_files == [Path(os.path.join(target, "fanapiservice.log1"))]
+    with open(log_files[0], "r") as f:
+        assert f.read().endswith("fanapiservice.log1\n")
+
+
+@pytest.mark.parametrize(
+    "name, patterns, match",
+    [
+        ("System/fanapiservice.log", ["*.log"], "*.log"),
+        ("System/fanapiservice.log7", ["*.log", "*.log[0-9]"], "*.log[0-9]"),
+        ("System/smb3_1.log", ["*service.log"], None),
+        ("System/readme.txt", ["*.log", "*.log[0-9]"], None),
+    ],
+)
+@pytest.mark.unit
+def test_match_member(name: str, patterns: list[str], match: str | None) -> None:
+    # Given a member name & globs
+    # When it matches the member
+    # Then it returns the first matching glob
+    assert extract._match_member(name, patterns) == match
@@ -204,3 +204,92 @@ class TestWithInferredStrategies:
             helper.get_log_dir(**kwargs)
 
         execute()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "archive, expected",
+    [
+        (
+            "GBLogs_n11_fanapiservice_1657563227839.zip",
+            helper.ArchiveInfo("n11", "", "fanapiservice", 1657563227839),
+        ),
+        (
+            "/src/GBLogs_sc1node1.domain.tld_svc_1657563227839.tar.gz",
+            helper.ArchiveInfo("sc1node1", "domain.tld", "svc", 1657563227839),
+        ),
+        ("README.md", None),
+    ],
+)
+def test_get_archive_info(archive: str, expected: helper.ArchiveInfo | None) -> None:
+    # Given an archive name
+    # When it resolves the archive info
+    # Then it parses the node, domain, log type & epoch
+    assert helper.get_archive_info(Path(archive)) == expected
+
+
+@pytest.mark.unit
+def test_get_archive_info_is_cached(logger: pytest.LogCaptureFixture) -> None:
+    # Given an archive name that has not been resolved before
+    archive: str = "GBLogs_cached.domain.tld_svc_1657563227839.zip"
+
+    # When it resolves the archive info twice
+    first: helper.ArchiveInfo | None = helper.get_archive_info(archive)
+    second: helper.ArchiveInfo | None = helper.get_archive_info(archive)
+
+    # Then the name is only parsed & logged once
+    assert first is second
+    assert len(logger.record_tuples) == 1
+    assert first is not None
+    assert first.collected is not None
+    assert first.collected.year == 2022
+
+
+@pytest.mark.unit
+def test_get_log_dir_per_collection(settings_override: config.Settings) -> None:
+    # Given two collections of the same node & service
+    # When it gets their log dirs
+    first: Path = helper.get_log_dir("n11", "fanapiservice", 1657563227839)
+    second: Path = helper.get_log_dir("n11", "fanapiservice", 1657563227840)
+
+    # Then each is under its epoch, so neither overwrites the other
+    assert first == Path(
+        settings_override.outdir, "1657563227839", "n11", "fanapiservice"
+    )
+    assert first != second
+    # And the node & log type still parse from the dir
+    assert helper.get_log_info(Path(first, "fanapiservice.log3")) == (
+        helper.ArchiveInfo("n11", "", "fanapiservice")
+    )
+
+
+@pytest.mark.unit
+def test_get_log_info_parses_dir() -> None:
+    # Given a log in an outdir/node/log_type dir
+    log_file: Path = Path("out/node.domain.tld/smbservice/smb3_1.log")
+
+    # When it looks up the info
+    # Then it is parsed from the dir
+    assert helper.get_log_info(log_file) == helper.ArchiveInfo(
+        "node", "domain.tld", "smbservice"
+    )
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "message, template",
+    [
+        ("Exec proxy 10.1.2.3:445 took 123 ms", "Exec proxy <ip> took <num> ms"),
+        (
+            "user 'bob' session 550e8400-e29b-41d4-a716-446655440000",
+            "user <str> session <uuid>",
+        ),
+        ("address 0x7ffe12 hash 12ab34cd56ef", "address <hex> hash <hex>"),
+        ("SecondaryMonitor started", "SecondaryMonitor started"),
+    ],
+)
+def test_message_template(message: str, template: str) -> None:
+    # Given a message
+    # When it reduces the message to a template
+    # Then the variable parts are masked
+    assert helper.message_template(message) == template
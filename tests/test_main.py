@@ -1,18 +1,47 @@
+import asyncio
 import logging
 import os
+from datetime import datetime
 from pathlib import Path
 from typing import Any, Coroutine, Literal
+from unittest.mock import AsyncMock
 
 import pytest
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.results import InsertManyResult
-
-from aggregator import config, main, model
+from pymongo.errors import AutoReconnect, ServerSelectionTimeoutError
+
+from aggregator import (
+    anomaly,
+    checkpoint,
+    config,
+    convert,
+    db,
+    extract,
+    helper,
+    main,
+    model,
+    spill,
+)
 from aggregator.config import Settings
 
 module_name: Literal["aggregator.main"] = "aggregator.main"
 
 
+def _records(count: int) -> list[model.LogRecord]:
+    return [
+        model.LogRecord(
+            node="node",
+            severity="INFO",
+            jvm="jvm 1",
+            datetime=datetime(2022, 7, 11, 9, 12, i),
+            source=None,
+            type=None,
+            message=f"log {i}",
+        )
+        for i in range(count)
+    ]
+
+
 class TestGetSettings:
     @pytest.mark.unit
     def test_get_settings_override(
@@ -185,7 +214,7 @@ class TestExtract:
     ) -> None:
         # Given a set of settings (settings_override)
         # When it tries to generate the list
-        zip_coro_list: list[Coroutine[Any, Any, list[Path]]] = (
+        zip_coro_list: list[Coroutine[Any, Any, extract.ExtractedArchive]] = (
             main._get_zip_extract_coro_list(settings_override.sourcedir)
         )
         # Then it returns a list of coros
@@ -220,7 +249,9 @@ class TestExtract:
         # Given a set of settings (settings_override)
         settings_override.sourcedir = Path("./testsource/zips")
         # When it tries to extract the logs
-        log_file_list: list[str] = await main._extract_logs(settings_override.sourcedir)
+        log_file_list: list[extract.ExtractedArchive] = await main._extract_logs(
+            settings_override.sourcedir
+        )
         # Then it returns a list of log files
         assert len(log_file_list) > 0
 
@@ -246,62 +277,273 @@ class TestExtract:
         )
 
 
-class TestConvert:
+class TestInitSettings:
+    @pytest.mark.asyncio
+    @pytest.mark.unit
+    @pytest.mark.mock
+    async def test_init_app_resolves_settings_on_call(
+        self, monkeypatch: pytest.MonkeyPatch, settings_override: Settings
+    ) -> None:
+        # Given a mock db init
+        calls: list[tuple] = []
+
+        async def mock_init(*args) -> str:
+            calls.append(args)
+            return "client"
+
+        monkeypatch.setattr(db, "init", mock_init)
+
+        # When it inits the app without settings
+        client: Any
+        settings: Settings
+        client, settings = await main.init_app()
+
+        # Then the current settings are used, with the client options
+        assert client == "client"
+        assert settings == settings_override
+        assert calls == [
+            (
+                settings_override.database,
+                settings_override.connection,
+                settings_override.get_db_options(),
+            )
+        ]
+
+
+class TestIngest:
     @pytest.mark.asyncio
-    @pytest.mark.integration
-    @pytest.mark.slow
-    async def test_get_convert_coro_list_success(settings_override) -> None:
-        # When it has inited the database
-        await main._init_db()
-        # And it has a log_file_list
-        sourcedir: Path = Path("./testsource/zips")
-        log_file_list: list[str] = await main._extract_logs(sourcedir)
-        # When it tries to get the get the convert coro list
-        log_lists: list[list[model.JavaLog]] = await main._convert_log_files(
-            log_file_list
+    @pytest.mark.mock
+    @pytest.mark.unit
+    async def test_ingest_log_file_resumes_from_checkpoint(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        # Given a log file & a checkpoint after its first 2 logs
+        log_file: Path = Path(os.path.join(tmp_path, "fanapiservice.log"))
+        with open(log_file, "w") as f:
+            f.write("x" * 50)
+        checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+            Path(os.path.join(tmp_path, "checkpoint.json"))
         )
-        # Then it should return a list of JavaLogs
-        assert len(log_lists) > 0
+        checkpoints.commit(log_file, 20, 2)
+
+        # And a mock convert that streams 3 logs from the offset
+        starts: list[int] = []
+
+        async def mock_stream_records(
+            file: str, start: int = 0, info=None, batch_size: int = 1000
+        ):
+            starts.append(start)
+            records: list[model.LogRecord] = _records(3)
+            offsets: list[int] = [30, 40, 50]
+            for i in range(0, 3, batch_size):
+                yield records[i : i + batch_size], offsets[i : i + batch_size]
+
+        monkeypatch.setattr(convert, "stream_records", mock_stream_records)
+
+        # And a mock db that fails on the second batch
+        written: list[dict[str, Any]] = []
+
+        async def mock_write_batch(batch: dict[str, Any], *args) -> bool:
+            if written:
+                raise ServerSelectionTimeoutError
+            written.append(batch)
+            return True
+
+        monkeypatch.setattr(db, "write_batch", mock_write_batch)
+
+        # When it ingests the file in batches of 2
+        # Then the failed batch raises
+        with pytest.raises(ServerSelectionTimeoutError):
+            await main._ingest_log_file(str(log_file), checkpoints, 2)
+
+        # And it converted from the checkpoint
+        assert starts == [20]
+        # And the written batch went with where it started & its own token
+        assert [log["message"] for log in written[0]["logs"]] == ["log 0", "log 1"]
+        assert written[0]["path"] == str(log_file)
+        assert written[0]["offset"] == 20
+        assert written[0]["token"] != written[0]["logs"][0]["_id"]
+        # And each log is identified by where it ends in the file
+        key: str = f"{log_file}:{checkpoints.get(str(log_file)).head}"
+        assert [log["_id"] for log in written[0]["logs"]] == [
+            db.record_id(key, 30, datetime(2022, 7, 11, 9, 12, 0)),
+            db.record_id(key, 40, datetime(2022, 7, 11, 9, 12, 1)),
+        ]
+
+        # And only the written batch was checkpointed
+        cp: checkpoint.Checkpoint = checkpoints.get(str(log_file))
+        assert cp.offset == 40
+        assert cp.records == 4
+
+    @pytest.mark.asyncio
+    @pytest.mark.mock
+    @pytest.mark.unit
+    async def test_ingest_log_file_spilled_batch_is_committed(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        # Given a log file, a spill queue & a db that is down
+        log_file: Path = Path(os.path.join(tmp_path, "fanapiservice.log"))
+        with open(log_file, "w") as f:
+            f.write("x" * 30)
+        checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+            Path(os.path.join(tmp_path, "checkpoint.json"))
+        )
+        queue: spill.SpillQueue = spill.SpillQueue(Path(tmp_path, "spill"))
+
+        async def mock_stream_records(*args, **kwargs):
+            records: list[model.LogRecord] = _records(3)
+            yield records[:2], [10, 20]
+            yield records[2:], [30]
+
+        async def mock_apply_batch(*args, **kwargs) -> int:
+            raise AutoReconnect
 
-    # TODO Add unhappy path
+        monkeypatch.setattr(convert, "stream_records", mock_stream_records)
+        monkeypatch.setattr(db, "apply_batch", mock_apply_batch)
 
+        # When it ingests the file
+        count: int = await main._ingest_log_file(str(log_file), checkpoints, 2, queue)
+
+        # Then every batch is queued with its logs & checkpointed as committed
+        assert count == 3
+        batches: list[dict[str, Any]] = queue.get(10)
+        assert [len(batch["logs"]) for batch in batches] == [2, 1]
+        assert checkpoints.get(str(log_file)).offset == 30
 
-class TestInsert:
     @pytest.mark.asyncio
-    @pytest.mark.integration
-    @pytest.mark.slow
-    async def test_insert_logs(self, motor_conn, settings_override) -> None:
+    @pytest.mark.mock
+    @pytest.mark.unit
+    async def test_ingest_log_files_tags_archive(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        # Given logs extracted from two collections of the same node & service
+        checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+            Path(os.path.join(tmp_path, "checkpoint.json"))
+        )
+        extracted: list[extract.ExtractedArchive] = []
+        for epoch in (1657563227839, 1657563227840):
+            log_file: Path = Path(tmp_path, str(epoch), "n11", "svc", "svc.log")
+            log_file.parent.mkdir(parents=True)
+            log_file.write_text("x")
+            extracted.append((helper.ArchiveInfo("n11", "", "svc", epoch), [log_file]))
 
-        # Given a mongo_conn
-        # Given a pmr_database & connection
-        database: str
-        conn: str
-        database, conn = motor_conn
-        settings_override.database = database
-        settings_override.connection = conn
+        # And a mock convert & db
+        written: list[dict[str, Any]] = []
 
-        # When main tries to init the app
-        # Then it returns settings and client
-        client: AsyncIOMotorClient
+        async def mock_stream_records(*args, **kwargs):
+            yield _records(1), [1]
 
-        try:
-            client, _ = await main.init_app(settings_override)
-            # And it has a log_file_list
-            sourcedir: Path = Path("./testsource/zips")
-            log_file_list: list[str] = await main._extract_logs(sourcedir)
-            # And it has converted the lists to logs
-            log_lists: list[list[model.JavaLog]] = await main._convert_log_files(
-                log_file_list
-            )
-            # When it tries to insert the logs
-            result: list[InsertManyResult | None] | None = await main._insert_logs(
-                log_lists
+        async def mock_write_batch(batch: dict[str, Any], *args) -> bool:
+            written.append(batch)
+            return True
+
+        monkeypatch.setattr(convert, "stream_records", mock_stream_records)
+        monkeypatch.setattr(db, "write_batch", mock_write_batch)
+
+        # When it ingests them
+        await main._ingest_log_files(extracted, checkpoints, 2)
+
+        # Then each log is tagged with its own archive's collection
+        assert [
+            (batch["log_file"]["collection"], batch["log_file"]["file"])
+            for batch in written
+        ] == [(info.epoch, "svc.log") for info, _ in extracted]
+        # And the same member of each collection gets its own ids
+        assert written[0]["logs"][0]["_id"] != written[1]["logs"][0]["_id"]
+
+    @pytest.mark.asyncio
+    @pytest.mark.mock
+    @pytest.mark.unit
+    async def test_ingest_log_file_write_ahead(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        # Given a log file & a write-ahead queue
+        log_file: Path = Path(os.path.join(tmp_path, "fanapiservice.log"))
+        with open(log_file, "w") as f:
+            f.write("x" * 30)
+        checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+            Path(os.path.join(tmp_path, "checkpoint.json"))
+        )
+        queue: spill.SpillQueue = spill.SpillQueue(Path(tmp_path, "spill"))
+
+        # And a mock convert that streams 3 logs
+        async def mock_stream_records(*args, **kwargs):
+            records: list[model.LogRecord] = _records(3)
+            yield records[:2], [10, 20]
+            yield records[2:], [30]
+
+        monkeypatch.setattr(convert, "stream_records", mock_stream_records)
+
+        # And a db that must not be written to directly
+        async def mock_write_batch(*args, **kwargs) -> None:
+            raise AssertionError("write_batch called")
+
+        monkeypatch.setattr(db, "write_batch", mock_write_batch)
+
+        # When it ingests the file with write-ahead
+        count: int = await main._ingest_log_file(
+            str(log_file), checkpoints, 2, queue, write_ahead=True
+        )
+
+        # Then the batches are queued for the drainer & checkpointed
+        assert count == 3
+        assert [
+            [log["message"] for log in batch["logs"]] for batch in queue.get(10)
+        ] == [["log 0", "log 1"], ["log 2"]]
+        assert checkpoints.get(str(log_file)).offset == 30
+
+    @pytest.mark.asyncio
+    @pytest.mark.mock
+    @pytest.mark.unit
+    async def test_ingest_log_files_by_stream(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        # Given two collections of a node, the later listed first, each
+        # with a rolled log & another service's log
+        extracted: list[extract.ExtractedArchive] = [
+            (
+                helper.ArchiveInfo("n1", "", "svc", epoch),
+                [
+                    Path(tmp_path, str(epoch), name)
+                    for name in ["svc.log1", "svc.log", "smb3_1.log"]
+                ],
             )
-            assert result is not None
-            assert len(result) > 0
-        finally:
-            # Set Manual Teardown
-            client = await main._init_db(settings_override)
-            await client.drop_database(database)
+            for epoch in (2, 1)
+        ]
+
+        # And a mock ingest recording each file & the detector it gets
+        ingested: list[tuple[str, Any]] = []
+
+        async def mock_ingest_log_file(file: str, *args) -> int:
+            ingested.append((os.path.relpath(file, tmp_path), args[4]))
+            await asyncio.sleep(0)
+            return 1
+
+        monkeypatch.setattr(main, "_ingest_log_file", mock_ingest_log_file)
+        monkeypatch.setattr(db, "write_batch", AsyncMock(return_value=True))
+        detectors: anomaly.StreamDetectors = anomaly.StreamDetectors(Settings())
+
+        # When the files are ingested
+        result: list[int] = await main._ingest_log_files(
+            extracted,
+            checkpoint.CheckpointStore(Path(tmp_path, "c.json")),
+            2,
+            detectors=detectors,
+        )
 
-    # TODO Add unhappy path
+        # Then each stream's files go one after another, oldest first, with
+        # the stream's own detector
+        assert result == [1] * 6
+        svc: list[tuple[str, Any]] = [item for item in ingested if "svc" in item[0]]
+        assert [file for file, _ in svc] == [
+            "1/svc.log1",
+            "1/svc.log",
+            "2/svc.log1",
+            "2/svc.log",
+        ]
+        assert {id(detector) for _, detector in svc} == {
+            id(detectors.detectors["n1/svc.log"])
+        }
+        assert detectors.detectors["n1/smb3_1.log"] is not (
+            detectors.detectors["n1/svc.log"]
+        )
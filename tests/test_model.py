@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import pytest
+from beanie import PydanticObjectId
+
+from aggregator.model import LogRecord
+
+
+@pytest.fixture()
+def make_record(get_datetime: datetime):
+    def _make_record(**kwargs) -> LogRecord:
+        fields: dict = {
+            "node": "node",
+            "severity": "INFO",
+            "jvm": "jvm 1",
+            "datetime": get_datetime,
+            "source": "ttl.test",
+            "type": "SMB",
+            "message": "Exec proxy",
+        }
+        fields.update(kwargs)
+        return LogRecord(**fields)
+
+    return _make_record
+
+
+@pytest.mark.unit
+def test_log_record_has_no_dict(make_record) -> None:
+    # Given a record
+    record: LogRecord = make_record()
+
+    # Then it is slots only
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        record.extra = "value"  # type: ignore
+
+
+@pytest.mark.unit
+def test_log_record_interns_strings(make_record) -> None:
+    # Given two records built from separately created strings
+    first: LogRecord = make_record(severity="".join(["WA", "RN"]))
+    second: LogRecord = make_record(severity="".join(["W", "ARN"]))
+
+    # Then the low cardinality strings are shared
+    assert first.severity is second.severity
+    # And None values are kept
+    assert make_record(jvm=None).jvm is None
+
+
+@pytest.mark.unit
+def test_log_record_to_dict(make_record, get_datetime: datetime) -> None:
+    # Given a record
+    record: LogRecord = make_record(type=None)
+
+    # When it converts the record to a document
+    # Then it has the javalogs fields
+    assert record.to_dict() == {
+        "node": "node",
+        "severity": "INFO",
+        "jvm": "jvm 1",
+        "datetime": get_datetime,
+        "source": "ttl.test",
+        "type": None,
+        "message": "Exec proxy",
+    }
+
+
+@pytest.mark.unit
+def test_log_record_equality_and_repr(make_record) -> None:
+    # Given two records with the same fields
+    # Then they are equal & repr shows the fields
+    assert make_record() == make_record()
+    assert make_record() != make_record(message="other")
+    assert repr(make_record()).startswith("LogRecord(node='node', severity='INFO'")
+
+
+@pytest.mark.unit
+def test_log_record_requires_message(make_record) -> None:
+    # Given a record without a message
+    # Then it raises a ValueError
+    with pytest.raises(ValueError):
+        make_record(message=None)
+
+
+@pytest.mark.unit
+def test_log_record_to_dict_with_log_file(make_record) -> None:
+    # Given a record that references its LogFile
+    log_file: PydanticObjectId = PydanticObjectId("608da169eb9e17281f0ab2ff")
+    record: LogRecord = make_record(log_file=log_file)
+
+    # When it converts the record to a document
+    # Then the document carries the LogFile id
+    assert record.to_dict()["log_file"] == log_file
+    # And records without one leave the field out
+    assert "log_file" not in make_record().to_dict()
@@ -0,0 +1,153 @@
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from aggregator import convert, parsers
+from aggregator.model import LogRecord
+
+smb3_log: str = (
+    "[2022/07/11 09:12:55.123456,  0] ../source3/smbd/service.c:1125(make_conn)\n"
+    "  make_connection_snum: canonicalize_connect_path failed\n"
+    "  for service share\n"
+    "[2022/07/11 09:12:56.000001,  3] ../source3/smbd/server.c:1741(main)\n"
+    "  smbd version 4.15.5 started.\n"
+    "[2022/07/11 09:12:57,  1] ../source3/lib/util.c:410(reopen_logs)\n"
+)
+
+
+@pytest.fixture()
+def smb3_file(tmp_path: Path) -> Path:
+    log_dir: Path = Path(tmp_path, "node", "fanapiservice")
+    log_dir.mkdir(parents=True)
+    log_file: Path = Path(log_dir, "smb3_1.log")
+    log_file.write_text(smb3_log)
+    return log_file
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "log_file, expected",
+    [
+        ("out/node/fanapiservice/fanapiservice.log", parsers.JAVA_WRAPPER),
+        ("out/node/fanapiservice/smb3_1.log", parsers.SMB3),
+        ("out/node/fanapiservice/smb3_1.log3", parsers.SMB3),
+        ("somewhere/else.log", parsers.JAVA_WRAPPER),
+    ],
+)
+def test_get_parser(log_file: str, expected: parsers.LogParser) -> None:
+    # Given a log file path
+    # When it picks the parser for the file
+    # Then it picks the registered format or the Java wrapper default
+    assert parsers.get_parser(Path(log_file)) is expected
+
+
+@pytest.mark.unit
+def test_register_parser_by_log_type() -> None:
+    # Given a parser registered for one log type
+    parser: parsers.LogParser = parsers.LogParser(
+        "test", parsers.RECORD_START, parsers.split_fields
+    )
+    parsers.register(parser, log_type="testservice")
+
+    try:
+        # When it picks parsers for that log type & another
+        # Then only the registered log type uses it
+        assert parsers.get_parser(Path("out/n/testservice/a.log")) is parser
+        assert parsers.get_parser(Path("out/n/other/a.log")) is parsers.JAVA_WRAPPER
+        assert parsers.PARSERS["test"] is parser
+    finally:
+        parsers._RULES.pop()
+        del parsers.PARSERS["test"]
+
+
+@pytest.mark.unit
+def test_split_java_keeps_fields() -> None:
+    # Given a wrapper record with only a message after the timestamp
+    record: bytes = b"INFO | jvm 1 | 2022/07/11 09:12:55 | SecondaryMonitor"
+
+    # When the Java wrapper parser splits it
+    d: dict[str, Any] = parsers.JAVA_WRAPPER.split(record)
+
+    # Then it splits it as convert always has, leaving the text in source
+    # for the short line rule in convert._build_log
+    assert d == convert._split_record(record)
+    assert d["source"] == "SecondaryMonitor"
+    assert d["message"] is None
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "record, expected",
+    [
+        (
+            b"[2022/07/11 09:12:55.123456,  0] smbd/service.c:1125(conn); failed",
+            [
+                "ERROR",
+                None,
+                "2022/07/11 09:12:55",
+                "smbd/service.c:1125(conn)",
+                "smb3",
+                "failed",
+            ],
+        ),
+        (
+            b"[2022/07/11 09:12:57,  1] ../source3/lib/util.c:410(reopen_logs)",
+            [
+                "WARN",
+                None,
+                "2022/07/11 09:12:57",
+                None,
+                "smb3",
+                "../source3/lib/util.c:410(reopen_logs)",
+            ],
+        ),
+        (
+            b"not a samba record",
+            [None, None, None, None, None, "not a samba record"],
+        ),
+    ],
+)
+def test_split_smb3(record: bytes, expected: list[str | None]) -> None:
+    # Given an smb3 record
+    # When the smb3 parser splits it
+    d: dict[str, Any] = parsers.SMB3.split(record)
+
+    # Then it maps the debug level to a severity & the header to the fields
+    assert d == dict(zip(parsers.HEADER, expected))
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_convert_records_smb3(smb3_file: Path) -> None:
+    # Given an smb3 log in a service dir
+    # When it converts the log
+    records: list[LogRecord]
+    offsets: list[int]
+    records, offsets = await convert.convert_records(str(smb3_file))
+
+    # Then the smb3 records are stitched & parsed with the smb3 parser
+    assert [record.severity for record in records] == ["ERROR", "INFO", "WARN"]
+    assert records[0].datetime == datetime(2022, 7, 11, 9, 12, 55)
+    assert records[0].message == (
+        "make_connection_snum: canonicalize_connect_path failed; for service share"
+    )
+    assert records[1].source == "../source3/smbd/server.c:1741(main)"
+    assert offsets[-1] == os.path.getsize(smb3_file)
+
+
+@pytest.mark.unit
+def test_chunk_offsets_use_parser_record_start(smb3_file: Path) -> None:
+    # Given an smb3 log
+    # When it is chunked with the smb3 record start
+    chunks: list[tuple[int, int]] = convert._chunk_offsets(
+        smb3_file, 64, record_start=parsers.SMB3.record_start
+    )
+
+    # Then each chunk starts on an smb3 record
+    with open(smb3_file, "rb") as file:
+        data: bytes = file.read()
+    assert len(chunks) == 3
+    assert all(data[start : start + 1] == b"[" for start, _ in chunks)
@@ -0,0 +1,172 @@
+from collections import Counter
+from datetime import datetime
+from typing import Any
+
+import pytest
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from aggregator import db, retention
+from aggregator.model import ExpiryBatch, HourlyCount, JavaLog, LogRecord, LogSummary
+
+
+@pytest.mark.unit
+def test_rollup() -> None:
+    # Given expired documents from two hours & nodes
+    documents: list[dict[str, Any]] = [
+        {"node": "a", "datetime": datetime(2022, 7, 11, 9, 12), "message": "took 5 ms"},
+        {"node": "a", "datetime": datetime(2022, 7, 11, 9, 48), "message": "took 7 ms"},
+        {"node": "b", "datetime": datetime(2022, 7, 11, 9, 1), "message": "took 1 ms"},
+        {"node": "a", "datetime": datetime(2022, 7, 11, 10, 3), "message": "started"},
+    ]
+
+    # When it rolls them up
+    counts: Counter = retention.rollup(documents, "INFO")
+
+    # Then they are counted per hour, node, severity & template
+    assert counts == {
+        (datetime(2022, 7, 11, 9), "a", "INFO", "took <num> ms"): 2,
+        (datetime(2022, 7, 11, 9), "b", "INFO", "took <num> ms"): 1,
+        (datetime(2022, 7, 11, 10), "a", "INFO", "started"): 1,
+    }
+
+
+@pytest.mark.unit
+@pytest.mark.mock
+@pytest.mark.asyncio
+async def test_apply_retention_per_severity(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given expired batches of 2, 2 & 1 INFO logs & no ERROR logs
+    batches: dict[str, list[int]] = {"INFO": [2, 2, 1, 0], "ERROR": [0]}
+    cutoffs: dict[str, datetime] = {}
+
+    async def mock_expire_batch(severity: str, cutoff: datetime, batch_size: int):
+        cutoffs[severity] = cutoff
+        return batches[severity].pop(0)
+
+    monkeypatch.setattr(retention, "_expire_batch", mock_expire_batch)
+
+    # And no batch left behind by a previous run
+    pending: list[bool] = []
+
+    async def mock_finish_pending() -> int:
+        pending.append(not cutoffs)
+        return 0
+
+    monkeypatch.setattr(retention, "finish_pending", mock_finish_pending)
+
+    # When it applies the retention
+    expired: dict[str, int] = await retention.apply_retention(
+        {"INFO": 14, "ERROR": 180}, 2, now=datetime(2022, 8, 1)
+    )
+
+    # Then each severity is expired in batches from its own cutoff
+    assert expired == {"INFO": 5, "ERROR": 0}
+    assert cutoffs == {
+        "INFO": datetime(2022, 7, 18),
+        "ERROR": datetime(2022, 2, 2),
+    }
+    # And batches left behind are finished before any more are expired
+    assert pending == [True]
+
+
+class MockCollection:
+    # MockCollection records the writes of one collection
+
+    def __init__(self) -> None:
+        self.requests: list[UpdateOne] = []
+        self.deletes: list[dict[str, Any]] = []
+
+    async def bulk_write(self, requests: list[UpdateOne], **kwargs) -> None:
+        self.requests += requests
+
+    async def delete_many(self, query: dict[str, Any]) -> None:
+        self.deletes.append(query)
+
+    async def delete_one(self, query: dict[str, Any]) -> None:
+        self.deletes.append(query)
+
+
+@pytest.mark.unit
+@pytest.mark.mock
+@pytest.mark.asyncio
+async def test_finish_batch_is_guarded(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Given mock collections
+    collections: dict[type, MockCollection] = {
+        model: MockCollection()
+        for model in (LogSummary, HourlyCount, JavaLog, ExpiryBatch)
+    }
+    for model, collection in collections.items():
+        monkeypatch.setattr(model, "get_motor_collection", lambda c=collection: c)
+
+    # And a saved batch of 2 expired logs
+    hour: datetime = datetime(2022, 7, 11, 9)
+    batch: dict[str, Any] = {
+        "_id": ObjectId(),
+        "severity": "INFO",
+        "ids": [ObjectId(), ObjectId()],
+        "summaries": [
+            {"hour": hour, "node": "a", "severity": "INFO", "template": "t", "logs": 2}
+        ],
+    }
+
+    # When it is finished twice, as after an interrupted run
+    await retention._finish_batch(batch)
+    await retention._finish_batch(batch)
+
+    # Then the summary & hourly count are guarded by the batch id
+    token: str = str(batch["_id"])
+    key: dict[str, Any] = {"hour": hour, "node": "a", "severity": "INFO"}
+    assert (
+        collections[LogSummary].requests
+        == [db.guarded_inc({**key, "template": "t"}, {"logs": 2}, token)] * 2
+    )
+    assert (
+        collections[HourlyCount].requests
+        == [db.guarded_inc(key, {"logs": -2}, token)] * 2
+    )
+    # And the logs & the batch are deleted after them
+    assert collections[JavaLog].deletes == [{"_id": {"$in": batch["ids"]}}] * 2
+    assert collections[ExpiryBatch].deletes == [{"_id": batch["_id"]}] * 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.db
+async def test_apply_retention_rolls_up_and_deletes(
+    motor_conn: tuple[str, str],
+) -> None:
+    # Given a motor_conn & database
+    database: str
+    conn: str
+    database, conn = motor_conn
+
+    try:
+        client: AsyncIOMotorClient = await db.init(database, conn)
+
+        # And an old & a recent INFO log
+        logs: list[LogRecord] = [
+            LogRecord("node", "INFO", None, timestamp, None, None, f"id {i}")
+            for i, timestamp in enumerate(
+                [datetime(2022, 7, 1, 9, 5), datetime(2022, 7, 30, 9, 5)]
+            )
+        ]
+        await db.insert_logs(logs, database)
+
+        # When it applies a 14 day retention
+        await retention.apply_retention({"INFO": 14}, 10, now=datetime(2022, 8, 1))
+
+        # Then only the recent log is kept
+        remaining: list[JavaLog] = await JavaLog.find({}).to_list()
+        assert [log.message for log in remaining] == ["id 1"]
+        assert isinstance(remaining[0].id, ObjectId)
+
+        # And the old log is counted in its hourly summary
+        summaries: list[LogSummary] = await LogSummary.find({}).to_list()
+        assert [(s.hour, s.template, s.logs) for s in summaries] == [
+            (datetime(2022, 7, 1, 9), "id <num>", 1)
+        ]
+
+    finally:
+        client = await db.init(database, conn)
+        await client.drop_database(database)
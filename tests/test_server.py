@@ -0,0 +1,292 @@
+import asyncio
+import json
+from datetime import datetime
+from http import HTTPStatus
+from typing import Any, AsyncIterator
+
+import bson
+import pytest
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+from aggregator import db, server
+from aggregator.cache import ResultCache
+from aggregator.model import JavaLog
+
+log_id: ObjectId = ObjectId("608da169eb9e17281f0ab2ff")
+document: dict[str, Any] = {
+    "_id": log_id,
+    "node": "node",
+    "severity": "ERROR",
+    "jvm": "jvm 1",
+    "datetime": datetime(2022, 7, 11, 9, 12, 2),
+    "message": "FileIO",
+}
+
+
+class FakeDb:
+    # Stands in for the db functions the server calls, counting queries
+    def __init__(self) -> None:
+        self.watermark: tuple[int, str | None] = (1, str(log_id))
+        self.queries: list[tuple[Any, ...]] = []
+
+    async def ingest_watermark(self) -> tuple[int, str | None]:
+        return self.watermark
+
+    async def stream_logs(self, *args) -> AsyncIterator[RawBSONDocument]:
+        self.queries.append(args)
+        yield RawBSONDocument(bson.encode(document))
+
+    async def count_logs(self, *args) -> list[tuple[Any, int]]:
+        self.queries.append(args)
+        return [("ERROR", 3), ("INFO", 2)]
+
+    async def get_log(self, object_id) -> JavaLog | None:
+        self.queries.append((object_id,))
+        if object_id != log_id:
+            return None
+        fields: dict[str, Any] = {k: v for k, v in document.items() if k != "_id"}
+        return JavaLog.model_construct(id=log_id, revision_id=None, **fields)
+
+
+@pytest.fixture()
+def fake_db(monkeypatch: pytest.MonkeyPatch) -> FakeDb:
+    fake: FakeDb = FakeDb()
+    for name in ["ingest_watermark", "stream_logs", "count_logs", "get_log"]:
+        monkeypatch.setattr(db, name, getattr(fake, name))
+    return fake
+
+
+@pytest.fixture()
+def query_server() -> server.QueryServer:
+    return server.QueryServer(ResultCache(8, 60.0), watermark_interval=0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_logs(fake_db: FakeDb, query_server: server.QueryServer) -> None:
+    # Given a query for a node's errors & warnings in a window
+    target: str = (
+        "/logs?node=node&severity=WARN&severity=ERROR"
+        "&start=2022-07-11T09:00:00&limit=10"
+    )
+
+    # When it is answered
+    status: HTTPStatus
+    body: bytes
+    status, body = await query_server.respond("GET", target)
+
+    # Then the matching logs come back as JSON
+    assert status == HTTPStatus.OK
+    assert json.loads(body) == {
+        "count": 1,
+        "logs": [
+            {
+                "_id": str(log_id),
+                "node": "node",
+                "severity": "ERROR",
+                "jvm": "jvm 1",
+                "datetime": "2022-07-11T09:12:02",
+                "message": "FileIO",
+            }
+        ],
+    }
+    assert fake_db.queries == [
+        (
+            {"node": "node", "severity": {"$in": ["ERROR", "WARN"]}},
+            "-datetime",
+            datetime(2022, 7, 11, 9),
+            None,
+            10,
+        )
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_logs_by_origin(
+    monkeypatch: pytest.MonkeyPatch, fake_db: FakeDb, query_server: server.QueryServer
+) -> None:
+    # Given log files of a service on a host
+    async def _find_log_file_ids(*args) -> list[ObjectId]:
+        return [log_id]
+
+    monkeypatch.setattr(db, "find_log_file_ids", _find_log_file_ids)
+
+    # When logs are asked for by that origin
+    status: HTTPStatus
+    status, _ = await query_server.respond(
+        "GET", "/logs?service=fanapiservice&fqdn=host.example.com&collection=1"
+    )
+
+    # Then they are matched by log file
+    assert status == HTTPStatus.OK
+    assert fake_db.queries[0][0] == {"log_file": {"$in": [log_id]}}
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_repeated_query_is_cached(
+    fake_db: FakeDb, query_server: server.QueryServer
+) -> None:
+    # Given a query that was answered
+    await query_server.respond("GET", "/stats?by=severity&severity=ERROR&node=n")
+
+    # When the same filters are asked for again in another order
+    second: tuple[HTTPStatus, bytes] = await query_server.respond(
+        "GET", "/stats?node=n&severity=ERROR"
+    )
+
+    # Then they are answered from the cache without a query
+    assert json.loads(second[1]) == {
+        "by": "severity",
+        "total": 5,
+        "counts": [{"severity": "ERROR", "logs": 3}, {"severity": "INFO", "logs": 2}],
+    }
+    assert len(fake_db.queries) == 1
+    assert query_server.cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_limit_is_capped(fake_db: FakeDb) -> None:
+    # Given a server capping queries at 50 logs
+    query_server: server.QueryServer = server.QueryServer(
+        ResultCache(8, 60.0), watermark_interval=0, max_limit=50
+    )
+
+    # When every log or more than the cap is asked for
+    await query_server.respond("GET", "/logs?limit=0")
+    await query_server.respond("GET", "/logs?limit=500")
+
+    # Then both load at most the cap & share its cache entry
+    assert [query[-1] for query in fake_db.queries] == [50]
+    assert query_server.cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_ingest_invalidates_cache(
+    fake_db: FakeDb, query_server: server.QueryServer
+) -> None:
+    # Given a cached query
+    await query_server.respond("GET", "/logs?severity=ERROR")
+
+    # When logs are ingested & it is asked for again
+    fake_db.watermark = (2, str(ObjectId()))
+    await query_server.respond("GET", "/logs?severity=ERROR")
+
+    # Then it is queried again
+    assert len(fake_db.queries) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_watermark_is_throttled(fake_db: FakeDb) -> None:
+    # Given a server that reads the watermark at most every minute
+    query_server: server.QueryServer = server.QueryServer(ResultCache(), 60.0)
+    await query_server.respond("GET", "/logs")
+
+    # When logs are ingested within the minute
+    fake_db.watermark = (2, str(ObjectId()))
+    await query_server.respond("GET", "/logs")
+
+    # Then the cached result is still served
+    assert len(fake_db.queries) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_get_log(fake_db: FakeDb, query_server: server.QueryServer) -> None:
+    # Given a stored log
+    # When it is fetched by id
+    status: HTTPStatus
+    body: bytes
+    status, body = await query_server.respond("GET", f"/logs/{log_id}")
+
+    # Then it is returned & a missing or malformed id is an error
+    assert status == HTTPStatus.OK
+    assert json.loads(body)["_id"] == str(log_id)
+    assert json.loads(body)["datetime"] == "2022-07-11T09:12:02"
+    with pytest.raises(server.HTTPError) as missing:
+        await query_server.respond("GET", f"/logs/{ObjectId()}")
+    assert missing.value.status == HTTPStatus.NOT_FOUND
+    with pytest.raises(server.HTTPError) as malformed:
+        await query_server.respond("GET", "/logs/nope")
+    assert malformed.value.status == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+@pytest.mark.parametrize(
+    "method,target,status",
+    [
+        ("POST", "/logs", HTTPStatus.METHOD_NOT_ALLOWED),
+        ("GET", "/nope", HTTPStatus.NOT_FOUND),
+        ("GET", "/logs?severity=DEBUG", HTTPStatus.BAD_REQUEST),
+        ("GET", "/logs?limit=-1", HTTPStatus.BAD_REQUEST),
+        ("GET", "/logs?collection=x", HTTPStatus.BAD_REQUEST),
+        ("GET", "/logs?start=yesterday", HTTPStatus.BAD_REQUEST),
+        ("GET", "/logs?node=a&node=b", HTTPStatus.BAD_REQUEST),
+        ("GET", "/stats?by=message", HTTPStatus.BAD_REQUEST),
+    ],
+)
+async def test_bad_requests(
+    fake_db: FakeDb,
+    query_server: server.QueryServer,
+    method: str,
+    target: str,
+    status: HTTPStatus,
+) -> None:
+    # Given a request the server cannot answer
+    # When it is routed
+    # Then it is refused with the matching status & nothing is queried
+    with pytest.raises(server.HTTPError) as err:
+        await query_server.respond(method, target)
+    assert err.value.status == status
+    assert not fake_db.queries
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+@pytest.mark.mock
+async def test_handle_over_http(
+    fake_db: FakeDb, query_server: server.QueryServer
+) -> None:
+    # Given a listening server
+    listener: asyncio.Server = await asyncio.start_server(
+        query_server.handle, "127.0.0.1", 0
+    )
+    port: int = listener.sockets[0].getsockname()[1]
+
+    async def _get(target: str) -> bytes:
+        reader: asyncio.StreamReader
+        writer: asyncio.StreamWriter
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response: bytes = await reader.read()
+        writer.close()
+        return response
+
+    # When it is sent a request & a bad one
+    async with listener:
+        health: bytes = await _get("/health")
+        bad: bytes = await _get("/logs?severity=DEBUG")
+
+    # Then each gets a JSON response with its status
+    head: bytes
+    body: bytes
+    head, body = health.split(b"\r\n\r\n", 1)
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert f"Content-Length: {len(body)}".encode() in head
+    assert json.loads(body)["status"] == "ok"
+    assert bad.startswith(b"HTTP/1.1 400 Bad Request")
+    assert "severity" in json.loads(bad.split(b"\r\n\r\n", 1)[1])["error"]
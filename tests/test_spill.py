@@ -0,0 +1,107 @@
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+from bson import ObjectId
+
+from aggregator import spill
+
+
+def _documents(start: int, count: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "_id": ObjectId(),
+            "node": "node",
+            "datetime": datetime(2022, 7, 11, 9, 12, i),
+            "message": f"log {i}",
+        }
+        for i in range(start, start + count)
+    ]
+
+
+@pytest.mark.unit
+def test_spill_queue_reads_in_order_until_commit(tmp_path: Path) -> None:
+    # Given a queue with two appended batches
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path)
+    documents: list[dict[str, Any]] = _documents(0, 5)
+    queue.put(documents[:3])
+    queue.put(documents[3:])
+
+    # When it reads without committing
+    # Then the same documents are read again, with their ids
+    assert queue.get(2) == documents[:2]
+    assert queue.get(2) == documents[:2]
+
+    # And a commit moves the cursor past them
+    queue.commit()
+    assert queue.get(10) == documents[2:]
+    queue.commit()
+    assert queue.get(10) == []
+    assert queue.pending() == 0
+
+
+@pytest.mark.unit
+def test_spill_queue_rotates_and_drops_drained_segments(tmp_path: Path) -> None:
+    # Given a queue with tiny segments
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path, segment_size=1)
+    documents: list[dict[str, Any]] = _documents(0, 3)
+
+    # When a batch is appended after each batch
+    for document in documents:
+        queue.put([document])
+
+    # Then each batch starts a new segment
+    assert len(queue.segments()) == 3
+
+    # And segments are dropped once fully read & committed
+    assert queue.get(2) == documents[:2]
+    queue.commit()
+    assert [segment.name for segment in queue.segments()] == ["000000000002.bson"]
+
+    # But the head segment is kept for the next batch
+    queue.get(1)
+    queue.commit()
+    assert [segment.name for segment in queue.segments()] == ["000000000002.bson"]
+    queue.put(_documents(3, 1))
+    assert [segment.name for segment in queue.segments()][-1] == "000000000003.bson"
+
+
+@pytest.mark.unit
+def test_spill_queue_survives_restart(tmp_path: Path) -> None:
+    # Given a queue with a committed & an uncommitted read
+    queue: spill.SpillQueue = spill.SpillQueue(tmp_path)
+    documents: list[dict[str, Any]] = _documents(0, 4)
+    queue.put(documents)
+    queue.get(1)
+    queue.commit()
+    queue.get(2)
+
+    # And a torn write at the end of its segment
+    with open(queue.segments()[-1], "ab") as file:
+        file.write(b"\x40\x00\x00\x00torn")
+
+    # When the process restarts
+    restarted: spill.SpillQueue = spill.SpillQueue(tmp_path)
+
+    # Then it resumes from the committed cursor without the torn write
+    assert restarted.get(10) == documents[1:]
+    assert json.loads(Path(tmp_path, spill.CURSOR_FILE).read_text())["offset"] > 0
+
+    # And new batches go to a new segment after the old one
+    restarted.commit()
+    restarted.put(_documents(4, 1))
+    assert restarted.get(10)[0]["message"] == "log 4"
+
+
+@pytest.mark.unit
+def test_spill_queue_empty(tmp_path: Path) -> None:
+    # Given a queue whose directory does not exist yet
+    queue: spill.SpillQueue = spill.SpillQueue(Path(tmp_path, "spill"))
+
+    # When it reads
+    # Then there is nothing queued
+    assert queue.segments() == []
+    assert queue.get(10) == []
+    assert queue.pending() == 0
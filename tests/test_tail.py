@@ -0,0 +1,182 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from aggregator import convert, tail
+from aggregator.model import LogRecord
+
+first_log: str = "INFO | jvm 1 | 2022/07/11 09:12:55 | This is a log"
+error_log: str = "ERROR | jvm 1 | 2022/07/11 09:12:56 | An error"
+second_log: str = "INFO | jvm 1 | 2022/07/11 09:12:57 | And another log"
+
+
+@pytest.fixture()
+def live_log(tmp_path: Path) -> Path:
+    log_file: Path = Path(tmp_path, "svc.log")
+    log_file.write_text(f"{first_log}\n")
+    return log_file
+
+
+def _append(log_file: Path, text: str) -> None:
+    with open(log_file, "a") as file:
+        file.write(text)
+
+
+@pytest.mark.unit
+def test_line_stitcher_holds_open_record() -> None:
+    # Given a stitcher
+    stitcher: convert.LineStitcher = convert.LineStitcher()
+
+    # When it is fed a record and its continuation lines
+    # Then nothing is returned until the next severity line
+    assert stitcher.feed(error_log) is None
+    assert stitcher.feed("  with multiple lines") is None
+    assert stitcher.feed("") is None
+    assert stitcher.feed(second_log) == f"{error_log}; with multiple lines"
+
+    # And the last record is returned on flush
+    assert stitcher.flush() == second_log
+    assert stitcher.flush() is None
+
+
+@pytest.mark.unit
+def test_tail_reader_starts_at_end(live_log: Path) -> None:
+    # Given a reader following a live log
+    reader: tail.TailReader = tail.TailReader(live_log)
+
+    # When it reads for the first time
+    # Then it skips what is already there
+    assert reader.read_lines() == []
+
+    # And it returns only complete appended lines
+    _append(live_log, f"{second_log}\nINFO | half a li")
+    assert reader.read_lines() == [second_log]
+    _append(live_log, "ne\n")
+    assert reader.read_lines() == ["INFO | half a line"]
+    reader.close()
+
+
+@pytest.mark.unit
+def test_tail_reader_from_start(live_log: Path) -> None:
+    # Given a reader asked to read a log from the start
+    reader: tail.TailReader = tail.TailReader(live_log, from_start=True)
+
+    # When it reads
+    # Then it returns the existing lines
+    assert reader.read_lines() == [first_log]
+    reader.close()
+
+
+@pytest.mark.unit
+def test_tail_reader_follows_rotation(live_log: Path) -> None:
+    # Given a reader following a live log
+    reader: tail.TailReader = tail.TailReader(live_log)
+    reader.read_lines()
+
+    # When the log gets a last line & is rotated to .log1
+    _append(live_log, f"{error_log}\n")
+    os.rename(live_log, f"{live_log}1")
+    live_log.write_text(f"{second_log}\n")
+
+    # Then the rest of the old file is read before the new file
+    assert reader.read_lines() == [error_log, second_log]
+    reader.close()
+
+
+@pytest.mark.unit
+def test_tail_reader_handles_truncation(live_log: Path) -> None:
+    # Given a reader following a live log
+    reader: tail.TailReader = tail.TailReader(live_log)
+    reader.read_lines()
+
+    # When the log is truncated & rewritten in place
+    live_log.write_text("INFO | new log\n")
+
+    # Then it is read from the start again
+    assert reader.read_lines() == ["INFO | new log"]
+    reader.close()
+
+
+@pytest.mark.unit
+def test_tail_reader_waits_for_missing_file(tmp_path: Path) -> None:
+    # Given a reader for a log that does not exist yet
+    log_file: Path = Path(tmp_path, "svc.log")
+    reader: tail.TailReader = tail.TailReader(log_file)
+    assert reader.read_lines() == []
+
+    # When the log appears
+    log_file.write_text(f"{first_log}\n")
+
+    # Then it is read from the start
+    assert reader.read_lines() == [first_log]
+    reader.close()
+
+
+@pytest.mark.unit
+def test_log_tailer_closes_record_after_timeout(live_log: Path) -> None:
+    # Given a tailer with a record timeout
+    tailer: tail.LogTailer = tail.LogTailer(live_log, record_timeout=2.0)
+    tailer.poll(0.0)
+
+    # When a multiline record is appended
+    _append(live_log, f"{error_log}\nwith multiple lines\n")
+
+    # Then it is held open while more lines may follow
+    assert tailer.poll(1.0) == []
+    assert tailer.poll(2.5) == []
+
+    # And it is closed once the timeout passes without a new line
+    logs: list[LogRecord] = tailer.poll(3.5)
+    assert len(logs) == 1
+    assert logs[0].severity == "ERROR"
+    assert logs[0].message == "An error; with multiple lines"
+    assert tailer.close() == []
+
+
+@pytest.mark.unit
+def test_log_tailer_closes_record_on_next_severity(live_log: Path) -> None:
+    # Given a tailer following a live log
+    tailer: tail.LogTailer = tail.LogTailer(live_log, record_timeout=2.0)
+    tailer.poll(0.0)
+
+    # When two records are appended
+    _append(live_log, f"{error_log}\n{second_log}\n")
+
+    # Then the first is returned as soon as the second starts
+    logs: list[LogRecord] = tailer.poll(0.1)
+    assert [log.severity for log in logs] == ["ERROR"]
+
+    # And the open record is returned when the tailer stops
+    logs = tailer.close()
+    assert [log.message for log in logs] == ["And another log"]
+
+
+@pytest.mark.unit
+def test_micro_batch_bounds_latency() -> None:
+    # Given a micro batch of 2 logs with a 1s latency
+    batch: tail.MicroBatch = tail.MicroBatch(batch_size=2, latency=1.0)
+    log: LogRecord = LogRecord(
+        node="node",
+        severity="INFO",
+        jvm="jvm 1",
+        datetime=datetime(2022, 7, 11, 9, 12, 55),
+        source=None,
+        type=None,
+        message="a log",
+    )
+
+    # When a log is added
+    batch.add([log], 10.0)
+
+    # Then it is not due until it has waited for the latency
+    assert not batch.due(10.5)
+    assert batch.due(11.0)
+
+    # And a full batch is due straight away
+    batch.add([log, log], 11.0)
+    assert batch.due(11.0)
+    assert batch.take() == [log, log]
+    assert batch.take() == [log]
+    assert not batch.due(20.0)
@@ -1,8 +1,9 @@
 # import logging
 import io
 import sys
+from datetime import datetime
 from pathlib import Path
-from typing import Literal
+from typing import Any, Literal
 
 import pytest
 from beanie import PydanticObjectId
@@ -10,7 +11,7 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.results import InsertManyResult
 
 from aggregator import config, convert, db, view
-from aggregator.model import JavaLog
+from aggregator.model import JavaLog, LogRecord
 
 module_name: Literal["aggregator.view"] = "aggregator.view"
 
@@ -32,8 +33,10 @@ async def test_view_display_result_one_line_success(
 
     # And a display header
     header: str = (
-        "| ObjectId\t\t\t| Node\t| Severity\t| JVM\t| Timestamp\t| "
-        "Source\t| Type\t| Message\t|\n"
+        "| ObjectId                 | Node | Severity | JVM   | Timestamp           "
+        "| Source   | Type | Message\n"
+        "|--------------------------|------|----------|-------|---------------------"
+        "|----------|------|--------\n"
     )
 
     # And an initialized database
@@ -58,8 +61,8 @@ async def test_view_display_result_one_line_success(
 
         # And the expected output is
         out: str = (
-            f"{header}| {id}\t| node\t| INFO\t| jvm 1\t| "
-            f"2022-07-11 09:12:02\t| ttl.test\t| SMB\t| Exec proxy\t|\n\n"
+            f"{header}| {id} | node | INFO     | jvm 1 | "
+            f"2022-07-11 09:12:02 | ttl.test | SMB  | Exec proxy\n"
         )
 
         # When it tries to display the logs
@@ -110,7 +113,7 @@ async def test_view_display_result_multi_line_success(
         await db.insert_logs(converted_logs)
 
         # And it has a query
-        query: str = JavaLog.node == "node"
+        query: dict[str, Any] = {"node": "node"}
 
         # And it gets the log
         results: list[JavaLog] = await db.find_logs(query, sort=None)
@@ -149,3 +152,75 @@ async def test_view_display_result_multi_line_success(
     finally:
         client = AsyncIOMotorClient(conn)
         await client.drop_database(database)
+
+
+def _record(i: int, message: str = "Exec proxy") -> LogRecord:
+    return LogRecord(
+        node=f"node{i}",
+        severity="INFO",
+        jvm="jvm 1",
+        datetime=datetime(2022, 7, 11, 9, 12, i),
+        source="ttl.test",
+        type=None,
+        message=message,
+    )
+
+
+@pytest.mark.unit
+def test_render_aligns_and_truncates() -> None:
+    # Given records & a raw document with a long source & message
+    rows: list = [
+        _record(1),
+        {"_id": "abc", "node": "node22", "source": "s" * 50, "message": "m" * 30},
+    ]
+    file: io.StringIO = io.StringIO()
+
+    # When they are rendered with narrow limits
+    written: int = view.render(rows, file, max_width=10, message_width=20)
+
+    # Then every column lines up under its header
+    lines: list[str] = file.getvalue().splitlines()
+    assert written == 2
+    assert len(lines) == 4
+    assert {line.rindex("|") for line in lines} == {lines[0].rindex("|")}
+
+    # And values wider than their column are truncated
+    assert "| sssssss... |" in lines[3]
+    assert lines[3].endswith(f"| {'m' * 17}...")
+    assert lines[2].endswith("|      | Exec proxy")
+
+
+@pytest.mark.unit
+def test_render_pages() -> None:
+    # Given 5 records & a reader who stops after the first page
+    pages: list[int] = []
+
+    def more() -> bool:
+        pages.append(1)
+        return False
+
+    file: io.StringIO = io.StringIO()
+
+    # When they are rendered in pages of 2
+    written: int = view.render(
+        (_record(i) for i in range(5)), file, page_size=2, more=more
+    )
+
+    # Then only the first page is written
+    assert written == 2
+    assert pages == [1]
+    assert len(file.getvalue().splitlines()) == 4
+
+
+@pytest.mark.asyncio
+@pytest.mark.unit
+async def test_display_result_streams_rows() -> None:
+    # Given more records than the sample the widths come from
+    file: io.StringIO = io.StringIO()
+    rows: list[LogRecord] = [_record(i % 60) for i in range(2500)]
+
+    # When they are displayed
+    await view.display_result(rows, file=file)
+
+    # Then every row is written
+    assert len(file.getvalue().splitlines()) == 2502
@@ -0,0 +1,176 @@
+import os
+import shutil
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+
+from aggregator import checkpoint, config, extract, helper, main, watch
+
+filename_example: str = "GBLogs_n11_fanapiservice_1657563227839.zip"
+
+
+@pytest.fixture()
+def watcher(tmp_path: Path) -> watch.ArchiveWatcher:
+    return watch.ArchiveWatcher(tmp_path, interval=0.01, debounce=5.0)
+
+
+@pytest.fixture()
+def archive(tmp_path: Path, settings_override: config.Settings) -> Path:
+    src: str = os.path.join(settings_override.get_sourcedir(), filename_example)
+    target: Path = Path(os.path.join(tmp_path, filename_example))
+    shutil.copy(src, target)
+    return target
+
+
+@pytest.mark.unit
+def test_scan_debounces_new_archive(
+    watcher: watch.ArchiveWatcher, archive: Path
+) -> None:
+    # Given a newly written archive
+    mtime: float = os.path.getmtime(archive)
+
+    # When it scans the directory for the first time
+    # Then the archive is held back until it is seen unchanged
+    assert watcher.scan(mtime + 10) == []
+
+    # And it is ready once it has been stable for the debounce period
+    assert watcher.scan(mtime + 10) == [archive]
+
+    # And it is not returned again while it is being ingested
+    assert watcher.scan(mtime + 20) == []
+
+
+@pytest.mark.unit
+def test_finished_archive_survives_restart(archive: Path, tmp_path: Path) -> None:
+    # Given a watcher that finished with an archive
+    checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+        Path(tmp_path, "state", "checkpoint.json")
+    )
+    watcher: watch.ArchiveWatcher = watch.ArchiveWatcher(
+        tmp_path, interval=0.01, debounce=5.0, checkpoints=checkpoints
+    )
+    watcher.finish(archive)
+    checkpoints.close()
+    mtime: float = os.path.getmtime(archive)
+
+    # When a new watcher is started from the same checkpoints
+    restarted: watch.ArchiveWatcher = watch.ArchiveWatcher(
+        tmp_path,
+        interval=0.01,
+        debounce=5.0,
+        checkpoints=checkpoint.CheckpointStore(
+            Path(tmp_path, "state", "checkpoint.json")
+        ),
+    )
+
+    # Then the archive is not picked up again
+    restarted.scan(mtime + 10)
+    assert restarted.scan(mtime + 10) == []
+
+    # And it is forgotten once it leaves the sourcedir
+    os.remove(archive)
+    restarted.scan()
+    assert restarted.done == set()
+    assert restarted.checkpoints is not None
+    assert restarted.checkpoints.archives == {}
+
+
+@pytest.mark.unit
+def test_scan_waits_for_recent_writes(
+    watcher: watch.ArchiveWatcher, archive: Path
+) -> None:
+    # Given an archive modified within the debounce period
+    mtime: float = os.path.getmtime(archive)
+
+    # When it scans twice
+    watcher.scan(mtime + 1)
+
+    # Then it is not ready yet
+    assert watcher.scan(mtime + 1) == []
+
+
+@pytest.mark.unit
+def test_scan_skips_partial_archive(
+    watcher: watch.ArchiveWatcher, archive: Path
+) -> None:
+    # Given an archive that is only partially written
+    with open(archive, "r+b") as f:
+        f.truncate(20)
+    mtime: float = os.path.getmtime(archive)
+
+    # When it scans twice after the debounce period
+    watcher.scan(mtime + 10)
+
+    # Then it is not ready
+    assert watcher.scan(mtime + 10) == []
+    # And it stays pending
+    assert archive in watcher.pending
+
+
+@pytest.mark.unit
+def test_scan_ignores_other_files(
+    watcher: watch.ArchiveWatcher, tmp_path: Path
+) -> None:
+    # Given a file that is not a GBLogs archive
+    other: Path = Path(os.path.join(tmp_path, "notes.txt"))
+    other.write_text("not an archive")
+
+    # When it scans twice
+    watcher.scan()
+
+    # Then it is ignored
+    assert watcher.scan() == []
+    assert watcher.pending == {}
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_changes_polls(
+    monkeypatch: pytest.MonkeyPatch, watcher: watch.ArchiveWatcher
+) -> None:
+    # Given the polling fallback
+    monkeypatch.setattr(watch, "awatch", None)
+
+    # When it iterates over changes
+    changes: AsyncIterator[list[Path]] = watcher.changes()
+
+    # Then it yields a scan immediately & after each interval
+    assert await changes.__anext__() == []
+    assert await changes.__anext__() == []
+    await changes.aclose()  # type: ignore
+
+
+@pytest.mark.unit
+@pytest.mark.mock
+@pytest.mark.asyncio
+async def test_ingest_archive(
+    monkeypatch: pytest.MonkeyPatch,
+    archive: Path,
+    tmp_path: Path,
+    settings_override: config.Settings,
+) -> None:
+    # Given an output dir
+    monkeypatch.setattr(settings_override, "outdir", Path(tmp_path, "out"))
+
+    # And a mock ingest
+    ingested: list[list[extract.ExtractedArchive]] = []
+
+    async def mock_ingest_log_files(log_file_list, *args, **kwargs) -> list[int]:
+        ingested.append(log_file_list)
+        return [3]
+
+    monkeypatch.setattr(main, "_ingest_log_files", mock_ingest_log_files)
+    checkpoints: checkpoint.CheckpointStore = checkpoint.CheckpointStore(
+        Path(tmp_path, "checkpoint.json")
+    )
+
+    # When it ingests the archive
+    inserted: int = await watch._ingest_archive(archive, checkpoints, 10)
+
+    # Then the extracted log is ingested with the info of its archive
+    info: helper.ArchiveInfo | None = helper.get_archive_info(archive)
+    assert info is not None
+    log_dir: Path = Path(tmp_path, "out", str(info.epoch), "n11", "fanapiservice")
+    assert inserted == 3
+    assert ingested == [[(info, [Path(log_dir, "fanapiservice.log")])]]